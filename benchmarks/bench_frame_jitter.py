@@ -0,0 +1,84 @@
+"""Audio frame jitter of a voice client while extractions run in threads, against running them in processes.
+
+A voice client's audio thread has to produce a frame every 20 ms. This simulates that thread with the same
+sleep-until-the-next-deadline loop discord.py's AudioPlayer uses, and records how late every frame is,
+while extraction-like work (JSON decoding and regex matching of info dicts shaped like yt_dlp's)
+runs either on a thread pool, as with the 'thread' extraction backend, or on a process pool,
+as with the 'process' one.
+
+Run from the repository root:
+    python -m benchmarks.bench_frame_jitter
+"""
+import json
+import multiprocessing
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from benchmarks.bench_media_metadata import synthetic_info_dict
+
+
+_FRAME_LENGTH = 0.02
+_DURATION = 5.0
+_WORKERS = 2
+_EXTRACTIONS = 10_000
+
+_PAYLOAD = json.dumps({'entries': [synthetic_info_dict(f"video{i:06d}") for i in range(10)]})
+_ITAG = re.compile(r'itag=(\d+)&')
+
+
+def synthetic_extraction(_):
+    """Decodes a 10-entry playlist response and scans its urls, like parsing an extraction does."""
+    data = json.loads(_PAYLOAD)
+    return sum(len(_ITAG.findall(fmt['url'])) for entry in data['entries'] for fmt in entry['formats'])
+
+
+def audio_thread(lateness: list, stop: threading.Event):
+    frame = bytes(3840)
+    start = time.perf_counter()
+    loops = 0
+    while not stop.is_set():
+        loops += 1
+        # a frame's worth of work, e.g. the copy discord.py makes before sending a packet.
+        bytes(frame)
+        next_time = start + _FRAME_LENGTH * loops
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        lateness.append(max(0.0, time.perf_counter() - next_time) * 1000)
+
+
+def measure(executor=None) -> list:
+    lateness = []
+    stop = threading.Event()
+    player = threading.Thread(target=audio_thread, args=(lateness, stop))
+    player.start()
+    futures = [executor.submit(synthetic_extraction, i) for i in range(_EXTRACTIONS)] if executor else []
+    time.sleep(_DURATION)
+    stop.set()
+    player.join()
+    for future in futures:
+        future.cancel()
+    return lateness
+
+
+def report(name: str, lateness: list):
+    lateness = sorted(lateness)
+    p99 = lateness[int(len(lateness) * 0.99) - 1]
+    late = sum(1 for x in lateness if x > _FRAME_LENGTH * 1000)
+    print(f"{name:<22} frames: {len(lateness):>4} | median: {statistics.median(lateness):6.2f} ms | "
+          f"p99: {p99:6.2f} ms | max: {lateness[-1]:6.2f} ms | later than a frame: {late}")
+
+
+if __name__ == '__main__':
+    report("idle", measure())
+    with ThreadPoolExecutor(_WORKERS) as threads:
+        report("thread extraction", measure(threads))
+        threads.shutdown(wait=True, cancel_futures=True)
+    with ProcessPoolExecutor(_WORKERS, mp_context=multiprocessing.get_context('spawn')) as processes:
+        # warm the workers up first, as the backend's long-lived pool would be.
+        list(processes.map(synthetic_extraction, range(_WORKERS)))
+        report("process extraction", measure(processes))
+        processes.shutdown(wait=True, cancel_futures=True)
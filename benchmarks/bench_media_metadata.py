@@ -0,0 +1,49 @@
+"""Memory benchmark of a queued MediaMetadata entry, against keeping the raw yt_dlp info dict as it used to.
+
+The info dict is synthetic but shaped like what `extract_info` returns for a YouTube video:
+a few dozen formats, thumbnails, and automatic captions in ~150 languages.
+
+Run from the repository root:
+    python -m benchmarks.bench_media_metadata
+"""
+from src.player.youtube.media_metadata import MediaMetadata
+from src.player.youtube.metadata_cache import _approx_size
+
+
+def _format(i):
+    return {
+        'format_id': str(100 + i), 'format_note': 'medium', 'ext': 'webm', 'acodec': 'opus', 'vcodec': 'none',
+        'url': f"https://rr1---sn-abc.googlevideo.com/videoplayback?expire=1700000000&itag={100 + i}&" + "x" * 900,
+        'width': None, 'height': None, 'fps': None, 'tbr': 130.5, 'abr': 130.5, 'asr': 48000, 'filesize': 3_500_000,
+        'quality': 3, 'protocol': 'https', 'container': 'webm_dash', 'audio_ext': 'webm', 'video_ext': 'none',
+        'http_headers': {'User-Agent': 'Mozilla/5.0 ' + 'x' * 100, 'Accept': '*/*', 'Accept-Language': 'en-us'},
+        'downloader_options': {'http_chunk_size': 10485760}, 'format': f"{100 + i} - audio only (medium)",
+    }
+
+
+def synthetic_info_dict(video_id='dQw4w9WgXcQ'):
+    languages = [f"l{i:03d}" for i in range(150)]
+    info = {
+        'id': video_id, 'title': 'A song title', 'duration': 213, 'original_url': f"https://www.youtube.com/watch?v={video_id}",
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}", 'uploader': 'Uploader', 'channel': 'Channel',
+        'channel_id': 'UC' + 'x' * 22, 'view_count': 1_000_000, 'like_count': 10_000, 'upload_date': '20091025',
+        'description': 'Description. ' * 300, 'tags': [f"tag {i}" for i in range(40)], 'categories': ['Music'],
+        'formats': [_format(i) for i in range(30)],
+        'thumbnails': [{'url': f"https://i.ytimg.com/vi/{video_id}/{i}.jpg", 'preference': -i, 'id': str(i)} for i in range(40)],
+        'automatic_captions': {lang: [{'ext': ext, 'url': "https://www.youtube.com/api/timedtext?" + 'x' * 400, 'name': lang}
+                                      for ext in ('json3', 'srv1', 'srv2', 'srv3', 'ttml', 'vtt')] for lang in languages},
+        'subtitles': {},
+        'chapters': None, 'extractor': 'youtube', 'extractor_key': 'Youtube', 'display_id': video_id,
+    }
+    info.update(_format(0))
+    return info
+
+
+if __name__ == '__main__':
+    info = synthetic_info_dict()
+    before = _approx_size(info)
+    after = _approx_size(MediaMetadata(info))
+    print(f"raw info dict kept per entry:  {before / 1024:>10.1f} KiB")
+    print(f"compact MediaMetadata:         {after / 1024:>10.1f} KiB")
+    print(f"reduction:                     {before / after:>10.1f}x")
+    print(f"a 1000-entry playlist:         {before * 1000 / 2 ** 20:>6.1f} MiB -> {after * 1000 / 2 ** 20:.1f} MiB")
@@ -0,0 +1,118 @@
+"""Microbenchmarks of MediaQueue against the plain list GuildSession.queue used to be.
+
+Run from the repository root:
+    python -m benchmarks.bench_media_queue
+"""
+import random
+from timeit import default_timer
+
+from src.player.media_queue import MediaQueue
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+QUEUE_SIZE = 10_000
+
+
+def _entries(n):
+    return [MediaMetadata({'id': f"id{i:06d}", 'title': f"Song {i}", 'duration': random.randint(60, 600)})
+            for i in range(n)]
+
+
+def _timed(func):
+    start = default_timer()
+    func()
+    return default_timer() - start
+
+
+def bench_drain(entries):
+    as_list = list(entries)
+    as_queue = MediaQueue(entries)
+
+    def drain_list():
+        while as_list:
+            as_list.pop(0)
+
+    def drain_queue():
+        while as_queue:
+            as_queue.popleft()
+
+    return _timed(drain_list), _timed(drain_queue)
+
+
+def bench_enqueue_with_total(entries):
+    """Adding entries one by one, checking the total play time on each - what play() does per request."""
+    as_list = []
+    as_queue = MediaQueue()
+
+    def enqueue_list():
+        for entry in entries:
+            sum(int(i.duration) for i in as_list)
+            as_list.append(entry)
+
+    def enqueue_queue():
+        for entry in entries:
+            as_queue.duration
+            as_queue.append(entry)
+
+    return _timed(enqueue_list), _timed(enqueue_queue)
+
+
+def bench_membership(entries):
+    as_list = list(entries)
+    as_queue = MediaQueue(entries)
+    probes = random.sample(entries, 1000)
+
+    def probe_list():
+        for entry in probes:
+            entry in as_list
+
+    def probe_queue():
+        for entry in probes:
+            entry in as_queue
+
+    return _timed(probe_list), _timed(probe_queue)
+
+
+def bench_retry_front(entries):
+    """Putting the current entry back to the front, as retry_play does."""
+    as_list = list(entries)
+    as_queue = MediaQueue(entries)
+
+    def retry_list():
+        for _ in range(1000):
+            as_list.insert(0, as_list.pop(0))
+
+    def retry_queue():
+        for _ in range(1000):
+            as_queue.appendleft(as_queue.popleft())
+
+    return _timed(retry_list), _timed(retry_queue)
+
+
+def bench_shuffle_and_index(entries):
+    as_list = list(entries)
+    as_queue = MediaQueue(entries)
+
+    def list_ops():
+        random.shuffle(as_list)
+        for i in range(len(as_list)):
+            as_list[i]
+
+    def queue_ops():
+        as_queue.shuffle()
+        for i in range(len(as_queue)):
+            as_queue[i]
+
+    return _timed(list_ops), _timed(queue_ops)
+
+
+if __name__ == '__main__':
+    entries = _entries(QUEUE_SIZE)
+    print(f"{QUEUE_SIZE} entries{'':<22}{'list':>12}{'MediaQueue':>14}")
+    for name, bench in [("drain from the front", bench_drain),
+                        ("enqueue + total play time", bench_enqueue_with_total),
+                        ("1000 membership checks", bench_membership),
+                        ("1000 retries to the front", bench_retry_front),
+                        ("shuffle + indexed walk", bench_shuffle_and_index)]:
+        as_list, as_queue = bench(entries)
+        print(f"{name:<36}{as_list * 1000:>10.2f}ms{as_queue * 1000:>12.2f}ms")
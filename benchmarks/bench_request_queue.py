@@ -0,0 +1,105 @@
+"""Throughput of play requests: the asyncio RequestQueue against the polling queue and Vault it replaced.
+
+The old pipeline resolved one request at a time, and every play command polled the Vault once a second
+for its result. RequestQueue resolves up to REQUEST_CONCURRENCY requests at a time, commits them in
+arrival order, and hands each command its result through a future. Extractions are simulated with
+sleeps of 0.2 to 0.8 seconds, so only the queueing differs.
+
+Run from the repository root:
+    python -m benchmarks.bench_request_queue
+"""
+import asyncio
+import random
+import statistics
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from src.cogs.player import Job, RequestQueue
+from src.player.load_options import JobOption
+
+
+_BURST = 12
+_SEED = 3
+
+
+class PollingRequestQueue:
+    """The request queue as it was: one request resolved at a time, its command polling a vault every second."""
+    _POLL_INTERVAL = 1
+
+    def __init__(self, resolve):
+        self._resolve = resolve
+        self._on_hold = deque()
+        self._vault = deque()
+        self._processing = False
+
+    async def play(self, work):
+        self._on_hold.append(work)
+        if not self._processing:
+            self._processing = True
+            asyncio.create_task(self._process_requests())
+        while not self._vault:
+            await asyncio.sleep(self._POLL_INTERVAL)
+        return self._vault.popleft()
+
+    async def _process_requests(self):
+        while self._on_hold:
+            self._vault.append(await self._resolve(self._on_hold.popleft()))
+        self._processing = False
+
+
+async def _extract(latency):
+    await asyncio.sleep(latency)
+    return [latency]
+
+
+async def _timed(coro):
+    started_at = time.perf_counter()
+    await coro
+    return time.perf_counter() - started_at
+
+
+async def bench_polling(latencies):
+    queue = PollingRequestQueue(_extract)
+    return await asyncio.gather(*(_timed(queue.play(latency)) for latency in latencies))
+
+
+async def bench_pipeline(latencies):
+    async def resolve(client, job, selector_choice):
+        return await _extract(job.work)
+
+    RequestQueue._resolve = staticmethod(resolve)
+    queue = RequestQueue()
+    ctx = SimpleNamespace(guild=SimpleNamespace(id=1))
+
+    def play(latency):
+        return queue.add_new_request(None, Job(JobOption.ACCESS_JOB, latency, ctx), lambda guild_id: True,
+                                     lambda job, data: data, None)
+
+    return await asyncio.gather(*(_timed(play(latency)) for latency in latencies))
+
+
+def _report(name, durations, elapsed):
+    durations = sorted(durations)
+    print(f"{name:>10}: {len(durations) / elapsed:5.2f} requests/s | "
+          f"latency p50 {statistics.median(durations):.2f}s, "
+          f"p95 {durations[int(len(durations) * 0.95) - 1]:.2f}s, max {durations[-1]:.2f}s")
+
+
+def main():
+    rng = random.Random(_SEED)
+    latencies = [rng.uniform(0.2, 0.8) for _ in range(_BURST)]
+    print(f"{_BURST} requests at once, {sum(latencies):.2f}s of extraction in total")
+    for name, bench in (('polling', bench_polling), ('pipeline', bench_pipeline)):
+        started_at = time.perf_counter()
+        durations = asyncio.run(bench(latencies))
+        _report(name, durations, time.perf_counter() - started_at)
+
+    print("one request at a time")
+    for name, bench in (('polling', bench_polling), ('pipeline', bench_pipeline)):
+        durations = [asyncio.run(bench([latency]))[0] for latency in latencies[:4]]
+        _report(name, durations, sum(durations))
+
+
+if __name__ == '__main__':
+    main()
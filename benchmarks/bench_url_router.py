@@ -0,0 +1,105 @@
+"""Link routing benchmark: the precompiled router against the regexes is_valid_link used to run per call,
+plus how often the old `"list" in url` check took a video link for a playlist.
+
+The corpus is generated offline but follows the shapes of links users paste: watch links with tracking
+parameters, youtu.be share links, music.youtube.com, shorts, playlists opened at an entry,
+bilibili links, and plain search queries. A second corpus links every video several equivalent ways
+(youtu.be, watch?v=, music.youtube.com, shorts), which should all share one cache key.
+
+Run from the repository root:
+    python -m benchmarks.bench_url_router
+"""
+import random
+import re
+import string
+import timeit
+
+from src.player.youtube.verify_link import route
+
+
+_OLD_YOUTUBE_VALID_LINK_REGEX = r'^((?:https?:)?\/\/)?((?:www|m)\.)?((?:youtube\.com|youtu.be))(\/(?:[\w\-]+\?v=|embed\/|v\/)?)([\w\-]+)(\S+)?$'
+_OLD_BILIBILI_VALID_LINK_REGEX = r'''(?x)
+                    https?://
+                        (?:(?:www|bangumi)\.)?
+                        bilibili\.(?:tv|com)/
+                        (?:
+                            (?:
+                                video/[aA][vV]|
+                                anime/(?P<anime_id>\d+)/play\#
+                            )(?P<id>\d+)|
+                            (s/)?video/[bB][vV](?P<id_bv>[^/?#&]+)
+                        )
+                        (?:/?\?p=(?P<page>\d+))?
+                    '''
+
+_ID_CHARS = string.ascii_letters + string.digits + '-_'
+_WORDS = ['lofi', 'hip', 'hop', 'radio', 'beats', 'to', 'relax', 'study', 'official', 'video', 'live', 'remix',
+          'playlist', 'chill', 'mix', 'best', 'of', 'anime', 'opening', 'full', 'album', 'piano', 'cover']
+
+
+def old_is_valid_link(link: str) -> bool:
+    return bool(re.search(_OLD_YOUTUBE_VALID_LINK_REGEX, link)) or bool(re.search(_OLD_BILIBILI_VALID_LINK_REGEX, link))
+
+
+def _id(rng, length=11):
+    return ''.join(rng.choice(_ID_CHARS) for _ in range(length))
+
+
+def corpus(size=100_000, seed=7):
+    rng = random.Random(seed)
+    shapes = [
+        lambda: f"https://www.youtube.com/watch?v={_id(rng)}",
+        lambda: f"https://www.youtube.com/watch?v={_id(rng)}&ab_channel={rng.choice(_WORDS).title()}List",
+        lambda: f"https://youtu.be/{_id(rng)}?si={_id(rng, 16)}",
+        lambda: f"https://youtu.be/{_id(rng)}?t={rng.randint(1, 600)}",
+        lambda: f"https://music.youtube.com/watch?v={_id(rng)}&feature=share",
+        lambda: f"https://www.youtube.com/shorts/{_id(rng)}",
+        lambda: f"https://m.youtube.com/watch?v={_id(rng)}&pp={_id(rng, 8)}",
+        lambda: f"https://www.youtube.com/playlist?list=PL{_id(rng, 32)}",
+        lambda: f"https://www.youtube.com/watch?v={_id(rng)}&list=PL{_id(rng, 32)}&index={rng.randint(1, 200)}",
+        lambda: f"https://www.bilibili.com/video/BV{_id(rng, 10)}?p={rng.randint(1, 9)}",
+        lambda: f"https://www.bilibili.com/video/av{rng.randint(10 ** 6, 10 ** 9)}",
+        lambda: ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(2, 6))),
+    ]
+    return [rng.choice(shapes)() for _ in range(size)]
+
+
+def equivalent_links(videos=10_000, seed=11):
+    """The same videos linked several ways, as different users share them."""
+    rng = random.Random(seed)
+    shapes = [
+        lambda video_id: f"https://www.youtube.com/watch?v={video_id}",
+        lambda video_id: f"https://youtube.com/watch?v={video_id}&ab_channel={rng.choice(_WORDS).title()}",
+        lambda video_id: f"https://youtu.be/{video_id}?si={_id(rng, 16)}",
+        lambda video_id: f"https://music.youtube.com/watch?v={video_id}&feature=share",
+        lambda video_id: f"https://m.youtube.com/watch?v={video_id}",
+        lambda video_id: f"https://www.youtube.com/shorts/{video_id}",
+    ]
+    links = []
+    for _ in range(videos):
+        video_id = _id(rng)
+        links.extend(shape(video_id) for shape in rng.sample(shapes, rng.randint(2, len(shapes))))
+    return videos, links
+
+
+if __name__ == '__main__':
+    links = corpus()
+    old = timeit.timeit(lambda: [old_is_valid_link(link) for link in links], number=1)
+    new = timeit.timeit(lambda: [route(link) for link in links], number=1)
+    print(f"{len(links)} links")
+    print(f"old is_valid_link:          {old * 1000:8.1f} ms ({old / len(links) * 1e6:.2f} us per link)")
+    print(f"route:                      {new * 1000:8.1f} ms ({new / len(links) * 1e6:.2f} us per link)")
+
+    routed = [(link, route(link)) for link in links]
+    disagree_valid = sum(1 for link, info in routed if old_is_valid_link(link) != (info is not None))
+    wrong_playlist = sum(1 for link, info in routed
+                         if info is not None and ("list" in link) != info.is_playlist)
+    keys = {info.cache_key for _, info in routed if info is not None}
+    print(f"links old and new disagree on being links: {disagree_valid}")
+    print(f"links the old check took for the wrong kind (video/playlist): {wrong_playlist}")
+    print(f"distinct cache keys: {len(keys)} for {sum(1 for _, info in routed if info is not None)} links")
+
+    videos, links = equivalent_links()
+    keys = {route(link).cache_key for link in links}
+    print(f"{len(links)} equivalent links to {videos} videos: {len(set(links))} distinct links, "
+          f"{len(keys)} distinct cache keys")
@@ -8,3 +8,91 @@ MUSIC_STORAGE = os.path.join(ROOT_FOLDER, "music_storage")
 
 MAX_MSG_EMBED_SIZE = 1024
 CONFIG_FILE_LOC = "config.ini"
+# guild settings are kept here; CONFIG_FILE_LOC is only read once, to import the settings kept there before.
+CONFIG_DB_LOC = "config.db"
+# how long changed settings are held in memory before they are written, in seconds.
+SETTINGS_FLUSH_DELAY = 2
+# each guild's queue and playback position are snapshotted here, so a restart or a reload of the player resumes them.
+SESSION_DB_LOC = "sessions.db"
+# how often changed and playing sessions are snapshotted, in seconds.
+SESSION_SNAPSHOT_INTERVAL = 10
+# snapshots older than this are dropped on startup, in seconds.
+SESSION_MAX_AGE = 7 * 24 * 3600
+# a session not connected to voice is compacted into its snapshot once it has been unused for this long, in seconds,
+# or, least recently used first, while the sessions in memory hold more bytes than the budget.
+SESSION_IDLE_TIMEOUT = 30 * 60
+SESSION_MEMORY_BUDGET = 64 * 1024 * 1024
+# how often sessions are checked for compaction, in seconds.
+SESSION_SWEEP_INTERVAL = 60
+# how long the bot stays in a voice channel without a listener that is not a bot, in minutes.
+ALONE_DISCONNECT_MINUTES = 5
+
+# metadata cache
+METADATA_CACHE_MAX_BYTES = 64 * 1024 * 1024
+METADATA_CACHE_DEFAULT_TTL = 3600
+STREAM_URL_EXPIRY_MARGIN = 300
+
+# sharding - the launcher starts SHARD_PROCESSES bot processes, each running its share of SHARD_COUNT shards.
+# None asks Discord for the recommended shard count.
+SHARD_COUNT = None
+SHARD_PROCESSES = os.cpu_count() or 1
+# set by the launcher for each bot process it starts.
+SHARD_COUNT_ENV = "MUSICPLAYERBOT_SHARD_COUNT"
+SHARD_IDS_ENV = "MUSICPLAYERBOT_SHARD_IDS"
+SHARD_PROCESSES_ENV = "MUSICPLAYERBOT_PROCESSES"
+# the bot processes on the host share the metadata cache and the audio store through this database and these locks.
+COORDINATOR_DB_LOC = os.path.join(ROOT_FOLDER, "coordinator.db")
+COORDINATOR_LOCK_DIR = os.path.join(ROOT_FOLDER, ".locks")
+
+# audio store
+AUDIO_STORE_QUOTA_BYTES = 2 * 1024 * 1024 * 1024
+AUDIO_STORE_INDEX_FILE = "index.json"
+
+# playback
+OPUS_PASSTHROUGH = True
+LOOP_BUFFER_MAX_BYTES = 8 * 1024 * 1024
+REQUEST_CONCURRENCY = 3
+PLAYLIST_CONCURRENCY = 4
+# opt-in: whether entries that would start more than 6 hours from now are downloaded instead of streamed.
+# off by default, since streams are resolved right before they play and no longer expire while queued.
+DOWNLOAD_LONG_QUEUES = False
+
+# ffmpeg - how many ffmpeg processes may run at once per CPU of the host, split between its bot processes.
+# transcoding ones decode and resample, and cost far more than the ones copying Opus through.
+FFMPEG_PROCESSES_PER_CPU = 8
+FFMPEG_TRANSCODES_PER_CPU = 2
+# prefetching the next track only takes a slot while less than this share of them is in use.
+FFMPEG_PREFETCH_SHARE = 0.75
+# how long a track waits for a free slot before it is given up on, in seconds.
+FFMPEG_ADMISSION_TIMEOUT = 30
+# how often, at most, the ffmpeg processes of a bot process are counted into the coordinator for the host, in seconds.
+FFMPEG_USAGE_PUBLISH_INTERVAL = 1
+
+# metrics - served in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics. None serves none.
+# processes started by launcher.py each serve them on the next port, handed over in METRICS_PORT_ENV.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+METRICS_PORT_ENV = "MUSICPLAYERBOT_METRICS_PORT"
+
+# downloads
+DOWNLOAD_WORKERS = 2
+# a track still being downloaded starts playing from its partial file once this much of it is on disk,
+# as long as the download runs this many times faster than the track plays.
+PROGRESSIVE_MIN_BYTES = 512 * 1024
+PROGRESSIVE_RATE_MARGIN = 1.5
+# how long playback waits on a partial file that stopped growing before it falls back to streaming.
+PROGRESSIVE_STALL_TIMEOUT = 5
+# how long playback waits for the next track's download to become playable before streaming it instead.
+DOWNLOAD_WAIT_TIMEOUT = 15
+
+# yt_dlp
+YDL_POOL_SIZE = 4
+YDL_MAX_USES = 500
+# 'thread' runs yt_dlp in the bot process, 'process' runs it in worker processes, away from the audio threads.
+EXTRACTION_BACKEND = "thread"
+EXTRACTION_PROCESSES = 2
+
+# executors - how many blocking calls of each workload class may run at the same time.
+SEARCH_EXECUTOR_WORKERS = 4
+INFO_EXECUTOR_WORKERS = 4
+DOWNLOAD_EXECUTOR_WORKERS = DOWNLOAD_WORKERS
@@ -0,0 +1,152 @@
+"""Starts the bot as several processes, each running a group of its shards, and restarts the ones that exit.
+
+The processes share the metadata cache and the audio store through the coordinator (see src/player/coordinator.py),
+so a track is extracted and downloaded once per host, not once per process.
+
+Run from the repository root:
+    python launcher.py [--processes N] [--shards N]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import aiohttp
+
+from constants import (ROOT_FOLDER, TOKEN, SHARD_COUNT, SHARD_PROCESSES, SHARD_COUNT_ENV, SHARD_IDS_ENV,
+                       SHARD_PROCESSES_ENV, METRICS_PORT, METRICS_PORT_ENV)
+
+
+_GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# Discord allows max_concurrency shards to identify every 5 seconds.
+_IDENTIFY_INTERVAL = 5
+_RESTART_DELAY = 5
+_MAX_RESTART_DELAY = 300
+_STOP_TIMEOUT = 30
+
+
+async def _gateway_info(token: str) -> Tuple[int, int]:
+    """Gets the recommended shard count of the bot, and how many shards may identify at the same time.
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(_GATEWAY_URL, headers={'Authorization': f"Bot {token}"}) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data['shards'], data.get('session_start_limit', {}).get('max_concurrency', 1)
+
+
+def shard_groups(shard_count: int, processes: int) -> List[List[int]]:
+    """Splits the shards into one group per process, as evenly as they go.
+
+    Args:
+        shard_count (int): How many shards the bot runs.
+        processes (int): How many processes to run them in. No more processes than shards are used.
+
+    Returns:
+        List[List[int]]: The shard ids of each process.
+    """
+    processes = max(1, min(processes, shard_count))
+    return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+
+class Launcher:
+    """Runs one bot process per group of shards, restarting a process that exits with a growing delay.
+    """
+    def __init__(self, groups: List[List[int]], shard_count: int, max_concurrency: int = 1):
+        """
+        Args:
+            groups (List[List[int]]): The shard ids of each process.
+            shard_count (int): How many shards the bot runs in total.
+            max_concurrency (int, optional): How many shards may identify at the same time.
+        """
+        self._groups = groups
+        self._shard_count = shard_count
+        self._identify_interval = _IDENTIFY_INTERVAL / max(1, max_concurrency)
+        self._processes: Dict[int, subprocess.Popen] = {}
+        self._restart_delays: Dict[int, float] = {}
+        self._started_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def _start(self, index: int) -> subprocess.Popen:
+        shard_ids = self._groups[index]
+        env = dict(os.environ)
+        env[SHARD_COUNT_ENV] = str(self._shard_count)
+        env[SHARD_IDS_ENV] = ','.join(map(str, shard_ids))
+        # per-host budgets, e.g. of ffmpeg processes, are split between the processes.
+        env[SHARD_PROCESSES_ENV] = str(len(self._groups))
+        if METRICS_PORT is not None:
+            env[METRICS_PORT_ENV] = str(METRICS_PORT + index)
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT_FOLDER, 'main.py')], cwd=ROOT_FOLDER, env=env)
+        self._started_at[index] = time.monotonic()
+        print(f"Started process {process.pid} for shards {shard_ids}")
+        return process
+
+    def _stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        for index, group in enumerate(self._groups):
+            if self._stopping:
+                break
+            self._processes[index] = self._start(index)
+            # the shards of the next process identify once these had their turn.
+            time.sleep(len(group) * self._identify_interval)
+
+        restart_at: Dict[int, float] = {}
+        while not self._stopping:
+            now = time.monotonic()
+            for index, process in list(self._processes.items()):
+                if index in restart_at:
+                    if now >= restart_at[index]:
+                        del restart_at[index]
+                        self._processes[index] = self._start(index)
+                    continue
+                code = process.poll()
+                if code is not None:
+                    if now - self._started_at[index] > _MAX_RESTART_DELAY:
+                        # it ran fine for a while - the delay starts over.
+                        self._restart_delays.pop(index, None)
+                    delay = self._restart_delays.get(index, _RESTART_DELAY / 2) * 2
+                    self._restart_delays[index] = min(delay, _MAX_RESTART_DELAY)
+                    restart_at[index] = now + self._restart_delays[index]
+                    print(f"Process {process.pid} for shards {self._groups[index]} exited with {code}, "
+                          f"restarting it in {self._restart_delays[index]:.0f}s")
+            time.sleep(1)
+
+        self.shutdown()
+
+    def shutdown(self):
+        """Stops every process, killing the ones that do not stop within _STOP_TIMEOUT seconds.
+        """
+        running = [process for process in self._processes.values() if process.poll() is None]
+        for process in running:
+            # an interrupt lets the bot close, and its sessions be snapshotted, as it does on Ctrl+C.
+            if os.name == 'nt':
+                process.terminate()
+            else:
+                process.send_signal(signal.SIGINT)
+        deadline = time.monotonic() + _STOP_TIMEOUT
+        for process in running:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the bot as one process per group of shards.")
+    parser.add_argument('--processes', type=int, default=SHARD_PROCESSES, help="how many bot processes to run")
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT, help="how many shards to run in total")
+    args = parser.parse_args()
+
+    shard_count, max_concurrency = asyncio.run(_gateway_info(TOKEN))
+    if args.shards is not None:
+        shard_count = args.shards
+    Launcher(shard_groups(shard_count, args.processes), shard_count, max_concurrency).run()
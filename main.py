@@ -1,12 +1,18 @@
 import discord, asyncio
+import os
 from pathlib import Path
-from constants import BOT_PREFIX, TOKEN, MUSIC_STORAGE
-from discord.ext.commands import Bot, is_owner
+from constants import BOT_PREFIX, TOKEN, MUSIC_STORAGE, SHARD_COUNT, SHARD_COUNT_ENV, SHARD_IDS_ENV
+from discord.ext.commands import AutoShardedBot, is_owner
+from src.player.audio_store import AUDIO_STORE
 
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = Bot(command_prefix=BOT_PREFIX, intents = intents)
+# run on its own, the bot runs every shard; started by launcher.py, it runs the shards it was handed.
+shard_count = int(os.environ[SHARD_COUNT_ENV]) if os.environ.get(SHARD_COUNT_ENV) else SHARD_COUNT
+shard_ids = [int(shard_id) for shard_id in os.environ[SHARD_IDS_ENV].split(',')] if os.environ.get(SHARD_IDS_ENV) else None
+
+bot = AutoShardedBot(command_prefix=BOT_PREFIX, intents = intents, shard_count=shard_count, shard_ids=shard_ids)
 bot.remove_command('help')
 client = discord.Client(intents = intents)
 
@@ -15,7 +21,7 @@ extensions = [f"src.cogs.{path.stem}" for path in Path('src/cogs').glob('*.py')]
 
 @bot.event
 async def on_ready():
-    print("The bot is live~")
+    print(f"The bot is live~ (shards {sorted(bot.shards)} of {bot.shard_count})")
 
 
 @bot.command()
@@ -63,17 +69,14 @@ async def error_msg(ctx, extension):
 
 
 if __name__ =='__main__':
-    import glob, os, os.path
-
-    filelist = glob.glob(os.path.join(MUSIC_STORAGE, "*.mp3"))
-    for f in filelist:
-        os.remove(f)
-
     try:
         os.makedirs(MUSIC_STORAGE, mode=0o777)
     except FileExistsError:
         pass
 
+    # downloaded audio is kept across restarts - the store drops whatever is over quota.
+    AUDIO_STORE.load()
+
     for extension in extensions:
         try:
             asyncio.run(bot.load_extension(extension))
@@ -1,213 +1,657 @@
-from discord.ext import commands, tasks
+from discord.ext import commands
 import discord
 import asyncio
-import os
-from copy import deepcopy
-from typing import Union
+import math
+from typing import Dict, List, Set, Tuple, Union
 from datetime import timedelta
-import random
-import inspect
-from yt_dlp import YoutubeDL
+import threading
 import functools
-from timeit import default_timer
-from constants import MUSIC_STORAGE, MAX_MSG_EMBED_SIZE, CONFIG_FILE_LOC, BOT_PREFIX
+import time
+from discord.ext import tasks
+from constants import (MAX_MSG_EMBED_SIZE, CONFIG_DB_LOC, BOT_PREFIX, LOOP_BUFFER_MAX_BYTES,
+                       REQUEST_CONCURRENCY, PLAYLIST_CONCURRENCY, DOWNLOAD_LONG_QUEUES, DOWNLOAD_WAIT_TIMEOUT,
+                       SESSION_SNAPSHOT_INTERVAL, SESSION_SWEEP_INTERVAL, ALONE_DISCONNECT_MINUTES,
+                       FFMPEG_ADMISSION_TIMEOUT)
 from src.player.youtube.verify_link import is_valid_link
 from src.player.youtube.search import SearchVideos
 from src.player.youtube.media_metadata import MediaMetadata
-from src.player.youtube.load_url import LoadURL
-from src.player.youtube.download_media import Downloader, NoVideoInQueueError, isExist, SingleDownloader
-from src.player.observers import *
-from src.player.load_options import LoopOption, PlayerOption, FFMPEGOption, JobOption
-from src.data_transfer import *
+from src.player.youtube.load_url import LoadURL, iter_playlist
+from src.player.youtube.metadata_cache import METADATA_CACHE, _approx_size
+from src.player.youtube.stream_resolver import STREAM_RESOLVER, StreamUnavailableError
+from src.player.youtube.ydl_pool import YDL_POOL
+from src.player.single_flight import IN_FLIGHT
+from src.player.executors import EXECUTORS
+from src.player.audio_store import AUDIO_STORE
+from src.player.download_scheduler import DownloadScheduler, DownloadProgress
+from src.player.media_queue import MediaQueue
+from src.player.session_store import SESSION_STORE, SNAPSHOT_VERSION
+from src.player.session_registry import SessionRegistry
+from src.player.audio_source import (create_source, needs_transcode, FrameBuffer, FrameRecorder, BufferedSource,
+                                     ProgressiveSource, FirstFrameSource)
+from src.player.ffmpeg_budget import FFMPEG_BUDGET, FFmpegBudgetExceededError, FFmpegSlot
+from src.player.metrics import (METRICS, METRICS_SERVER, Histogram, REQUEST_WAIT, REQUEST_DURATION,
+                                VOICE_CONNECT_DURATION, FIRST_AUDIO, TRACK_GAP, TRACKS_STARTED, PLAY_RETRIES,
+                                TRACK_ERRORS, QUEUED_ENTRIES, LONGEST_QUEUE, VOICE_CLIENTS, SESSIONS, GATEWAY_LATENCY,
+                                METADATA_CACHE_LOOKUPS, METADATA_CACHE_HIT_RATIO, METADATA_CACHE_BYTES,
+                                AUDIO_STORE_BYTES, EXECUTOR_TASKS, DOWNLOADS_ACTIVE, FFMPEG_PROCESSES, FFMPEG_WAITING,
+                                FFMPEG_REJECTIONS)
+from src.player.youtube.download_media import isExist
+from src.player.load_options import LoopOption, PlayerOption, JobOption
 from src.configs import Config
 
 
-YOUTUBEDL_PARAMS = {
-    'format': 'bestaudio/best',
-    'extractaudio': True,
-    'postprocessors': [{
-        'key': 'FFmpegExtractAudio',
-        'preferredcodec': 'mp3',
-        'preferredquality': '192',
-    }],
-    'outtmpl': os.path.join(MUSIC_STORAGE, '%(id)s.%(ext)s'),
-}
+async def run_blocker(client, func, *args, workload: str = 'info', guild_id: Union[int, None] = None, **kwargs):
+    """Runs a blocking function on the executor of its workload class, e.g. 'search', 'info' or 'download'.
+    Guilds take turns on each executor, so one guild cannot take all of its threads.
+    """
+    return await EXECUTORS[workload].run(func, *args, guild_id=guild_id, **kwargs)
 
-async def run_blocker(client, func, *args, **kwargs):
-    func_ = functools.partial(func, *args, **kwargs)
-    return await client.loop.run_in_executor(None, func_)
+
+async def run_coalesced(client, key, func, *args, **kwargs):
+    """Runs a blocking function like run_blocker, unless the same work is already running for the key.
+    In that case, the result of the running one is awaited instead.
+
+    Returns:
+        Tuple[Any, bool]: The result, and whether it was shared from another caller.
+    """
+    return await IN_FLIGHT.do(key, run_blocker, client, func, *args, **kwargs)
 
 
 def _time_split(time: int):
     return str(timedelta(seconds=time))
 
 
+_SNAPSHOT_FIELDS = ('id', 'title', 'duration', 'original_url')
+
+
+def _entry_snapshot(entry: MediaMetadata) -> list:
+    return [getattr(entry, field) for field in _SNAPSHOT_FIELDS]
+
+
+def _entry_from_snapshot(data: list) -> MediaMetadata:
+    # the stream url is not kept - it would have expired - and is resolved right before the entry plays.
+    return MediaMetadata(dict(zip(_SNAPSHOT_FIELDS, data)))
+
+
 class Job:
-    def __init__(self, job_name: str, work: str):
+    def __init__(self, job_name: JobOption, work: str, ctx: commands.Context):
         """
         Defines a job for the bot to do.
 
         Args:
-            job_name (str): The name of the job. Accepts either 'search' or 'access'.
+            job_name (JobOption): The kind of the job, either a search or an access.
             work (str): The workload required for the job.
+            ctx (commands.Context): Context of the command that made the job.
         """
-        self.job = job_name  # accepts either "search" or "access"
+        self.job = job_name
         self.work = work
+        self.ctx = ctx
+        # the extraction running for the job, and the job's outcome once it is committed to the queue.
+        self.task: Union[asyncio.Task, None] = None
+        self.reservation: Union[QueueReservation, None] = None
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.created_at = time.monotonic()
+
+
+DOWNLOAD_SCHEDULER = DownloadScheduler()
+
+
+class SearchSelection:
+    """The results of a search, waiting for the user who searched to pick one of them.
+    """
+    def __init__(self, results: List[MediaMetadata]):
+        self.results = results
+
+
+class PlaylistStream:
+    """The entries of a playlist, to be resolved and committed to the queue one by one.
+    """
+    def __init__(self, entries: List[MediaMetadata]):
+        self.entries = entries
+
+
+class QueueReservation:
+    """A reserved position in a guild's queue, held for a request that is still waiting on its user.
+    """
+    __slots__ = ('entries_after', 'dropped')
 
+    def __init__(self):
+        # how many entries have been added to the queue behind this position since it was reserved.
+        self.entries_after = 0
+        # set once the queue is cleared - whatever the request resolves to is then dropped too.
+        self.dropped = False
 
-YT_DLP_SESH = YoutubeDL(YOUTUBEDL_PARAMS)
 
+class RequestQueue:
+    _SELECTION_TIMEOUT = 30
 
-class RequestQueue(DownloaderObservers):
-    def __init__(self, observer = DownloaderObservable()):
+    def __init__(self, concurrency: int = REQUEST_CONCURRENCY):
         """Initialize a queue for processing the urls and queries.
+        Up to `concurrency` requests are resolved at the same time, but they are always committed
+        in the order they arrived - whichever comes first is handled first.
 
         Args:
-            observer (DownloaderObservable, optional): A DownloaderObservable object.
+            concurrency (int, optional): How many requests may be resolved at the same time.
         """
-        super().__init__(observer)
-        self.priority: Union[Job, None] = None
-        self.on_hold: List[Job] = []
-        self._completed_priority = False
-        self._ongoing_process = False
-    
-    def add_new_request(self, job: Job):
-        """Adds a new request to the queue
+        self._concurrency = concurrency
+        self._slots: Union[asyncio.Semaphore, None] = None
+        self._jobs: Union[asyncio.Queue, None] = None
+        self._worker: Union[asyncio.Task, None] = None
+        self._selections: Set[asyncio.Task] = set()
+
+    def add_new_request(self, client, job: Job, selector_choice, commit, reserve) -> asyncio.Future:
+        """Adds a new request to the queue. Its resolution starts as soon as a slot is free.
 
         Args:
+            client: A Discord Bot Client.
             job (Job): A job for the queue to handle.
-        """
-        if self.priority is None and not self.on_hold:
-            self.priority = job
-        elif self.priority is None:
-            self.priority = self.on_hold.pop(0)
-            self.on_hold.append(job)
-        else:
-            self.on_hold.append(job)
+            selector_choice (Callable[[int], bool]): Gets whether a guild wants the search to yield an immediate result or not.
+            commit (Callable[[Job, List[MediaMetadata]], Any]): Commits the resolved entries of a job. Called in arrival order.
+            reserve (Callable[[Job], QueueReservation]): Reserves the queue position of a job that waits on its user to pick a result.
 
-    def update(self):
+        Returns:
+            asyncio.Future: The result of the job, i.e. what `commit` returned, or None if nothing was resolved.
         """
-        Overrides the original update function in DownloaderObservers
+        if self._jobs is None:
+            self._jobs = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self._concurrency)
+        job.task = asyncio.create_task(self._resolve_in_slot(client, job, selector_choice(job.ctx.guild.id)))
+        self._jobs.put_nowait(job)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self.process_requests(client, commit, reserve))
+        return job.result
+
+    @property
+    def busy(self) -> bool:
+        """Whether requests are still being resolved, or waiting on their user to pick a search result.
         """
-        if inspect.stack()[1][3] == "notify_observers":
-            self._completed_priority = True
+        return (self._worker is not None and not self._worker.done()) or bool(self._selections)
 
-    async def process_requests(self, client, ctx: commands.Context, vault: Vault, selector_choice):
-        """Processes the requests sequentially.
+    def cancel(self):
+        """Cancels the pending requests and stops processing the queue.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for selection in list(self._selections):
+            selection.cancel()
+        while self._jobs is not None and not self._jobs.empty():
+            job = self._jobs.get_nowait()
+            job.task.cancel()
+            if not job.result.done():
+                job.result.set_result(None)
+
+    async def _resolve_in_slot(self, client, job: Job, selector_choice):
+        async with self._slots:
+            REQUEST_WAIT.observe(time.monotonic() - job.created_at, kind=job.job.value)
+            return await self._resolve(client, job, selector_choice)
+
+    async def process_requests(self, client, commit, reserve):
+        """Commits the resolved requests in the order they arrived, until there is none left.
+        A slow request only holds back the requests behind it from being committed - they keep resolving meanwhile.
+        A search waiting on its user to pick a result only reserves its position, and is committed into it later.
 
         Args:
-            client (_type_): A Discord Bot Client.
-            ctx (commands.Context): Context of the command
-            vault (Vault): A vault to store values for other classes
-            selector_choice (int): Whether the guild wants the search to yield an immediate result or not.
+            client: A Discord Bot Client.
+            commit (Callable[[Job, List[MediaMetadata]], Any]): Commits the resolved entries of a job.
+            reserve (Callable[[Job], QueueReservation]): Reserves the queue position of a job.
+        """
+        while not self._jobs.empty():
+            job: Job = self._jobs.get_nowait()
+            try:
+                await asyncio.wait((job.task,))
+            except asyncio.CancelledError:
+                job.task.cancel()
+                if not job.result.done():
+                    job.result.set_result(None)
+                raise
+            if job.result.done():
+                continue
+            if job.task.cancelled():
+                job.result.set_result(None)
+            elif job.task.exception() is not None:
+                job.result.set_exception(job.task.exception())
+            elif isinstance(job.task.result(), PlaylistStream):
+                try:
+                    await self._commit_playlist(client, job, job.task.result(), commit)
+                except asyncio.CancelledError:
+                    if not job.result.done():
+                        job.result.set_result(None)
+                    raise
+            elif isinstance(job.task.result(), SearchSelection):
+                job.reservation = reserve(job)
+                selection = asyncio.create_task(self._complete_selection(client, job, job.task.result(), commit))
+                self._selections.add(selection)
+                selection.add_done_callback(self._selections.discard)
+            else:
+                data = job.task.result()
+                # committing is synchronous, so no other request can get in between.
+                try:
+                    job.result.set_result(commit(job, data) if data else data)
+                except Exception as e:
+                    job.result.set_exception(e)
+
+    @staticmethod
+    async def _resolve_entry(client, guild_id: int, entry: MediaMetadata) -> List[MediaMetadata]:
+        # flat entries that carry their title and duration are queued as they are - their stream is resolved
+        # right before they play. Others are extracted, which also drops unavailable videos.
+        if entry.title and entry.duration is not None:
+            return [entry]
+        load_sesh = LoadURL(entry.original_url)
+        data = load_sesh.cached_info(shared=False)
+        if data is not None:
+            return data
+        data, _ = await run_coalesced(client, load_sesh.cache_key, load_sesh.load_info, guild_id=guild_id)
+        return data
+
+    async def _commit_playlist(self, client, job: Job, stream: PlaylistStream, commit):
+        """Resolves the entries of a playlist and commits them in order as they come in.
+        The job is resolved as soon as the first playable entry is committed, so playback can start right away.
+        Requests behind the playlist are committed after its last entry.
         """
+        first_rejected = []
+        added = rejected = 0
+        entries_iter = iter_playlist(stream.entries, functools.partial(self._resolve_entry, client, job.ctx.guild.id),
+                                     PLAYLIST_CONCURRENCY)
+        async for entries in entries_iter:
+            if not entries:
+                continue
+            try:
+                added_entries, rejected_entries = commit(job, entries)
+            except Exception as e:
+                if not job.result.done():
+                    job.result.set_exception(e)
+                await entries_iter.aclose()
+                return
+
+            if not job.result.done():
+                first_rejected.extend(rejected_entries)
+                if added_entries:
+                    job.result.set_result((added_entries, first_rejected))
+            else:
+                added += len(added_entries)
+                rejected += len(rejected_entries)
+
+        if not job.result.done():
+            job.result.set_result((list(), first_rejected) if first_rejected else list())
+        if added:
+            await job.ctx.send(f"Added {added} more songs from the playlist to the queue.")
+        if rejected:
+            await job.ctx.send(f"{rejected} songs from the playlist were too long and were not added.")
+
+    async def _complete_selection(self, client, job: Job, selection: SearchSelection, commit):
+        """Waits for the user to pick a search result, then commits it into the job's reserved position.
+        The position is released if the user does not pick a valid result in time.
+        """
+        ctx = job.ctx
+
         def check_valid_input(m):
             return m.author == ctx.author and m.channel == ctx.channel
 
-        if self.priority is not None and self._ongoing_process:
-            while not self._completed_priority:
-                await asyncio.sleep(1)
-            self._completed_priority = False
-            self._ongoing_process = False
-            await self.process_requests(client, ctx, vault, selector_choice)
-        elif self.priority is not None and not self._completed_priority:
-            self._ongoing_process = True
-            guild_id = ctx.guild.id
-            new_sender = Sender(guild_id, vault)
-
-            url_ = self.priority.work
-            if self.priority.job == "search":
-                if not selector_choice:
-                    sv_obj = SearchVideos()
-                    sv_obj.subscribe(self)
-                    result: List[MediaMetadata] = await run_blocker(client, sv_obj.search, url_)
-                    results_embed = discord.Embed(
-                        color=discord.Color.blue()
-                    )
-                    r_link = ""
-                    for res_ind, res in enumerate(result):
-                        if res_ind != len(result) - 1:
-                            r_link += f"**{res_ind + 1}. [{res.title}]({res.original_url})** ({_time_split(res.duration)})\n"
-                        else:
-                            r_link += f"**{res_ind + 1}. [{res.title}]({res.original_url})** ({_time_split(res.duration)})\n"
-
-                    results_embed.add_field(
-                        name="Select a video.",
-                        value=r_link,
-                        inline=False
-                    )
-                    results_embed.set_footer(text="Timeout in 30s")
-                    await ctx.send(embed=results_embed)
+        chosen = []
+        try:
+            results_embed = discord.Embed(
+                color=discord.Color.blue()
+            )
+            r_link = ""
+            for res_ind, res in enumerate(selection.results):
+                r_link += f"**{res_ind + 1}. [{res.title}]({res.original_url})** ({_time_split(res.duration)})\n"
+
+            results_embed.add_field(
+                name="Select a video.",
+                value=r_link,
+                inline=False
+            )
+            results_embed.set_footer(text=f"Timeout in {self._SELECTION_TIMEOUT}s")
+            await ctx.send(embed=results_embed)
 
-                    try:
-                        q_msg = await client.wait_for('message', check=check_valid_input, timeout=30)
-                    except asyncio.TimeoutError:
-                        self.priority = None
-                        return await ctx.send(f"Timeout! Search session for query {url_} terminated.")
-                    sv_obj.unsubscribe(self)
-                    if q_msg.content.isdigit() and 1 <= int(q_msg.content) <= 5:
-                        data = [result[int(q_msg.content) - 1]]
-                    else:
-                        self.priority = None  # reset. This session no longer exists
-                        return await ctx.send("Illegal input. Terminated search session.")
+            try:
+                q_msg = await client.wait_for('message', check=check_valid_input, timeout=self._SELECTION_TIMEOUT)
+            except asyncio.TimeoutError:
+                await ctx.send(f"Timeout! Search session for query {job.work} terminated.")
+            else:
+                if q_msg.content.isdigit() and 1 <= int(q_msg.content) <= len(selection.results):
+                    chosen = [selection.results[int(q_msg.content) - 1]]
                 else:
-                    sv_obj = SearchVideos(limit=1)
-                    sv_obj.subscribe(self)
-                    data: List[MediaMetadata] = await run_blocker(client, sv_obj.search, url_)
-                    sv_obj.unsubscribe(self) # avoid the bot to store far too many unnecessary observants.
+                    await ctx.send("Illegal input. Terminated search session.")
+        finally:
+            # an empty commit releases the reserved position.
+            try:
+                committed = commit(job, chosen)
+            except Exception as e:
+                if not job.result.done():
+                    job.result.set_exception(e)
             else:
-                load_sesh = LoadURL(url_)
-                load_sesh.subscribe(self)
-                data = await run_blocker(client, load_sesh.load_info)
-                load_sesh.unsubscribe(self)
-
-            new_sender.send(data)
-            self.priority = None
-        elif self.priority is None and self.on_hold:
-            self.priority = self.on_hold.pop(0)
-            await self.process_requests(client, ctx, vault, selector_choice)
-    
+                if not job.result.done():
+                    job.result.set_result(committed if chosen else None)
+
+    @staticmethod
+    async def _resolve(client, job: Job, selector_choice) -> Union[List[MediaMetadata], PlaylistStream, SearchSelection, None]:
+        """Resolves a job into the media entries to add to the queue.
+
+        Args:
+            client: A Discord Bot Client.
+            job (Job): The job to resolve.
+            selector_choice (bool): Whether the guild wants the search to yield an immediate result or not.
+
+        Returns:
+            Union[List[MediaMetadata], PlaylistStream, SearchSelection, None]: The entries, the entries of a playlist
+            to stream in, or the search results for the user to pick from.
+        """
+        url_ = job.work
+        guild_id = job.ctx.guild.id
+        if job.job is JobOption.SEARCH_JOB:
+            if not selector_choice:
+                sv_obj = SearchVideos()
+                result, _ = await run_coalesced(client, sv_obj.cache_key(url_), sv_obj.search, url_,
+                                                workload='search', guild_id=guild_id)
+                return SearchSelection(result)
+            sv_obj = SearchVideos(limit=1)
+            data, _ = await run_coalesced(client, sv_obj.cache_key(url_), sv_obj.search, url_,
+                                          workload='search', guild_id=guild_id)
+        else:
+            load_sesh = LoadURL(url_)
+            if load_sesh.is_playlist:
+                entries, _ = await run_coalesced(client, load_sesh.flat_cache_key, load_sesh.load_entries, guild_id=guild_id)
+                if load_sesh.playlist_index is not None:
+                    # the link was opened at an entry of the playlist, which it is played from.
+                    entries = entries[load_sesh.playlist_index - 1:]
+                return PlaylistStream(entries)
+            data = load_sesh.cached_info(shared=False)
+            if data is None:
+                data, _ = await run_coalesced(client, load_sesh.cache_key, load_sesh.load_info, guild_id=guild_id)
+        return data
+
 
 class GuildSession:
+    # what an empty session takes up, and how many entries are measured to estimate the size of a queue.
+    _BASE_BYTES = 4096
+    _SIZE_SAMPLE = 16
+
     def __init__(self):
-        self.queue: List[MediaMetadata] = list()
+        self.queue: MediaQueue = MediaQueue()
         self.request_queue: RequestQueue = RequestQueue()
         self.loop: int = LoopOption.NO_LOOP
         
         self.loop_count: Union[Dict[MediaMetadata, int], None] = None
-        self.loop_counter: int = lambda: 0
+        self.loop_counter: int = 0
 
         self.cur_song: Union[MediaMetadata, None] = None
         self.previous_song: Union[MediaMetadata, None] = None
-        self.player: Union[discord.FFmpegPCMAudio, None] = None
+        self.player: Union[discord.AudioSource, None] = None
         
-        self.cur_processing: bool = False
         self.retry_count: int = 0
 
-        self.requires_download: List[MediaMetadata] = list()
+        # used as an ordered set, for O(1) membership checks.
+        self.requires_download: Dict[MediaMetadata, None] = dict()
 
-    @staticmethod
-    def _delete_files(song_metadata: MediaMetadata):
-        """ Deletes the files of a song, given the metadata.
+        # positions held for searches whose user has not picked a result yet, oldest first.
+        self.reservations: List[QueueReservation] = list()
+
+        # the source of the next entry, opened ahead of time while the current one is playing.
+        self.next_song: Union[MediaMetadata, None] = None
+        self.next_player: Union[discord.AudioSource, None] = None
+        self._next_lock = threading.Lock()
+
+        # held while a song is being started, which awaits its stream and an ffmpeg slot,
+        # so two commands cannot both take the head of the queue.
+        self.play_lock = asyncio.Lock()
+
+        # the frames of the current song, kept after its first play so loops replay it from memory.
+        self.loop_buffer: Union[FrameBuffer, None] = None
+        self.loop_buffer_song: Union[MediaMetadata, None] = None
+
+        # how far into the current song playback is: the seconds played up to the last pause,
+        # and since when it has been playing again.
+        self.played: float = 0.0
+        self.playing_since: Union[float, None] = None
+
+        # a song restored from a snapshot resumes from where it was when the snapshot was taken.
+        self.resume_song: Union[MediaMetadata, None] = None
+        self.resume_at: float = 0.0
+
+        # the latency measured up to the first frame of the next song started, and when it started counting.
+        self.audio_awaited: Union[Tuple[Histogram, float], None] = None
+
+    def await_audio(self, latency: Histogram, since: float):
+        """Measures, into latency, the time from since until the next song started produces its first frame.
+        """
+        self.audio_awaited = (latency, since)
+
+    def measure_audio(self, player: discord.AudioSource) -> discord.AudioSource:
+        """Wraps the source of the song being started, if its first frame is awaited.
+        """
+        awaited, self.audio_awaited = self.audio_awaited, None
+        if awaited is None:
+            return player
+        latency, since = awaited
+        return FirstFrameSource(player, lambda: latency.observe(time.monotonic() - since))
+
+    def mark_started(self, offset: float = 0.0):
+        """Marks the current song as starting to play, offset seconds in.
+        """
+        self.played = offset
+        self.playing_since = time.monotonic()
+
+    def mark_paused(self):
+        if self.playing_since is not None:
+            self.played += time.monotonic() - self.playing_since
+            self.playing_since = None
+
+    def mark_resumed(self):
+        if self.playing_since is None:
+            self.playing_since = time.monotonic()
+
+    @property
+    def position(self) -> float:
+        """How far into the current song playback is, in seconds.
+        """
+        if self.playing_since is None:
+            return self.played
+        return self.played + time.monotonic() - self.playing_since
+
+    @property
+    def busy(self) -> bool:
+        """Whether requests of the guild are still being resolved into its queue.
+        """
+        return self.request_queue.busy or bool(self.reservations)
+
+    def approx_bytes(self) -> int:
+        """Roughly how many bytes the session holds, measured on a sample of its entries.
+        """
+        size = self._BASE_BYTES
+        entries = len(self.queue)
+        if entries:
+            sample = [self.queue[index] for index in range(0, entries, max(1, entries // self._SIZE_SAMPLE))]
+            size += sum(_approx_size(entry) for entry in sample) * entries // len(sample)
+        if self.loop_buffer is not None:
+            size += len(self.loop_buffer.data) + self.loop_buffer.offsets.itemsize * len(self.loop_buffer.offsets)
+        return size
+
+    def take_resume_at(self, song: MediaMetadata) -> float:
+        """Takes the position a restored song resumes from, or 0 for any other song.
+        """
+        start = self.resume_at if song is self.resume_song else 0.0
+        self.resume_song = None
+        self.resume_at = 0.0
+        return start
+
+    def snapshot(self) -> Union[dict, None]:
+        """A compact snapshot of the session for SESSION_STORE: the entries in order, the current song and how far
+        into it playback is, and the loop state.
+
+        Returns:
+            Union[dict, None]: The snapshot, or None if there is nothing to resume.
+        """
+        if self.cur_song is None and not self.queue:
+            return None
+        return {
+            'version': SNAPSHOT_VERSION,
+            'cur_song': _entry_snapshot(self.cur_song) if self.cur_song is not None else None,
+            'position': round(self.position, 1),
+            'queue': [_entry_snapshot(entry) for entry in self.queue],
+            'downloads': [entry.id for entry in self.requires_download],
+            'loop': self.loop.value,
+            'loop_count': next(iter(self.loop_count.values())) if self.loop_count else None,
+            'loop_counter': self.loop_counter,
+        }
+
+    def restore(self, snapshot: dict):
+        """Restores the session from a snapshot taken by snapshot().
+        The current song is put back at the front of the queue, to resume from its position once played.
+        """
+        entries = [_entry_from_snapshot(data) for data in snapshot.get('queue', ())]
+        cur_song = snapshot.get('cur_song')
+        if cur_song is not None:
+            cur_song = _entry_from_snapshot(cur_song)
+            entries.insert(0, cur_song)
+            self.resume_song = cur_song
+            self.resume_at = float(snapshot.get('position') or 0)
+        self.queue.extend(entries)
+
+        downloads = set(snapshot.get('downloads', ()))
+        self.requires_download.update(dict.fromkeys(entry for entry in entries if entry.id in downloads))
+
+        if cur_song is not None and snapshot.get('loop') == LoopOption.LOOP.value:
+            self.loop = LoopOption.LOOP
+            if snapshot.get('loop_count') is not None:
+                self.loop_count = {cur_song: int(snapshot['loop_count'])}
+                self.loop_counter = int(snapshot.get('loop_counter') or 0)
+
+    def set_prepared(self, song: MediaMetadata, player: discord.AudioSource) -> bool:
+        """Stores the prepared source of the next entry, if that entry is still the next one.
 
         Args:
-            song_metadata (MediaMetadata): The metadata of the song.
+            song (MediaMetadata): The entry the source was prepared for.
+            player (discord.AudioSource): The prepared source.
+
+        Returns:
+            bool: Whether the source was kept. A source that is not kept is cleaned up.
         """
-        fp = os.path.join(MUSIC_STORAGE, f"{song_metadata.id}.mp3")
-        try:
-            if os.path.isfile(fp) or os.path.islink(fp):
-                os.unlink(fp)
-        except Exception as e:
-            print('Failed to delete %s. Reason: %s' % (fp, e))
+        with self._next_lock:
+            if self.next_player is None and self.queue and self.queue[0] is song:
+                self.next_song = song
+                self.next_player = player
+                return True
+        player.cleanup()
+        return False
+
+    def take_prepared(self, song: MediaMetadata) -> Union[discord.AudioSource, None]:
+        """Takes the prepared source, if it was prepared for the given entry.
+        """
+        with self._next_lock:
+            if self.next_player is not None and self.next_song is song:
+                player = self.next_player
+                self.next_song = None
+                self.next_player = None
+                return player
+        return None
+
+    def discard_prepared(self, only_if_stale: bool = False):
+        """Cleans up the prepared source.
+
+        Args:
+            only_if_stale (bool, optional): Only discards the source if its entry is no longer the next one.
+        """
+        with self._next_lock:
+            if self.next_player is None:
+                return
+            if only_if_stale and self.queue and self.queue[0] is self.next_song:
+                return
+            player = self.next_player
+            self.next_song = None
+            self.next_player = None
+        player.cleanup()
+
+    def reserve(self) -> QueueReservation:
+        """Reserves the position at the end of the queue.
+        """
+        reservation = QueueReservation()
+        self.reservations.append(reservation)
+        return reservation
+
+    def add_entries(self, entries: List[MediaMetadata], reservation: Union[QueueReservation, None] = None):
+        """Adds entries to the queue, either at its end or into a reserved position.
+        Adding into a reserved position, even no entries at all, releases it.
+
+        Args:
+            entries (List[MediaMetadata]): The entries to add.
+            reservation (Union[QueueReservation, None], optional): The reserved position to add the entries into.
+        """
+        if reservation is None:
+            self.queue.extend(entries)
+            for held in self.reservations:
+                held.entries_after += len(entries)
+            return
+
+        if reservation.dropped or reservation not in self.reservations:
+            # the queue was cleared since - the entries are dropped with it.
+            return
+        held_index = self.reservations.index(reservation)
+        index = max(0, len(self.queue) - reservation.entries_after)
+        self.queue.insert_many(index, entries)
+        for held in self.reservations[:held_index]:
+            held.entries_after += len(entries)
+        del self.reservations[held_index]
+
+    def drop_reservations(self):
+        """Drops the reserved positions, so the searches holding them add nothing once their user picks a result.
+        """
+        for reservation in self.reservations:
+            reservation.dropped = True
+        self.reservations.clear()
+
+    def clear_queue(self):
+        """Clears the queue, the positions reserved in it, and the source prepared for its next entry.
+        """
+        self.discard_prepared()
+        self.queue.clear()
+        self.requires_download.clear()
+        self.drop_reservations()
+
+    def download_plan(self) -> List[Tuple[MediaMetadata, int]]:
+        """The queued entries that require downloading, with the seconds until each one plays.
+        """
+        plan = []
+        if not self.requires_download:
+            return plan
+        eta = int(self.cur_song.duration or 0) if self.cur_song is not None else 0
+        for entry in self.queue:
+            if entry in self.requires_download:
+                plan.append((entry, eta))
+                if len(plan) == len(self.requires_download):
+                    break
+            eta += int(entry.duration or 0)
+        return plan
+
+    @property
+    def remaining_play_time(self) -> int:
+        """The play time of the current song and every queued entry, in seconds.
+        """
+        cur_duration = int(self.cur_song.duration or 0) if self.cur_song is not None else 0
+        return self.queue.duration + cur_duration
 
     def reset(self):
-        bogus_queue = deepcopy(self.queue) # safe delete
-        for item in bogus_queue:
-            self._delete_files(item)
+        # requests still being resolved are dropped with the rest of the session.
+        self.request_queue.cancel()
+        # downloaded files are kept in the shared AUDIO_STORE - the guild only drops its references to them.
+        self.discard_prepared()
         self.queue.clear()
+        self.requires_download.clear()
+        self.drop_reservations()
         self.cur_song = None
         self.player = None
+        self.loop_buffer = None
+        self.loop_buffer_song = None
+        self.retry_count = 0
         self.loop = LoopOption.NO_LOOP
+        self.loop_count = None
+        self.loop_counter = 0
+        self.played = 0.0
+        self.playing_since = None
+        self.resume_song = None
+        self.resume_at = 0.0
+        self.audio_awaited = None
 
 
 class Player(commands.Cog):
@@ -217,7 +661,8 @@ class Player(commands.Cog):
     
     # issue found at https://gist.github.com/vbe0201/ade9b80f2d3b64643d854938d40a0a2d?permalink_comment_id=4140046#gistcomment-4140046
     # basically, if the playlist is set to be played for 6 hrs, the latter links will expire.
-    # though, this should only matter to streaming music, right?
+    # stream urls are now resolved right before an entry plays (see STREAM_RESOLVER), so long queues can stream;
+    # downloading them is opt-in, with DOWNLOAD_LONG_QUEUES.
 
     def __init__(self, bot):
         """Initializes the Player
@@ -227,42 +672,343 @@ class Player(commands.Cog):
         """
         
         self._bot = bot
-        self._sessions: Dict[int, GuildSession] = defaultdict(lambda: GuildSession())
-        self._vault = Vault()
-        self._bot_config = Config(CONFIG_FILE_LOC)
+        # idle sessions are compacted into their snapshot, and restored from it on their next use.
+        self._sessions: SessionRegistry = SessionRegistry(GuildSession)
+        self._bot_config = Config(CONFIG_DB_LOC)
+        # set while the cog is being unloaded, so its players stop without touching the sessions they snapshot.
+        self._unloading = False
+        # guilds the bot is leaving on its own, whose sessions are compacted rather than reset.
+        self._leaving: Set[int] = set()
+        # guild id -> the pending disconnect of a voice client left without listeners.
+        self._alone_timers: Dict[int, asyncio.TimerHandle] = {}
+        # only read here - each guild's session is restored once the guild uses the bot again.
+        SESSION_STORE.load()
+        METRICS.set_collector('player', self._collect_metrics)
+
+    async def cog_load(self):
+        # the first load runs before the bot does, on a loop of its own - the server is started once the bot is ready.
+        if self._bot.is_ready():
+            await self._start_metrics()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self._start_metrics()
 
-    def get_players(self, ctx, job= PlayerOption.NEW_PLAYER):
+    async def _start_metrics(self):
+        try:
+            await METRICS_SERVER.start()
+        except OSError as e:
+            print(f"Failed to serve the metrics. Reason: {e}")
+
+    async def cog_unload(self):
+        # settings are written behind - whatever is still pending is written now.
+        self._bot_config.close()
+        METRICS.set_collector('player', None)
+        await METRICS_SERVER.stop()
+
+        # every session is snapshotted where it is, so the reloaded cog or the restarted bot resumes it.
+        self._unloading = True
+        self._snapshot_sessions.cancel()
+        self._sweep_sessions.cancel()
+        for timer in self._alone_timers.values():
+            timer.cancel()
+        for _, guild_sesh in self._sessions.items():
+            guild_sesh.request_queue.cancel()
+        SESSION_STORE.take_dirty()
+        SESSION_STORE.write({guild_id: guild_sesh.snapshot() for guild_id, guild_sesh in self._sessions.items()}).result()
+        for voice_client in list(self._bot.voice_clients):
+            try:
+                await voice_client.disconnect(force=True)
+            except Exception as e:
+                print(f"Failed to disconnect in guild id {voice_client.guild.id}: {e}")
+
+    @tasks.loop(seconds=SESSION_SNAPSHOT_INTERVAL)
+    async def _snapshot_sessions(self):
+        """Snapshots the sessions that changed, and saves the position of the ones playing.
+        """
+        sessions = dict(self._sessions.items())
+        guild_ids = set(SESSION_STORE.take_dirty())
+        # a playing session that did not change otherwise only moved on in its song - its queue is not written again.
+        positions = {guild_id: round(guild_sesh.position, 1) for guild_id, guild_sesh in sessions.items()
+                     if guild_sesh.playing_since is not None and guild_id not in guild_ids}
+        if guild_ids or positions:
+            SESSION_STORE.write({guild_id: sessions[guild_id].snapshot() if guild_id in sessions else None
+                                 for guild_id in guild_ids}, positions)
+
+    @tasks.loop(seconds=SESSION_SWEEP_INTERVAL)
+    async def _sweep_sessions(self):
+        """Compacts the sessions that went idle, or that are over the memory budget, into their snapshots.
+        """
+        pinned = self._session_pinned()
+        for guild_id in self._sessions.evictable(pinned):
+            self._compact_session(guild_id)
+
+    def _session_pinned(self):
+        """Gets whether the session of a guild must stay in memory: it is connected to voice or resolving requests.
+        """
+        connected = {voice_client.guild.id for voice_client in self._bot.voice_clients}
+        return lambda guild_id, guild_sesh: guild_id in connected or guild_id in self._leaving or guild_sesh.busy
+
+    def _compact_session(self, guild_id: int, snapshot: Union[dict, None] = None):
+        """Drops the session of a guild from memory, keeping only its snapshot, which is restored on its next use.
+
+        Args:
+            guild_id (int): The guild.
+            snapshot (Union[dict, None], optional): The snapshot to keep, if it was taken already.
+        """
+        guild_sesh = self._sessions.pop(guild_id, evicted=True)
+        if guild_sesh is not None and snapshot is None:
+            snapshot = guild_sesh.snapshot()
+        if guild_sesh is not None:
+            guild_sesh.discard_prepared()
+        if snapshot is not None:
+            SESSION_STORE.stash(guild_id, snapshot)
+        else:
+            SESSION_STORE.mark_dirty(guild_id)
+        # the downloads are synced and their files held again once the session is restored.
+        DOWNLOAD_SCHEDULER.drop_guild(guild_id)
+        AUDIO_STORE.release_guild(guild_id, keep=self._playing_media(guild_id, guild_sesh))
+
+    def _playing_media(self, guild_id: int, guild_sesh: Union[GuildSession, None]) -> Tuple[str, ...]:
+        """Gets the media a guild is still playing, or has paused, whose file must stay held when its others are released.
+        """
+        voice_client = next((vc for vc in self._bot.voice_clients if vc.guild.id == guild_id), None)
+        if guild_sesh is None or guild_sesh.cur_song is None or voice_client is None:
+            return ()
+        if not (voice_client.is_playing() or voice_client.is_paused()):
+            return ()
+        return (guild_sesh.cur_song.id,)
+
+    def _mark_dirty(self, ctx):
+        SESSION_STORE.mark_dirty(ctx.guild.id)
+
+    def _ensure_snapshots(self):
+        # started lazily, on the loop the bot runs on.
+        if not self._snapshot_sessions.is_running():
+            self._snapshot_sessions.start()
+        if not self._sweep_sessions.is_running():
+            self._sweep_sessions.start()
+
+    def _rehydrate(self, ctx, guild_sesh: 'GuildSession'):
+        """Restores the session of a guild from its saved snapshot, if there is one.
+        Nothing is extracted: stream urls are resolved as the restored entries play.
+        """
+        snapshot = SESSION_STORE.take(ctx.guild.id)
+        if snapshot is None:
+            return
+        guild_sesh.restore(snapshot)
+        for entry in guild_sesh.requires_download:
+            AUDIO_STORE.acquire(ctx.guild.id, entry.id)
+        print(f"Restored {len(guild_sesh.queue)} entries in guild id {ctx.guild.id}")
+        self._ensure_snapshots()
+        self._sync_downloads(ctx)
+
+    def get_players(self, ctx, job= PlayerOption.NEW_PLAYER, wait: float = FFMPEG_ADMISSION_TIMEOUT,
+                    slot: Union[FFmpegSlot, None] = None):
         """Gets the player for the bot in a voice channel in a guild
 
         Args:
             ctx (commands.Context): Context of the command
             job (str, optional): The job of this getter, which either gets a new player or refreshes the current one. Defaults to getting a new one.
+            wait (float, optional): How long to wait for an ffmpeg slot, in seconds. Only 0 may be used on the event loop.
+            slot (Union[FFmpegSlot, None], optional): The ffmpeg slot the song was admitted with already, if any.
+                It is given back if the prepared source is played instead.
+
+        Raises:
+            FFmpegBudgetExceededError: No ffmpeg slot freed up in time.
 
         Returns:
-            discord.FFmegPCMAudio: The player for the bot to play audio.
+            discord.AudioSource: The player for the bot to play audio.
         """
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
 
-        if guild_sesh.player is not None and job:
+        if guild_sesh.player is not None and job is PlayerOption.NEW_PLAYER:
             return guild_sesh.player
         else:
-            if guild_sesh.cur_song not in guild_sesh.requires_download:
-                player = discord.FFmpegPCMAudio(guild_sesh.cur_song.url, **FFMPEGOption.FFMPEG_STREAM_OPTIONS)
-            else:
-                player = discord.FFmpegPCMAudio(os.path.join(MUSIC_STORAGE, f"{guild_sesh.cur_song.id}.mp3"),
-                                            **FFMPEGOption.FFMPEG_PLAY_OPTIONS)
+            start = guild_sesh.take_resume_at(guild_sesh.cur_song)
+            player = guild_sesh.take_prepared(guild_sesh.cur_song) if not start else None
+            TRACKS_STARTED.inc(start='prepared' if player is not None else 'cold')
+            if player is not None and slot is not None:
+                slot.release()
+            if player is None:
+                try:
+                    # retries fall back to transcoding, in case the passthrough is what failed.
+                    player = self._create_player(guild_sesh.cur_song, passthrough=guild_sesh.retry_count == 0,
+                                                 start=start, wait=wait, slot=slot)
+                except FFmpegBudgetExceededError:
+                    # kept for when the song gets its slot.
+                    guild_sesh.resume_song, guild_sesh.resume_at = guild_sesh.cur_song, start
+                    raise
+            player = guild_sesh.measure_audio(player)
+            # a song resumed part way through is not recorded, as its recording would miss the start.
+            if LOOP_BUFFER_MAX_BYTES > 0 and not start:
+                player = FrameRecorder(player, LOOP_BUFFER_MAX_BYTES)
             guild_sesh.player = player
+            guild_sesh.mark_started(start)
+            self._mark_dirty(ctx)
             return player
 
+    @staticmethod
+    def _create_player(song: MediaMetadata, passthrough: bool = True, start: float = 0,
+                       wait: float = FFMPEG_ADMISSION_TIMEOUT, prefetch: bool = False,
+                       slot: Union[FFmpegSlot, None] = None) -> discord.AudioSource:
+        """Creates a source for a song, from the audio store if it was downloaded, from its partial file
+        if its download is far enough along and keeps ahead of playback, or from its stream otherwise.
+        The stream url is resolved or refreshed first if needed, which blocks on network I/O,
+        and the ffmpeg process of the source waits up to `wait` seconds for FFMPEG_BUDGET to admit it,
+        unless it was admitted with `slot` already.
+
+        Raises:
+            StreamUnavailableError: The song is not downloaded and its stream cannot be resolved.
+            FFmpegBudgetExceededError: No ffmpeg slot freed up in time, or none is spare for prefetching.
+        """
+        stored_path = AUDIO_STORE.path_for(song.id)
+        if stored_path is not None:
+            return create_source(song, stored_path, stream=False, passthrough=passthrough, start=start,
+                                 wait=wait, prefetch=prefetch, slot=slot)
+        progress = Player._progressive_download(song) if start == 0 else None
+        if progress is not None:
+            return ProgressiveSource(song, progress, lambda at, opus: Player._reopen_progressive(song, opus, at),
+                                     passthrough, wait=wait, prefetch=prefetch, slot=slot)
+        return create_source(song, STREAM_RESOLVER.resolve(song), stream=True, passthrough=passthrough, start=start,
+                             wait=wait, prefetch=prefetch, slot=slot)
+
+    @staticmethod
+    def _needs_transcode(song: MediaMetadata, passthrough: bool = True, start: float = 0) -> bool:
+        """Gets whether the source `_create_player` would create for a song transcodes,
+        so the song waits for the right kind of ffmpeg slot.
+        """
+        stored_path = AUDIO_STORE.path_for(song.id)
+        if stored_path is not None:
+            return needs_transcode(song, stored_path, stream=False, passthrough=passthrough)
+        progress = Player._progressive_download(song) if start == 0 else None
+        if progress is not None:
+            return needs_transcode(song, progress.file, stream=False, passthrough=passthrough)
+        return needs_transcode(song, song.url, stream=True, passthrough=passthrough)
+
+    @staticmethod
+    def _reopen_progressive(song: MediaMetadata, passthrough: bool, start: float) -> discord.AudioSource:
+        """Reopens a song whose partial file ran out, from its finished file or its stream.
+        It runs in the audio thread, in the middle of reading a frame, so it never waits: neither on the network
+        for a stream url, nor for an ffmpeg slot. The track ends instead.
+
+        Raises:
+            StreamUnavailableError: The song is not downloaded, and has no fresh stream url.
+            FFmpegBudgetExceededError: No ffmpeg slot is free.
+        """
+        stored_path = AUDIO_STORE.path_for(song.id)
+        if stored_path is not None:
+            return create_source(song, stored_path, stream=False, passthrough=passthrough, start=start, wait=0)
+        if STREAM_RESOLVER.needs_refresh(song):
+            raise StreamUnavailableError(f"No fresh stream url to reopen {song.title} with")
+        return create_source(song, song.url, stream=True, passthrough=passthrough, start=start, wait=0)
+
+    @staticmethod
+    def _progressive_download(song: MediaMetadata) -> Union[DownloadProgress, None]:
+        """Gets the running download of a song, if its partial file can be played already.
+        """
+        progress = DOWNLOAD_SCHEDULER.progress(song.id)
+        if progress is not None and progress.playable and progress.keeps_up(song.duration):
+            return progress
+        return None
+
+    async def _resolve_stream(self, song: MediaMetadata, guild_id: int):
+        """Resolves the stream url of a song off the event loop, unless it is downloaded,
+        played from its partial file, or its url is still fresh.
+        """
+        if (not AUDIO_STORE.contains(song.id) and self._progressive_download(song) is None
+                and STREAM_RESOLVER.needs_refresh(song)):
+            await run_coalesced(self._bot, STREAM_RESOLVER.flight_key(song), STREAM_RESOLVER.resolve, song, guild_id=guild_id)
+
+    async def prepare_next(self, ctx):
+        """Opens the source of the next entry in queue while the current one is still playing,
+        so the next track starts without waiting for ffmpeg to spin up.
+
+        Args:
+            ctx (commands.Context): Context of the command
+        """
+        guild_sesh = self._get_guild_sesh(ctx)
+        guild_sesh.discard_prepared(only_if_stale=True)
+        if guild_sesh.loop is LoopOption.LOOP or guild_sesh.next_player is not None or not guild_sesh.queue:
+            return
+
+        song = guild_sesh.queue[0]
+        if song in guild_sesh.requires_download and not isExist(song):
+            return
+        try:
+            await self._resolve_stream(song, ctx.guild.id)
+            player = await run_blocker(self._bot, self._create_player, song, prefetch=True, guild_id=ctx.guild.id)
+        except FFmpegBudgetExceededError:
+            # prefetching yields to the tracks about to play - the next one starts cold instead.
+            return
+        except Exception as e:
+            print(f"Failed to prepare the next song in guild id {ctx.guild.id}: {e}")
+            return
+        guild_sesh.set_prepared(song, player)
+
+    def _schedule_prepare_next(self, ctx):
+        asyncio.run_coroutine_threadsafe(self.prepare_next(ctx), self._bot.loop)
+
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before, after):
-        # add cases where ALL users left the VC and the bot is left idle for some time.
-
         if member.bot and member.id == self._bot.user.id:
             if before.channel and not after.channel:
                 guild_id = member.guild.id
-                self._sessions[guild_id].reset()
+                self._cancel_alone_timer(guild_id)
+                if self._unloading or guild_id in self._leaving:
+                    return
+                guild_sesh = self._sessions.get(guild_id)
+                if guild_sesh is not None:
+                    guild_sesh.reset()
+                SESSION_STORE.mark_dirty(guild_id)
+                DOWNLOAD_SCHEDULER.drop_guild(guild_id)
+                AUDIO_STORE.release_guild(guild_id)
                 print(f"cleared in guild id {guild_id}")
+                return
+
+        if before.channel != after.channel:
+            self._check_listeners(member.guild)
+
+    def _check_listeners(self, guild: discord.Guild):
+        """Schedules leaving the voice channel of a guild once no one but bots is left in it,
+        and calls it off once someone is back.
+        """
+        voice_client = guild.voice_client
+        if voice_client is None or voice_client.channel is None:
+            return
+        if any(not listener.bot for listener in voice_client.channel.members):
+            self._cancel_alone_timer(guild.id)
+        elif guild.id not in self._alone_timers:
+            self._alone_timers[guild.id] = self._bot.loop.call_later(
+                ALONE_DISCONNECT_MINUTES * 60, lambda: asyncio.ensure_future(self._leave_alone(guild))
+            )
+
+    def _cancel_alone_timer(self, guild_id: int):
+        timer = self._alone_timers.pop(guild_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def _leave_alone(self, guild: discord.Guild):
+        """Leaves a voice channel no one has listened in for ALONE_DISCONNECT_MINUTES.
+        The session is compacted instead of reset, so `resume` picks it up where it was left.
+        """
+        self._alone_timers.pop(guild.id, None)
+        voice_client = guild.voice_client
+        if voice_client is None or any(not listener.bot for listener in voice_client.channel.members):
+            return
+        guild_sesh = self._sessions.get(guild.id)
+        self._leaving.add(guild.id)
+        try:
+            snapshot = None
+            if guild_sesh is not None:
+                voice_client.pause()
+                guild_sesh.mark_paused()
+                snapshot = guild_sesh.snapshot()
+            await voice_client.disconnect()
+            self._compact_session(guild.id, snapshot)
+            print(f"Left guild id {guild.id} after {ALONE_DISCONNECT_MINUTES} minutes without listeners")
+        finally:
+            self._leaving.discard(guild.id)
             
     @commands.command()
     async def play(self, ctx: commands.Context, *, url_: str):
@@ -274,52 +1020,37 @@ class Player(commands.Cog):
         :param url_: The url, or the query, that is associated with the command
         :return:
         """
+        started_at = time.monotonic()
         can_join_vc = self.peek_vc(ctx)
         if not can_join_vc:
             return await ctx.send("You need to be in a voice channel to use this command.")
 
         if not url_:
             return await ctx.send("No input has been given")
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
         if is_valid_link(url_):
             cmd_job = JobOption.ACCESS_JOB
         else:
             cmd_job = JobOption.SEARCH_JOB
-        guild_sesh.request_queue.add_new_request(Job(cmd_job, url_))
-        if not guild_sesh.cur_processing:
-            guild_sesh.cur_processing = True
-            self._bot.loop.create_task(self.bg_process_rq(ctx))
+        pending = guild_sesh.request_queue.add_new_request(self._bot, Job(cmd_job, url_, ctx), self._bot_config.isAutoPick,
+                                                           self._commit_entries, self._reserve_entries)
+        try:
+            committed = await pending
+        except Exception as e:
+            print(f"Failed to process request {url_} in guild id {ctx.guild.id}: {e}")
+            return await ctx.send(f"Failed to load {url_}.")
+        REQUEST_DURATION.observe(time.monotonic() - started_at, kind=cmd_job.value)
 
-        while self._vault.isEmpty(ctx.guild.id):
-            await asyncio.sleep(1)
+        if committed:
+            data, too_long = committed
+            for item in too_long:
+                await ctx.send(f"Video {item.title} is too long! Current max length allowed is 6 hours! Removed from queue")
 
-        # both runs at the same time from here.
-        data = self._vault.get_data(ctx.guild.id)
-        if data is not None:
-            data_l = len(data)
-            if data_l == 1:
-                msg = f"Added {data[0].title} to the queue."
-            else:
-                msg = f"Added {data_l} songs to the queue."
-
-            # checking for entries that requires downloading
-            # These entries are some but not limited to:
-            #  - Entries that are more than 6 hours in play time.
-            #  - Entries that make the playlist plays longer than 6 hours 
-            # All of this is mainly to preserve the items in the playlist.
-
-            queue_total_play_time = sum([int(i.duration) for i in guild_sesh.queue]) if guild_sesh.queue else 0
-            for item_ind, item in enumerate(data):
-                if item.duration >= self._MAX_AUDIO_ALLOWED_TIME: # for now, for safety, that is removed
-                    await ctx.send(f"Video {item.title} is too long! Current max length allowed is 6 hours! Removed from queue")
-                    data.remove(item)
-                elif queue_total_play_time + item.duration >= self._MAX_AUDIO_ALLOWED_TIME:
-                    guild_sesh.requires_download.extend(data[item_ind:])
-                    break
-            
             if data:
-                guild_sesh.queue.extend(data)
-                await ctx.send(msg)
+                if len(data) == 1:
+                    await ctx.send(f"Added {data[0].title} to the queue.")
+                else:
+                    await ctx.send(f"Added {len(data)} songs to the queue.")
 
                 try:
                     voiceChannel = discord.utils.get(
@@ -329,7 +1060,66 @@ class Player(commands.Cog):
                 except AttributeError:
                     return await ctx.send('You need to be in a voice channel to use this command')
 
+                if ctx.voice_client is None or not ctx.voice_client.is_playing():
+                    guild_sesh.await_audio(FIRST_AUDIO, started_at)
                 await self.pre_play_process(ctx, voiceChannel)
+            elif not too_long:
+                await ctx.send(f"The queue was cleared meanwhile, so nothing was added for {url_}.")
+        elif committed is not None:
+            await ctx.send(f"Nothing playable was found for {url_}.")
+
+    def _commit_entries(self, job: Job, data: List[MediaMetadata]) -> Tuple[List[MediaMetadata], List[MediaMetadata]]:
+        """Adds the resolved entries of a request to the guild's queue.
+        This is synchronous, so requests are committed strictly in the order RequestQueue hands them over.
+
+        Args:
+            job (Job): The request the entries were resolved for.
+            data (List[MediaMetadata]): The resolved entries.
+
+        Returns:
+            Tuple[List[MediaMetadata], List[MediaMetadata]]: The entries added to the queue, and the ones that were too long to be added.
+        """
+        ctx = job.ctx
+        guild_sesh = self._get_guild_sesh(ctx)
+        if job.reservation is not None and job.reservation.dropped:
+            # the queue was cleared while the user was picking a result.
+            return list(), list()
+
+        too_long = [item for item in data if (item.duration or 0) >= self._MAX_AUDIO_ALLOWED_TIME]
+        data = [item for item in data if (item.duration or 0) < self._MAX_AUDIO_ALLOWED_TIME]
+
+        # checking for entries that requires downloading
+        # These entries are some but not limited to:
+        #  - Entries that are more than 6 hours in play time.
+        #  - Entries that make the playlist plays longer than 6 hours
+        # All of this is mainly to preserve the items in the playlist.
+        queue_total_play_time = guild_sesh.queue.duration
+        for item_ind, item in enumerate(data):
+            queue_total_play_time += item.duration or 0
+            if DOWNLOAD_LONG_QUEUES and queue_total_play_time >= self._MAX_AUDIO_ALLOWED_TIME:
+                guild_sesh.requires_download.update(dict.fromkeys(data[item_ind:]))
+                for download_item in data[item_ind:]:
+                    AUDIO_STORE.acquire(ctx.guild.id, download_item.id)
+                break
+
+        guild_sesh.add_entries(data, job.reservation)
+        guild_sesh.discard_prepared(only_if_stale=True)
+        self._sync_downloads(ctx)
+        self._mark_dirty(ctx)
+        if data and guild_sesh.next_player is None and ctx.voice_client is not None and ctx.voice_client.is_playing():
+            asyncio.create_task(self.prepare_next(ctx))
+        return data, too_long
+
+    def _sync_downloads(self, ctx):
+        """Hands the entries the guild needs downloaded, in the order they play, to the download scheduler.
+        This must run on the event loop.
+        """
+        DOWNLOAD_SCHEDULER.sync_guild(ctx.guild.id, self._get_guild_sesh(ctx).download_plan())
+
+    def _reserve_entries(self, job: Job) -> QueueReservation:
+        """Reserves the queue position of a request whose user is still picking a search result.
+        """
+        return self._get_guild_sesh(job.ctx).reserve()
 
     async def pre_play_process(self, ctx, voiceChannel):
         """
@@ -341,28 +1131,16 @@ class Player(commands.Cog):
             voiceChannel (_type_): The voice channel to connect to
 
         """
-        guild_sesh = self._get_guild_sesh()
-            # try:
-            #     obj = Downloader(data, YT_DLP_SESH)
-            #     await run_blocker(self._bot, obj.first_download)
-            # except NoVideoInQueueError:
-            #     return await ctx.send("No items are currently in queue")
-
-            # if len(data) > 1:
-        try:
-            if guild_sesh.requires_download:
-                try:
-                    obj = Downloader(guild_sesh.requires_download[0], YT_DLP_SESH)
-                    await run_blocker(self._bot, obj.first_download)
-                except NoVideoInQueueError:
-                    return await ctx.send("No items are currently in queue")
-                if len(guild_sesh.requires_download) > 1:
-                    self.bg_download_check.start(ctx)
-        except RuntimeError:
-            pass
+        guild_sesh = self._get_guild_sesh(ctx)
+        self._ensure_snapshots()
+        # the rest of the downloads run in the background through DOWNLOAD_SCHEDULER.
+        idle = ctx.voice_client is None or not ctx.voice_client.is_playing()
+        if idle and guild_sesh.queue and guild_sesh.queue[0] in guild_sesh.requires_download:
+            await self._wait_playable(ctx, guild_sesh.queue[0])
 
         if not self._is_connected(ctx):
-            await voiceChannel.connect()
+            with VOICE_CONNECT_DURATION.time():
+                await voiceChannel.connect()
 
         voice = ctx.voice_client
         try:
@@ -370,34 +1148,23 @@ class Player(commands.Cog):
         except discord.errors.ClientException:
             pass
 
-    async def bg_process_rq(self, ctx):
-        """ Processes the requests in the background
-
-        Args:
-            ctx (commands.Context): Context of the command
-        """
-        guild_sesh = self._get_guild_sesh()
-        while True:
-            if guild_sesh.request_queue.on_hold or guild_sesh.request_queue.priority is not None:
-                await guild_sesh.request_queue.process_requests(self._bot, ctx, self._vault, self._bot_config.isAutoPick(ctx.guild.id))
-            else:
-                guild_sesh.cur_processing = False
-                break
-
-    @tasks.loop(seconds = 20)
-    async def bg_download_check(self, ctx):
+    async def _wait_playable(self, ctx, song: MediaMetadata):
+        """Waits, ahead of every other download, until enough of a song is downloaded to start playing it.
+        The song is streamed instead if that takes longer than DOWNLOAD_WAIT_TIMEOUT.
         """
+        try:
+            await asyncio.wait_for(DOWNLOAD_SCHEDULER.wait(song, ctx.guild.id, playable=True), DOWNLOAD_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Download of {song.title} is not playable yet, streaming it instead")
 
-        Processes the download in the background.
-
-        Args:
-            ctx (_type_): _description_
+    async def _play_when_playable(self, ctx):
+        """Waits until the next entry can be played from its download, then plays it.
         """
-        guild_sesh = self._get_guild_sesh()
-        for item in guild_sesh.requires_download:
-            if not isExist(item):
-                down_sesh = SingleDownloader(item, YT_DLP_SESH)
-                await run_blocker(self._bot, down_sesh.download)
+        guild_sesh = self._get_guild_sesh(ctx)
+        if guild_sesh.queue:
+            await self._wait_playable(ctx, guild_sesh.queue[0])
+        if ctx.voice_client is not None:
+            await self.play_song(ctx, ctx.voice_client)
 
     async def play_song(self, ctx, voice, refresh = False):
         """Plays the audio.
@@ -407,48 +1174,115 @@ class Player(commands.Cog):
             voice (discord.VoiceClient): The current voice client that the command issuer is being in.
             refresh (bool, optional): Whether the player should be refreshed a lot. Defaults to False.
         """
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
+
+        async with guild_sesh.play_lock:
+            while not voice.is_playing():
+                async with ctx.typing():
+                    try:
+                        guild_sesh.cur_song = guild_sesh.queue.popleft()
+                    except IndexError:
+                        guild_sesh.cur_song = None
+                if guild_sesh.cur_song is None:
+                    await voice.disconnect()
+                    return
+                self._mark_dirty(ctx)
 
-        if not voice.is_playing():
-            async with ctx.typing():
                 try:
-                    guild_sesh.cur_song = guild_sesh.queue.pop(0)
-                except IndexError:
+                    await self._resolve_stream(guild_sesh.cur_song, ctx.guild.id)
+                except StreamUnavailableError as e:
+                    print(e)
+                    TRACK_ERRORS.inc(reason='unavailable')
+                    await ctx.send(f"Could not play {guild_sesh.cur_song.title}, skipping it.")
                     guild_sesh.cur_song = None
-            if guild_sesh.cur_song is None:
-                await voice.disconnect()
-                return
+                    continue
+
+                try:
+                    player = await self._get_admitted_player(ctx)
+                except FFmpegBudgetExceededError as e:
+                    print(e)
+                    TRACK_ERRORS.inc(reason='ffmpeg_busy')
+                    guild_sesh.queue.appendleft(guild_sesh.cur_song)
+                    guild_sesh.cur_song = None
+                    return await ctx.send(f"The bot is playing as many songs as it can right now. "
+                                          f"Use {BOT_PREFIX}resume to try again in a bit.")
+
+                song = guild_sesh.cur_song
+                # something else may have started playing during the awaits above - the song then waits its turn.
+                started = False
+                try:
+                    if not voice.is_playing():
+                        voice.play(
+                            player,
+                            after=lambda e:
+                            self.retry_play(ctx, voice, e) if e else self.play_next(ctx)
+                                )
+                        started = True
+                finally:
+                    if not started:
+                        # the source never reached the voice client, so its ffmpeg slot is given back here.
+                        player.cleanup()
+                        if guild_sesh.player is player:
+                            guild_sesh.player = None
+                        if guild_sesh.cur_song is song:
+                            guild_sesh.cur_song = None
+                        guild_sesh.queue.appendleft(song)
+                if started:
+                    await ctx.send('**Now playing:** {}'.format(song.title), delete_after=20)
+                break
+        # new entries may have been added behind the current one.
+        await self.prepare_next(ctx)
 
-            player = self.get_players(ctx, PlayerOption._REFRESH_PLAYER) if refresh else self.get_players(ctx)
-            voice.play(
-                player,
-                after=lambda e:
-                self.retry_play(ctx, voice, e) if e else self.play_next(ctx)
-                    )
-            await ctx.send('**Now playing:** {}'.format(guild_sesh.cur_song.title), delete_after=20)
-        else:
-            await asyncio.sleep(1)
-    
     def retry_play(self, ctx, voice, e):
         """Retries playing the audio.
         """
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
         if guild_sesh.retry_count < self._MAX_RETRY_COUNT:
+            PLAY_RETRIES.inc()
+            guild_sesh.await_audio(TRACK_GAP, time.monotonic())
             guild_sesh.retry_count += 1
-            guild_sesh.queue.insert(0, guild_sesh.cur_song)
+            guild_sesh.queue.appendleft(guild_sesh.cur_song)
             guild_sesh.cur_song = None
             asyncio.run_coroutine_threadsafe(self.play_song(ctx, voice, True), ctx.bot.loop)
         else:
+            TRACK_ERRORS.inc(reason='player_error')
             print("Player error: %s", e)
 
+    @staticmethod
+    def _hand_over(voice, guild_sesh: 'GuildSession', player: discord.AudioSource, after) -> bool:
+        """Hands a source to the voice client. A source it does not take is cleaned up, giving its ffmpeg slot back.
+
+        Returns:
+            bool: Whether the voice client is playing the source.
+        """
+        started = False
+        try:
+            if voice is None:
+                raise discord.errors.ClientException('Not connected to voice.')
+            voice.play(player, after=after)
+            started = True
+        except discord.errors.ClientException as e:
+            print(f"Failed to start playing: {e}")
+        finally:
+            if not started:
+                player.cleanup()
+                if guild_sesh.player is player:
+                    guild_sesh.player = None
+        return started
+
     def play_next(self, ctx):
         """Plays the next audio in queue.
         """
-        guild_sesh = self._get_guild_sesh()
+        if self._unloading or ctx.guild.id in self._leaving:
+            return
+        guild_sesh = self._get_guild_sesh(ctx)
+        self._mark_dirty(ctx)
+        # the silence between the songs lasts until the next one produces its first frame.
+        guild_sesh.await_audio(TRACK_GAP, time.monotonic())
 
         vc = discord.utils.get(self._bot.voice_clients, guild=ctx.guild)
 
-        if guild_sesh.loop:
+        if guild_sesh.loop is LoopOption.LOOP:
             if guild_sesh.loop_count is not None:
                 if guild_sesh.loop_counter < list(guild_sesh.loop_count.values())[0]:
                     guild_sesh.loop_counter += 1
@@ -456,24 +1290,49 @@ class Player(commands.Cog):
                     guild_sesh.loop = LoopOption.NO_LOOP
                     guild_sesh.loop_count = None
                     guild_sesh.loop_counter = 0
-                    self.play_next(ctx)
-            
-            player = self.get_players(ctx, self._REFRESH_PLAYER)
-            ctx.voice_client.play(
-                player,
-                after=lambda e:
-                print('Player error: %s' % e) if e else self.play_next(ctx)
-            )
+                    return self.play_next(ctx)
+
+            if isinstance(guild_sesh.player, FrameRecorder) and guild_sesh.player.complete:
+                guild_sesh.loop_buffer = guild_sesh.player.frames()
+                guild_sesh.loop_buffer_song = guild_sesh.cur_song
+
+            if guild_sesh.loop_buffer is not None and guild_sesh.loop_buffer_song is guild_sesh.cur_song:
+                player = guild_sesh.measure_audio(BufferedSource(guild_sesh.loop_buffer))
+                TRACKS_STARTED.inc(start='loop_buffer')
+                guild_sesh.player = player
+                guild_sesh.mark_started()
+            else:
+                self._notify_if_saturated(ctx)
+                try:
+                    player = self.get_players(ctx, PlayerOption.REFRESH_PLAYER)
+                except StreamUnavailableError as e:
+                    print(e)
+                    TRACK_ERRORS.inc(reason='unavailable')
+                    asyncio.run_coroutine_threadsafe(ctx.send(
+                        f"Could not play {guild_sesh.cur_song.title} again, so the loop stops and the queue moves on."
+                    ), ctx.bot.loop)
+                    guild_sesh.loop = LoopOption.NO_LOOP
+                    guild_sesh.loop_count = None
+                    guild_sesh.loop_counter = 0
+                    return self.play_next(ctx)
+                except FFmpegBudgetExceededError as e:
+                    print(e)
+                    return self._defer_for_ffmpeg(ctx)
+            self._hand_over(ctx.voice_client, guild_sesh, player,
+                            after=lambda e: print('Player error: %s' % e) if e else self.play_next(ctx))
             
         elif len(guild_sesh.queue) >= 1:
             try:
                 guild_sesh.previous_song = guild_sesh.cur_song
-                guild_sesh.cur_song = guild_sesh.queue.pop(0)
-                if guild_sesh.cur_song in guild_sesh.requires_download and not isExist(guild_sesh.cur_song):
-                    guild_sesh.queue.insert(0, guild_sesh.cur_song)
+                guild_sesh.cur_song = guild_sesh.queue.popleft()
+                guild_sesh.retry_count = 0
+                if (guild_sesh.cur_song in guild_sesh.requires_download and not isExist(guild_sesh.cur_song)
+                        and self._progressive_download(guild_sesh.cur_song) is None):
+                    guild_sesh.queue.appendleft(guild_sesh.cur_song)
                     guild_sesh.cur_song = guild_sesh.previous_song
                     guild_sesh.previous_song = None
-                    raise IOError("File not exist just yet")
+                    asyncio.run_coroutine_threadsafe(self._play_when_playable(ctx), self._bot.loop)
+                    return
             except IndexError:
                 guild_sesh.cur_song = None
             if guild_sesh.cur_song is None:
@@ -481,15 +1340,133 @@ class Player(commands.Cog):
                 asyncio.run_coroutine_threadsafe(ctx.voice_client.disconnect(), ctx.bot.loop)
                 return
 
-            ctx.voice_client.play(self.get_players(ctx, job=self._REFRESH_PLAYER), after=lambda e: self.play_next(ctx))
+            guild_sesh.loop_buffer = None
+            guild_sesh.loop_buffer_song = None
+
+            previous_song = guild_sesh.previous_song
+            if previous_song is not None and previous_song != guild_sesh.cur_song and previous_song not in guild_sesh.queue:
+                if previous_song in guild_sesh.requires_download:
+                    del guild_sesh.requires_download[previous_song]
+                AUDIO_STORE.release(ctx.guild.id, previous_song.id)
+
+            self._notify_if_saturated(ctx)
+            try:
+                player = self.get_players(ctx, job=PlayerOption.REFRESH_PLAYER)
+            except StreamUnavailableError as e:
+                print(e)
+                TRACK_ERRORS.inc(reason='unavailable')
+                asyncio.run_coroutine_threadsafe(ctx.send(f"Could not play {guild_sesh.cur_song.title}, skipping it."), ctx.bot.loop)
+                return self.play_next(ctx)
+            except FFmpegBudgetExceededError as e:
+                print(e)
+                return self._defer_for_ffmpeg(ctx)
+            if not self._hand_over(ctx.voice_client, guild_sesh, player, after=lambda e: self.play_next(ctx)):
+                return
             asyncio.run_coroutine_threadsafe(ctx.send(
                     f'**Now playing:** {guild_sesh.cur_song.title}',
                     delete_after=20
                 ), ctx.bot.loop)
+            self._schedule_prepare_next(ctx)
+            self._bot.loop.call_soon_threadsafe(self._sync_downloads, ctx)
         elif not ctx.voice_client.is_playing():
             asyncio.run_coroutine_threadsafe(vc.disconnect(), self._bot.loop)
             asyncio.run_coroutine_threadsafe(ctx.send("Finished playing!"), ctx.bot.loop)
 
+    async def _get_admitted_player(self, ctx) -> discord.AudioSource:
+        """Gets the player of the current song, once FFMPEG_BUDGET admits its ffmpeg process.
+        The slot is waited for on the event loop, in turn with the other songs waiting, telling the guild if it has to wait.
+        A song whose source was prepared already needs no slot of its own.
+
+        Raises:
+            FFmpegBudgetExceededError: No ffmpeg slot freed up in time.
+
+        Returns:
+            discord.AudioSource: The player of the current song.
+        """
+        guild_sesh = self._get_guild_sesh(ctx)
+        song = guild_sesh.cur_song
+        start = guild_sesh.resume_at if guild_sesh.resume_song is song else 0.0
+        if not start and guild_sesh.next_player is not None and guild_sesh.next_song is song:
+            return self.get_players(ctx, PlayerOption.REFRESH_PLAYER, wait=0)
+        transcode = self._needs_transcode(song, passthrough=guild_sesh.retry_count == 0, start=start)
+        if not FFMPEG_BUDGET.has_room(transcode):
+            await ctx.send("The bot is playing as many songs as it can right now - yours starts as soon as one ends.")
+        slot = await FFMPEG_BUDGET.admit(transcode)
+        try:
+            return self.get_players(ctx, PlayerOption.REFRESH_PLAYER, wait=0, slot=slot)
+        except BaseException:
+            # the source may have given the slot back already, which makes this do nothing.
+            slot.release()
+            raise
+
+    def _notify_if_saturated(self, ctx):
+        """Tells the guild its next song waits for an ffmpeg slot. Called from the audio thread.
+        """
+        guild_sesh = self._get_guild_sesh(ctx)
+        transcode = self._needs_transcode(guild_sesh.cur_song, passthrough=guild_sesh.retry_count == 0)
+        if not FFMPEG_BUDGET.has_room(transcode):
+            asyncio.run_coroutine_threadsafe(ctx.send(
+                "The bot is playing as many songs as it can right now - the next one starts as soon as one ends."
+            ), self._bot.loop)
+
+    def _defer_for_ffmpeg(self, ctx):
+        """Puts the current song back in front of the queue, to be played once an ffmpeg slot frees up.
+        Called from the audio thread.
+        """
+        guild_sesh = self._get_guild_sesh(ctx)
+        if guild_sesh.cur_song is not None:
+            guild_sesh.queue.appendleft(guild_sesh.cur_song)
+            guild_sesh.cur_song = None
+        guild_sesh.player = None
+        asyncio.run_coroutine_threadsafe(self._play_when_admitted(ctx), self._bot.loop)
+
+    async def _play_when_admitted(self, ctx):
+        # play_song waits its turn for a slot.
+        if ctx.voice_client is not None:
+            await self.play_song(ctx, ctx.voice_client)
+
+    def _collect_metrics(self):
+        """Copies the state of the sessions, the caches, the executors, the downloads and ffmpeg into the metrics.
+        """
+        queues = [len(guild_sesh.queue) for _, guild_sesh in self._sessions.items()]
+        QUEUED_ENTRIES.set(sum(queues))
+        LONGEST_QUEUE.set(max(queues, default=0))
+        VOICE_CLIENTS.set(len(self._bot.voice_clients))
+        sessions = self._sessions.stats(self._session_pinned())
+        SESSIONS.set(sessions['live'], state='live')
+        SESSIONS.set(sessions['idle'], state='idle')
+        SESSIONS.set(len(SESSION_STORE.saved_guilds()), state='saved')
+        GATEWAY_LATENCY.clear()
+        for shard_id, latency in self._bot.latencies:
+            if math.isfinite(latency):
+                GATEWAY_LATENCY.set(latency, shard=shard_id)
+
+        cache = METADATA_CACHE.stats()
+        METADATA_CACHE_LOOKUPS.set_total(cache['hits'] - cache['shared_hits'], result='hit')
+        METADATA_CACHE_LOOKUPS.set_total(cache['shared_hits'], result='shared_hit')
+        METADATA_CACHE_LOOKUPS.set_total(cache['misses'], result='miss')
+        METADATA_CACHE_HIT_RATIO.set(cache['hit_rate'])
+        METADATA_CACHE_BYTES.set(cache['bytes'])
+        AUDIO_STORE_BYTES.set(AUDIO_STORE.stats()['bytes'])
+
+        for name, executor in EXECUTORS.items():
+            ex = executor.stats()
+            EXECUTOR_TASKS.set(ex['running'], executor=name, state='running')
+            EXECUTOR_TASKS.set(ex['queued'], executor=name, state='queued')
+        downloads = DOWNLOAD_SCHEDULER.stats()
+        DOWNLOADS_ACTIVE.set(downloads['running'], state='running')
+        DOWNLOADS_ACTIVE.set(downloads['pending'], state='pending')
+
+        ffmpeg = FFMPEG_BUDGET.stats()
+        for scope in ('process', 'host'):
+            active, transcoding = (ffmpeg['active'], ffmpeg['transcoding']) if scope == 'process' \
+                else (ffmpeg['host_active'], ffmpeg['host_transcoding'])
+            FFMPEG_PROCESSES.set(active - transcoding, scope=scope, mode='passthrough')
+            FFMPEG_PROCESSES.set(transcoding, scope=scope, mode='transcode')
+        FFMPEG_WAITING.set(ffmpeg['waiting'])
+        FFMPEG_REJECTIONS.set_total(ffmpeg['rejected'], kind='play')
+        FFMPEG_REJECTIONS.set_total(ffmpeg['prefetch_skipped'], kind='prefetch')
+
     @commands.command()
     @commands.is_owner()
     async def debug(self, ctx):
@@ -498,15 +1475,84 @@ class Player(commands.Cog):
         Args:
             ctx (commands.Context()): context of the message
         """
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
         await ctx.send(guild_sesh.queue)
         if guild_sesh.cur_song is not None:
             await ctx.send(guild_sesh.cur_song)
         else:
             await ctx.send("Currently no song is playing")
 
-        await ctx.send([(k, v.queue) for k, v in self._sessions])
-        await ctx.send([(k, v.cur_song) for k, v in self._sessions])
+        await ctx.send([(k, v.queue) for k, v in self._sessions.items()])
+        await ctx.send([(k, v.cur_song) for k, v in self._sessions.items()])
+
+    @commands.command(name='cache_stats')
+    @commands.is_owner()
+    async def cache_stats(self, ctx):
+        """Shows the hit/miss counters of the metadata cache, the state of the downloads, the YoutubeDL pool, the executors, ffmpeg and the sessions. Only the owner can use this.
+        """
+        stats = METADATA_CACHE.stats()
+        stats_embed = discord.Embed(
+            color=discord.Color.blue()
+        )
+        stats_embed.add_field(
+            name="Metadata cache",
+            value=f"Hits: {stats['hits']} | Misses: {stats['misses']} | Hit rate: {stats['hit_rate']:.1%}\n"
+                  f"Entries: {stats['entries']} | Size: {stats['bytes'] // 1024}/{stats['max_bytes'] // 1024} KiB\n"
+                  f"Evictions: {stats['evictions']} | Expirations: {stats['expirations']}",
+            inline=False
+        )
+        downloads = DOWNLOAD_SCHEDULER.stats()
+        stats_embed.add_field(
+            name="Downloads",
+            value=f"Pending: {downloads['pending']} | Running: {downloads['running']}/{downloads['workers']}\n"
+                  f"Completed: {downloads['completed']} | Failed: {downloads['failed']} | Cancelled: {downloads['cancelled']}\n"
+                  f"Avg wait: {downloads['avg_wait']:.1f}s | Avg download: {downloads['avg_download']:.1f}s | "
+                  f"Max download: {downloads['max_download']:.1f}s",
+            inline=False
+        )
+        stats_embed.add_field(
+            name="YoutubeDL pool",
+            value="\n".join(
+                f"{profile}: {pool['in_use']}/{pool['instances']} in use | "
+                f"Uses: {sum(i['uses'] for i in pool['per_instance'])} | "
+                f"Errors: {sum(i['errors'] for i in pool['per_instance'])} | "
+                f"Waits: {pool['waits']} ({pool['wait_time']:.1f}s) | Retired: {pool['retired']}"
+                for profile, pool in YDL_POOL.stats().items()
+            ),
+            inline=False
+        )
+        stats_embed.add_field(
+            name="Executors",
+            value="\n".join(
+                f"{name}: {ex['running']}/{ex['workers']} running | Queued: {ex['queued']} ({ex['queued_guilds']} guilds) | "
+                f"Wait: {ex['avg_wait']:.2f}s avg, {ex['max_wait']:.2f}s max | "
+                f"Run: {ex['avg_run']:.2f}s avg, {ex['max_run']:.2f}s max"
+                for name, ex in ((name, executor.stats()) for name, executor in EXECUTORS.items())
+            ),
+            inline=False
+        )
+        ffmpeg = FFMPEG_BUDGET.stats()
+        stats_embed.add_field(
+            name="FFmpeg",
+            value=f"Active: {ffmpeg['active']}/{ffmpeg['max_processes']} | "
+                  f"Transcoding: {ffmpeg['transcoding']}/{ffmpeg['max_transcodes']} | Waiting: {ffmpeg['waiting']}\n"
+                  f"Host: {ffmpeg['host_active']} active, {ffmpeg['host_transcoding']} transcoding "
+                  f"over {ffmpeg['host_processes']} processes\n"
+                  f"Admitted: {ffmpeg['admitted']} | Rejected: {ffmpeg['rejected']} | "
+                  f"Prefetches skipped: {ffmpeg['prefetch_skipped']} | "
+                  f"Wait: {ffmpeg['avg_wait']:.2f}s avg, {ffmpeg['max_wait']:.2f}s max",
+            inline=False
+        )
+        sessions = self._sessions.stats(self._session_pinned())
+        stats_embed.add_field(
+            name="Sessions",
+            value=f"Live: {sessions['live']} | Idle: {sessions['idle']} | Compacted: {sessions['evicted']} | "
+                  f"Saved: {len(SESSION_STORE.saved_guilds())}\n"
+                  f"Size: {sessions['bytes'] // 1024}/{sessions['max_bytes'] // 1024} KiB | "
+                  f"Per session: {sessions['avg_bytes'] / 1024:.1f} KiB avg, {sessions['largest_bytes'] // 1024} KiB max",
+            inline=False
+        )
+        await ctx.send(embed=stats_embed)
 
     @commands.command(name='stop')
     async def stop_(self, ctx):
@@ -548,13 +1594,14 @@ class Player(commands.Cog):
         if not can_join_vc:
             return await ctx.send("You need to be in a voice channel to use this command.")
 
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
 
         if self._is_connected(ctx):
             ctx.voice_client.pause()
             try:
                 guild_sesh.loop = LoopOption.NO_LOOP # next song is set to NOT loop - which should be what people want anyway.
-                self.play_next(ctx)
+                guild_sesh.discard_prepared(only_if_stale=True)
+                ctx.voice_client.stop()  # play_next is called by the player once it stops.
             except IOError:
                 ctx.voice_client.resume()
                 return await ctx.send("The next media file is not ready to be played just yet - please be patient.")
@@ -571,21 +1618,33 @@ class Player(commands.Cog):
 
         if self._is_connected(ctx):
             ctx.voice_client.pause()
+            self._get_guild_sesh(ctx).mark_paused()
+            self._mark_dirty(ctx)
             await ctx.send("Paused!")
         else:
             await ctx.send("I am not in any voice chat right now")
 
     @commands.command(name='resume')
     async def resume(self, ctx):
-        """Resumes the player
+        """Resumes the player, the queue that stopped, or the queue left from before the bot restarted
         """
         can_join_vc = self.peek_vc(ctx)
         if not can_join_vc:
             return await ctx.send("You need to be in a voice channel to use this command.")
 
+        guild_sesh = self._get_guild_sesh(ctx)
         if self._is_connected(ctx):
-            ctx.voice_client.resume()
+            voice = ctx.voice_client
+            if not voice.is_paused() and not voice.is_playing() and guild_sesh.queue:
+                # the queue stopped, e.g. as no ffmpeg slot freed up in time for its next song.
+                await ctx.send(f"Resuming the queue of {len(guild_sesh.queue)} songs.")
+                return await self.play_song(ctx, voice)
+            voice.resume()
+            guild_sesh.mark_resumed()
             await ctx.send("Resumed!")
+        elif guild_sesh.queue:
+            await ctx.send(f"Resuming the queue of {len(guild_sesh.queue)} songs where it was left.")
+            await self.pre_play_process(ctx, ctx.author.voice.channel)
         else:
             await ctx.send("I am not in any voice chat right now")
 
@@ -597,7 +1656,7 @@ class Player(commands.Cog):
         if not can_join_vc:
             return await ctx.send("You need to be in a voice channel to use this command.")
 
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
 
         if self._is_connected(ctx):
             cur_playing_embed = discord.Embed(
@@ -655,8 +1714,11 @@ class Player(commands.Cog):
         if not can_join_vc:
             return await ctx.send("You need to be in a voice channel to use this command.")
 
-        self._queue[guild_id].clear()
-        self._requires_download[guild_id].clear()
+        guild_sesh = self._get_guild_sesh(ctx)
+        guild_sesh.clear_queue()
+        DOWNLOAD_SCHEDULER.drop_guild(guild_id)
+        AUDIO_STORE.release_guild(guild_id, keep=self._playing_media(guild_id, guild_sesh))
+        self._mark_dirty(ctx)
         await ctx.send("Queue cleared!")
 
     @commands.command(name='loop')
@@ -667,9 +1729,9 @@ class Player(commands.Cog):
         can_join_vc = self.peek_vc(ctx)
         if not can_join_vc:
             return await ctx.send("You need to be in a voice channel to use this command.")
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
 
-        if guild_sesh.loop:
+        if guild_sesh.loop is LoopOption.LOOP:
             if loop_amount is not None:
                 return await ctx.send(f"Already looping a couple of times - please type {BOT_PREFIX}loop to end loop.")
             guild_sesh.loop = LoopOption.NO_LOOP
@@ -688,6 +1750,8 @@ class Player(commands.Cog):
             else:
                 await ctx.send("Looping current song.")
             guild_sesh.loop = LoopOption.LOOP
+            guild_sesh.discard_prepared()  # the next entry will not be needed for a while.
+        self._mark_dirty(ctx)
             
 
     @commands.command(name='shuffle')
@@ -698,9 +1762,13 @@ class Player(commands.Cog):
         if not can_join_vc:
             return await ctx.send("You need to be in a voice channel to use this command.")
 
-        guild_sesh = self._get_guild_sesh()
+        guild_sesh = self._get_guild_sesh(ctx)
         if guild_sesh.queue:
-            random.shuffle(guild_sesh.queue)
+            guild_sesh.queue.shuffle()
+            guild_sesh.discard_prepared(only_if_stale=True)
+            self._sync_downloads(ctx)
+            self._mark_dirty(ctx)
+            await self.prepare_next(ctx)
             await ctx.send(f"Queue is shuffled. To check current queue, please use {BOT_PREFIX}queue, or {BOT_PREFIX}q")
         else:
             await ctx.send("There is nothing to be shuffled.")
@@ -742,7 +1810,12 @@ class Player(commands.Cog):
         return discord.utils.get(self._bot.voice_clients, guild=ctx.guild)
 
     def _get_guild_sesh(self, ctx):
-        return self._session[ctx.guild.id]
+        guild_sesh = self._sessions.get(ctx.guild.id)
+        if guild_sesh is None:
+            # the first use of the guild since startup - its saved session, if any, is restored now.
+            guild_sesh = self._sessions[ctx.guild.id]
+            self._rehydrate(ctx, guild_sesh)
+        return guild_sesh
 
 async def setup(bot):
     await bot.add_cog(Player(bot))
@@ -1,61 +1,147 @@
-from genericpath import isfile
-from typing import Union
+from typing import Dict, Tuple, Union
+import atexit
 import configparser
 from pathlib import Path
 import os
+import sqlite3
+import threading
+import weakref
+
+from constants import CONFIG_FILE_LOC, SETTINGS_FLUSH_DELAY
+
+
+_DEFAULTS = {
+    'AutoSelectSong': "True",
+}
+
+# the configs that have not been closed yet. One exit handler closes them all,
+# so reloading the player cog does not pile up handlers, nor keep its old configs alive.
+_OPEN_CONFIGS: 'weakref.WeakSet[Config]' = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_configs():
+    for config in list(_OPEN_CONFIGS):
+        config.close()
 
 
 class Config:
-    def __init__(self, config_file: Union[str, Path]):
+    def __init__(self, config_file: Union[str, Path], legacy_config_file: Union[str, Path] = CONFIG_FILE_LOC,
+                 flush_delay: float = SETTINGS_FLUSH_DELAY):
         """
-        Loads up the config saved for the bot
+        Loads up the config saved for the bot.
+        Settings are kept in memory, so reading them costs no disk I/O. Changes are written behind to an SQLite
+        database, batched over flush_delay seconds, and whatever is left is written on shutdown.
 
         Args:
-            config_file (Union[str, Path]): The location of the config file.
+            config_file (Union[str, Path]): The location of the settings database.
+            legacy_config_file (Union[str, Path], optional): The ini file settings used to be kept in, imported once.
+            flush_delay (float, optional): How long changes are held before they are written, in seconds.
         """
-
         self._config_file = config_file
-        if not os.path.isfile(config_file):
-            self._create_new_config()
-        
+        self._flush_delay = flush_delay
+        self._lock = threading.Lock()
+        # serializes the writes themselves, which happen outside of self._lock.
+        self._write_lock = threading.Lock()
+        self._timer: Union[threading.Timer, None] = None
+
+        # guild id -> setting name -> value, for the settings that differ from or were set over the defaults.
+        self._data: Dict[int, Dict[str, str]] = {}
+        self._dirty: Dict[Tuple[int, str], str] = {}
+
+        self._create_new_config()
         self._data = self._read_config()
+        if not self._data and os.path.isfile(legacy_config_file):
+            self._import_legacy_config(legacy_config_file)
+        _OPEN_CONFIGS.add(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._config_file, timeout=30)
 
     def _create_new_config(self):
-        config = configparser.ConfigParser()
-        config['DEFAULT'] = {
-            'AutoSelectSong': True
-        }
-        
-        with open(self._config_file, 'w') as cf:
-            config.write(cf)
-
-    def _read_config(self):
-        config = configparser.ConfigParser()
-        config.read(self._config_file)
-        return config
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS guild_settings ('
+                    'guild_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (guild_id, key))'
+                )
+        finally:
+            conn.close()
+
+    def _read_config(self) -> Dict[int, Dict[str, str]]:
+        data: Dict[int, Dict[str, str]] = {}
+        conn = self._connect()
+        try:
+            for guild_id, key, value in conn.execute('SELECT guild_id, key, value FROM guild_settings'):
+                data.setdefault(guild_id, {})[key] = value
+        finally:
+            conn.close()
+        return data
 
-    def _write_to_config(self, id_:int ):
+    def _import_legacy_config(self, legacy_config_file: Union[str, Path]):
         config = configparser.ConfigParser()
-        config.read(self._config_file)
-        config.add_section(str(id_))
-        config.set(str(id_), 'AutoSelectSong', "True")
-        with open(self._config_file, 'w') as cf:
-            config.write(cf)
+        config.read(legacy_config_file)
+        for section in config.sections():
+            if section.isdigit():
+                if config.has_option(section, 'AutoSelectSong'):
+                    self._set(int(section), 'AutoSelectSong', str(config.getboolean(section, 'AutoSelectSong')))
+        self.flush()
+
+    def _get(self, id_: int, key: str) -> str:
+        settings = self._data.get(id_)
+        if settings is not None and key in settings:
+            return settings[key]
+        return _DEFAULTS[key]
+
+    def _set(self, id_: int, key: str, value: str):
+        with self._lock:
+            self._data.setdefault(id_, {})[key] = value
+            self._dirty[(id_, key)] = value
+            if self._timer is None:
+                self._timer = threading.Timer(self._flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Writes the pending changes to the database, in one transaction.
+        """
+        # the changes are taken under the write lock, so an older batch can never be written over a newer one.
+        with self._write_lock:
+            with self._lock:
+                self._timer = None
+                changes, self._dirty = self._dirty, {}
+            if not changes:
+                return
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?)',
+                        [(id_, key, value) for (id_, key), value in changes.items()]
+                    )
+            except sqlite3.Error as e:
+                print(f"Failed to save the settings. Reason: {e}")
+                with self._lock:
+                    # put back, unless changed again in the meantime.
+                    for change, value in changes.items():
+                        self._dirty.setdefault(change, value)
+            finally:
+                conn.close()
+
+    def close(self):
+        """Writes whatever is still pending, e.g. on shutdown.
+        """
+        _OPEN_CONFIGS.discard(self)
+        with self._lock:
+            timer = self._timer
+            self._timer = None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
 
     def isAutoPick(self, id_: int):
-        if str(id_) not in self._data:
-            self._write_to_config(id_)
-            self._data = self._read_config()
-        return self._data[str(id_)].getboolean('AutoSelectSong')
+        return self._get(id_, 'AutoSelectSong') == "True"
 
     def set_state(self, id_:int):
-        if str(id_) not in self._data:
-            self._write_to_config(id_)
-            self._data = self._read_config()
-        if self.isAutoPick(id_):
-            self._data[str(id_)]['AutoSelectSong'] = "False"
-        else:
-            self._data[str(id_)]['AutoSelectSong'] = "True"
-        
-        with open(self._config_file, 'w') as cf:
-            self._data.write(cf)
\ No newline at end of file
+        self._set(id_, 'AutoSelectSong', "False" if self.isAutoPick(id_) else "True")
@@ -0,0 +1,362 @@
+import os
+import time
+from array import array
+from typing import Callable, Union
+
+import discord
+
+from constants import OPUS_PASSTHROUGH, PROGRESSIVE_STALL_TIMEOUT, FFMPEG_ADMISSION_TIMEOUT
+from src.player.load_options import FFMPEGOption
+from src.player.ffmpeg_budget import FFMPEG_BUDGET, FFmpegSlot
+from src.player.metrics import FFMPEG_START_DURATION
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+_OPUS_CONTAINERS = ('webm', 'ogg', 'opus')
+
+
+def is_opus(media: MediaMetadata, location: Union[str, None] = None) -> bool:
+    """Checks whether the audio of a media is Opus in a container ffmpeg can copy it out of.
+
+    Args:
+        media (MediaMetadata): The metadata of the media.
+        location (Union[str, None], optional): The downloaded file of the media, if it is played from disk.
+
+    Returns:
+        bool: Whether the audio can be passed through without transcoding.
+    """
+    if location is not None and not location.startswith(('http://', 'https://')):
+        ext = os.path.splitext(location)[1].lstrip('.').lower()
+    else:
+        ext = (media.ext or '').lower()
+    return (media.acodec or '').lower().startswith('opus') and ext in _OPUS_CONTAINERS
+
+
+def needs_transcode(media: MediaMetadata, location: Union[str, None], stream: bool,
+                    passthrough: bool = OPUS_PASSTHROUGH) -> bool:
+    """Checks whether the ffmpeg process playing a media transcodes it, rather than copying its Opus through.
+
+    Args:
+        media (MediaMetadata): The metadata of the media.
+        location (Union[str, None]): The stream url or the downloaded file of the media.
+        stream (bool): Whether the location is a remote stream.
+        passthrough (bool, optional): Whether Opus passthrough may be used. Defaults to OPUS_PASSTHROUGH.
+
+    Returns:
+        bool: Whether the audio is transcoded.
+    """
+    return not (passthrough and is_opus(media, None if stream else location))
+
+
+def _ffmpeg_options(stream: bool, start: float = 0) -> dict:
+    options = dict(FFMPEGOption.FFMPEG_STREAM_OPTIONS.value if stream else FFMPEGOption.FFMPEG_PLAY_OPTIONS.value)
+    if start > 0:
+        options['before_options'] = f"{options.get('before_options', '')} -ss {start:.3f}".strip()
+    return options
+
+
+class AdmittedSource(discord.AudioSource):
+    """Wraps an ffmpeg source, giving its slot in FFMPEG_BUDGET back once the source is cleaned up.
+    """
+    def __init__(self, source: discord.AudioSource, slot: FFmpegSlot):
+        self._source = source
+        self._slot = slot
+
+    def read(self) -> bytes:
+        return self._source.read()
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self):
+        try:
+            self._source.cleanup()
+        finally:
+            self._slot.release()
+
+
+class FirstFrameSource(discord.AudioSource):
+    """Wraps a source, calling back once it produced its first frame, e.g. to measure how long the audio took to start.
+    """
+    def __init__(self, source: discord.AudioSource, on_first_frame: Callable[[], None]):
+        self._source = source
+        self._on_first_frame = on_first_frame
+
+    def read(self) -> bytes:
+        data = self._source.read()
+        if data and self._on_first_frame is not None:
+            on_first_frame, self._on_first_frame = self._on_first_frame, None
+            on_first_frame()
+        return data
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self):
+        self._source.cleanup()
+
+
+def _admitted(factory: Callable[[], discord.AudioSource], transcode: bool, wait: float, prefetch: bool,
+              slot: Union[FFmpegSlot, None] = None) -> AdmittedSource:
+    if slot is not None and slot.transcode < transcode:
+        # admitted to copy Opus through, but the audio turned out to need transcoding.
+        slot.release()
+        slot = None
+    if slot is None:
+        slot = FFMPEG_BUDGET.acquire(transcode, wait, prefetch)
+    try:
+        with FFMPEG_START_DURATION.time(mode='transcode' if transcode else 'passthrough'):
+            return AdmittedSource(factory(), slot)
+    except BaseException:
+        slot.release()
+        raise
+
+
+def create_source(media: MediaMetadata, location: str, stream: bool, passthrough: bool = OPUS_PASSTHROUGH,
+                  start: float = 0, wait: float = FFMPEG_ADMISSION_TIMEOUT, prefetch: bool = False,
+                  slot: Union[FFmpegSlot, None] = None) -> discord.AudioSource:
+    """Creates the audio source for a media, once FFMPEG_BUDGET admits its ffmpeg process.
+
+    Opus audio is copied straight into the voice connection, so neither ffmpeg nor discord.py has to
+    decode and re-encode it. Anything else is transcoded to PCM and encoded by discord.py.
+
+    Args:
+        media (MediaMetadata): The metadata of the media.
+        location (str): The stream url or the downloaded file of the media.
+        stream (bool): Whether the location is a remote stream.
+        passthrough (bool, optional): Whether Opus passthrough may be used. Defaults to OPUS_PASSTHROUGH.
+        start (float, optional): Where to start playing the media from, in seconds.
+        wait (float, optional): How long to wait for an ffmpeg slot, in seconds.
+        prefetch (bool, optional): Whether the source is opened ahead of time, which only happens while slots are plenty.
+        slot (Union[FFmpegSlot, None], optional): The slot the process was admitted with already, if any.
+
+    Raises:
+        FFmpegBudgetExceededError: No ffmpeg slot was free in time.
+
+    Returns:
+        discord.AudioSource: The source for the voice client to play.
+    """
+    options = _ffmpeg_options(stream, start)
+    # FFmpegOpusAudio copies the audio (-c:a copy) only for codec 'opus' - any other codec is re-encoded with libopus.
+    if not needs_transcode(media, location, stream, passthrough):
+        return _admitted(lambda: discord.FFmpegOpusAudio(location, codec='opus', **options), False, wait, prefetch, slot)
+    return _admitted(lambda: discord.FFmpegPCMAudio(location, **options), True, wait, prefetch, slot)
+
+
+class FrameBuffer:
+    """The encoded frames of a whole track, kept in one compact bytes object.
+    """
+    __slots__ = ('data', 'offsets', 'opus')
+
+    def __init__(self, data: bytes, offsets: array, opus: bool):
+        self.data = data
+        self.offsets = offsets
+        self.opus = opus
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def frame(self, index: int) -> bytes:
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+
+class FrameRecorder(discord.AudioSource):
+    """Wraps a source, keeping a copy of every frame read from it, so the track can be replayed from memory.
+    Recording stops once the track is larger than the given size.
+    """
+    def __init__(self, source: discord.AudioSource, max_bytes: int):
+        """
+        Args:
+            source (discord.AudioSource): The source to record.
+            max_bytes (int): The largest track, in bytes of frames, that is kept.
+        """
+        self._source = source
+        self._max_bytes = max_bytes
+        self._data = bytearray()
+        self._offsets = array('L', [0])
+        self.overflowed = False
+        self.complete = False
+
+    def read(self) -> bytes:
+        frame = self._source.read()
+        if not frame:
+            self.complete = not self.overflowed
+        elif not self.overflowed:
+            if len(self._data) + len(frame) > self._max_bytes:
+                self.overflowed = True
+                self._data = bytearray()
+                self._offsets = array('L', [0])
+            else:
+                self._data += frame
+                self._offsets.append(len(self._data))
+        return frame
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self):
+        self._source.cleanup()
+
+    def frames(self) -> Union[FrameBuffer, None]:
+        """Gets the recorded frames, if the whole track was recorded.
+        """
+        if not self.complete:
+            return None
+        return FrameBuffer(bytes(self._data), self._offsets, self._source.is_opus())
+
+
+class BufferedSource(discord.AudioSource):
+    """Plays a track back from frames kept in memory, without ffmpeg or the network.
+    """
+    def __init__(self, buffer: FrameBuffer):
+        self._buffer = buffer
+        self._index = 0
+
+    def read(self) -> bytes:
+        if self._index >= len(self._buffer):
+            return b''
+        frame = self._buffer.frame(self._index)
+        self._index += 1
+        return frame
+
+    def is_opus(self) -> bool:
+        return self._buffer.opus
+
+
+class GrowingFileReader:
+    """Reads a file that is still being downloaded, waiting for more of it like `tail -f` does.
+
+    It is handed to ffmpeg as its stdin. Reading ends once the download is done and the file is read through,
+    or once the file has stopped growing for too long, in which case the reader is marked as stalled.
+    """
+    _POLL_INTERVAL = 0.05
+
+    def __init__(self, progress, stall_timeout: float = PROGRESSIVE_STALL_TIMEOUT):
+        """
+        Args:
+            progress (DownloadProgress): The progress of the download writing the file.
+            stall_timeout (float, optional): How long to wait on a file that does not grow, in seconds.
+        """
+        self._progress = progress
+        self._stall_timeout = stall_timeout
+        self._file = None
+        self._closed = False
+        self.stalled = False
+
+    def _open(self):
+        # the partial file is renamed once it is finished - an open handle keeps reading the same file.
+        for path in (self._progress.tmp_file, self._progress.file):
+            if path is not None and os.path.isfile(path):
+                self._file = open(path, 'rb')
+                return
+
+    def read(self, size: int = -1) -> bytes:
+        idle_since = time.monotonic()
+        while not self._closed:
+            if self._file is None:
+                self._open()
+            done = self._progress.done.is_set()
+            if self._file is not None:
+                try:
+                    data = self._file.read(size)
+                except ValueError:
+                    # closed from another thread while reading.
+                    return b''
+                if data or done:
+                    return data
+            elif done:
+                return b''
+            if time.monotonic() - idle_since >= self._stall_timeout:
+                self.stalled = True
+                return b''
+            time.sleep(self._POLL_INTERVAL)
+        return b''
+
+    def close(self):
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ProgressiveSource(discord.AudioSource):
+    """Plays a track from its partially downloaded file, while the download is still running.
+
+    If the partial file runs out before the download is done, or the download stalled or failed, the track is
+    reopened at the position played so far: from the finished file if it is in the store by then, or from its stream.
+    A download that finished normally simply ends the track.
+    """
+    _FRAME_LENGTH = 0.02
+
+    def __init__(self, media: MediaMetadata, progress, reopen: Callable[[float, bool], discord.AudioSource],
+                 passthrough: bool = OPUS_PASSTHROUGH, wait: float = FFMPEG_ADMISSION_TIMEOUT, prefetch: bool = False,
+                 slot: Union[FFmpegSlot, None] = None):
+        """
+        Args:
+            media (MediaMetadata): The metadata of the media.
+            progress (DownloadProgress): The progress of the download of the media.
+            reopen (Callable[[float, bool], discord.AudioSource]): Creates a source of the media starting at a position,
+                in seconds, and whether it may pass Opus through.
+            passthrough (bool, optional): Whether Opus passthrough may be used. Defaults to OPUS_PASSTHROUGH.
+            wait (float, optional): How long to wait for an ffmpeg slot, in seconds.
+            prefetch (bool, optional): Whether the source is opened ahead of time.
+            slot (Union[FFmpegSlot, None], optional): The slot the process was admitted with already, if any.
+
+        Raises:
+            FFmpegBudgetExceededError: No ffmpeg slot was free in time.
+        """
+        self._progress = progress
+        self._reader = GrowingFileReader(progress)
+        self._reopen = reopen
+        self._reopened = False
+        self._frames = 0
+        options = _ffmpeg_options(stream=False)
+        try:
+            if not needs_transcode(media, progress.file, stream=False, passthrough=passthrough):
+                self._source = _admitted(lambda: discord.FFmpegOpusAudio(self._reader, pipe=True, codec='opus', **options),
+                                         False, wait, prefetch, slot)
+            else:
+                self._source = _admitted(lambda: discord.FFmpegPCMAudio(self._reader, pipe=True, **options),
+                                         True, wait, prefetch, slot)
+        except BaseException:
+            self._reader.close()
+            raise
+        # the voice client only sets up its encoder when playback starts, so the kind of audio must not change.
+        self._opus = self._source.is_opus()
+
+    @property
+    def elapsed(self) -> float:
+        """How much of the track has been played, in seconds."""
+        return self._frames * self._FRAME_LENGTH
+
+    def _cut_short(self) -> bool:
+        # the partial file ran out of audio before the track did.
+        return self._reader.stalled or self._progress.failed or not self._progress.done.is_set()
+
+    def read(self) -> bytes:
+        frame = self._source.read()
+        if not frame and not self._reopened and self._cut_short():
+            self._reopened = True
+            if self._reader.stalled:
+                print(f"Download fell behind playback, streaming from {self.elapsed:.1f}s instead")
+            self._source.cleanup()
+            self._reader.close()
+            try:
+                self._source = self._reopen(self.elapsed, self._opus)
+            except Exception as e:
+                print(f"Failed to reopen a progressively played track: {e}")
+                return b''
+            if self._source.is_opus() != self._opus:
+                print("The reopened track does not match the audio it started with")
+                return b''
+            frame = self._source.read()
+        if frame:
+            self._frames += 1
+        return frame
+
+    def is_opus(self) -> bool:
+        return self._opus
+
+    def cleanup(self):
+        self._source.cleanup()
+        self._reader.close()
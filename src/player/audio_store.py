@@ -0,0 +1,252 @@
+import os
+import glob
+import json
+import time
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Set, Tuple, Union
+
+from constants import MUSIC_STORAGE, AUDIO_STORE_QUOTA_BYTES, AUDIO_STORE_INDEX_FILE
+from src.player.coordinator import COORDINATOR, Coordinator
+
+
+_PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp', '.tmp')
+
+
+class AudioStore:
+    """A store of the downloaded audio in MUSIC_STORAGE, keyed by media id and shared by every guild.
+
+    Each guild holds a reference on the entries it has queued. Once the store is over its disk quota,
+    the least recently used entries that no guild references are deleted.
+    The index of the store and the references on it are kept by the coordinator, so every bot process
+    on the host shares them, and downloaded audio survives restarts.
+
+    The coordinator blocks on SQLite and on file locks, so it is only used from a writer thread of the store's own,
+    or from threads that may block, e.g. downloads. The event loop looks media up in a copy of the index kept in memory.
+    """
+    def __init__(self, storage_dir: str = MUSIC_STORAGE, quota_bytes: int = AUDIO_STORE_QUOTA_BYTES,
+                 coordinator: Coordinator = COORDINATOR):
+        """
+        Args:
+            storage_dir (str, optional): The folder the audio files are kept in.
+            quota_bytes (int, optional): How many bytes of audio the store may keep on disk.
+            coordinator (Coordinator, optional): Keeps the index and the references, shared between processes.
+        """
+        self._dir = storage_dir
+        self._quota = quota_bytes
+        # where the index used to be kept, before it was shared - read once, on load.
+        self._index_path = os.path.join(storage_dir, AUDIO_STORE_INDEX_FILE)
+        self._coordinator = coordinator
+        self._lock = threading.RLock()
+        # one writer, so references and evictions reach the coordinator in the order they were made.
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="audio-store")
+
+        # media id -> the guilds of this process holding it, mirrored to the coordinator.
+        self._refs: Dict[str, Set[int]] = defaultdict(set)
+        # media id -> the file name of its audio, as far as this process knows. Files another process downloaded
+        # are added once looked up with find(), and files another process evicted are dropped once found missing.
+        self._files: Dict[str, str] = {}
+        # how many media the shared store holds, how many bytes, and how many are referenced, as last counted.
+        self._usage = (0, 0, 0)
+
+    def load(self):
+        """Checks the shared index against the disk, dropping entries whose file is gone and adopting files it missed.
+        """
+        with self._lock:
+            os.makedirs(self._dir, exist_ok=True)
+            try:
+                with open(self._index_path, 'r') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                saved = {}
+
+            known = self._coordinator.audio_files()
+            gone = [media_id for media_id, (file_name, _, _) in known.items()
+                    if not os.path.isfile(os.path.join(self._dir, file_name))]
+            self._coordinator.remove_audio_files(gone)
+            known_files = {file_name for media_id, (file_name, _, _) in known.items() if media_id not in gone}
+
+            found = {}
+            for media_id, entry in saved.items():
+                fp = os.path.join(self._dir, entry.get('file', ''))
+                if os.path.isfile(fp):
+                    found[media_id] = (entry['file'], os.path.getsize(fp), entry.get('last_used', 0))
+            for fp in glob.glob(os.path.join(self._dir, '*.*')):
+                file_name = os.path.basename(fp)
+                if file_name in known_files or fp == self._index_path or file_name.endswith(_PARTIAL_SUFFIXES):
+                    continue
+                media_id = os.path.splitext(file_name)[0]
+                if media_id not in found:
+                    found[media_id] = (file_name, os.path.getsize(fp), os.path.getmtime(fp))
+            # another process may have indexed the same files meanwhile - its entries are kept.
+            self._coordinator.put_audio_files(found, replace=False)
+            self._files = {media_id: file_name for media_id, (file_name, _, _) in self._coordinator.audio_files().items()}
+            self._evict()
+
+    def _delete_file(self, file_name: str):
+        fp = os.path.join(self._dir, file_name)
+        try:
+            if os.path.isfile(fp) or os.path.islink(fp):
+                os.unlink(fp)
+        except Exception as e:
+            print('Failed to delete %s. Reason: %s' % (fp, e))
+
+    def _evict(self) -> bool:
+        evicted = []
+        _, used = self._coordinator.audio_usage()
+        if used > self._quota:
+            # one process evicts at a time, so two of them never evict for the same overshoot.
+            with self._coordinator.file_lock('audio-store'):
+                _, used = self._coordinator.audio_usage()
+                for media_id, file_name, size in self._coordinator.eviction_candidates():
+                    if used <= self._quota:
+                        break
+                    self._delete_file(file_name)
+                    evicted.append(media_id)
+                    used -= size
+                self._coordinator.remove_audio_files(evicted)
+            with self._lock:
+                for media_id in evicted:
+                    self._files.pop(media_id, None)
+        self._count_usage()
+        return bool(evicted)
+
+    def _count_usage(self):
+        entries, used = self._coordinator.audio_usage()
+        self._usage = (entries, used, self._coordinator.referenced_count())
+
+    def _submit(self, func, *args) -> Future:
+        return self._writer.submit(self._run_logged, func, *args)
+
+    @staticmethod
+    def _run_logged(func, *args):
+        # nothing waits on most of the writes, so their errors would go unnoticed otherwise.
+        try:
+            return func(*args)
+        except Exception as e:
+            print(f"Failed to update the audio store. Reason: {e}")
+
+    def _file_path(self, media_id: str) -> Union[str, None]:
+        with self._lock:
+            file_name = self._files.get(media_id)
+        if file_name is None:
+            return None
+        fp = os.path.join(self._dir, file_name)
+        if not os.path.isfile(fp):
+            # evicted by another process.
+            with self._lock:
+                if self._files.get(media_id) == file_name:
+                    del self._files[media_id]
+            return None
+        return fp
+
+    def contains(self, media_id: str) -> bool:
+        """Checks whether the audio of a media is in the store, without blocking on the coordinator."""
+        return self._file_path(media_id) is not None
+
+    def find(self, media_id: str) -> bool:
+        """Checks whether the audio of a media is in the store, also finding the audio another process downloaded.
+        This blocks on the coordinator, so it must not be called on the event loop.
+        """
+        if self.contains(media_id):
+            return True
+        entry = self._coordinator.audio_file(media_id)
+        if entry is None or not os.path.isfile(os.path.join(self._dir, entry[0])):
+            return False
+        with self._lock:
+            self._files[media_id] = entry[0]
+        return True
+
+    def path_for(self, media_id: str) -> Union[str, None]:
+        """Gets the path of the audio of a media, marking it as recently used.
+
+        Args:
+            media_id (str): The id of the media.
+
+        Returns:
+            Union[str, None]: The path to the audio file, or None if it is not in the store.
+        """
+        fp = self._file_path(media_id)
+        if fp is not None:
+            self._submit(self._coordinator.touch_audio_file, media_id, time.time())
+        return fp
+
+    def register(self, media_id: str) -> bool:
+        """Registers the audio file of a media that has just been downloaded into the storage folder.
+        It is in the store once this returns, and in the shared index once the writer thread gets to it.
+
+        Args:
+            media_id (str): The id of the media.
+
+        Returns:
+            bool: Whether a finished audio file for the media was found.
+        """
+        candidates = [fp for fp in glob.glob(os.path.join(self._dir, f"{glob.escape(media_id)}.*"))
+                      if not fp.endswith(_PARTIAL_SUFFIXES) and fp != self._index_path]
+        if not candidates:
+            return False
+        fp = max(candidates, key=os.path.getmtime)
+        file_name = os.path.basename(fp)
+
+        with self._lock:
+            self._files[media_id] = file_name
+        self._submit(self._put_and_evict, {media_id: (file_name, os.path.getsize(fp), time.time())})
+        return True
+
+    def _put_and_evict(self, entries: Dict[str, Tuple[str, int, float]]):
+        self._coordinator.put_audio_files(entries)
+        self._evict()
+
+    def acquire(self, guild_id: int, media_id: str):
+        """Marks a media as needed by a guild, so it is not evicted."""
+        with self._lock:
+            self._refs[media_id].add(guild_id)
+        self._submit(self._coordinator.add_ref, guild_id, media_id)
+
+    def release(self, guild_id: int, media_id: str):
+        """Marks a media as no longer needed by a guild."""
+        with self._lock:
+            holders = self._refs.get(media_id)
+            if holders is not None:
+                holders.discard(guild_id)
+                if not holders:
+                    del self._refs[media_id]
+        self._submit(self._remove_refs, self._coordinator.remove_ref, guild_id, media_id)
+
+    def release_guild(self, guild_id: int, keep: Iterable[str] = ()):
+        """Releases every media a guild holds, e.g. once the bot has left its voice channel.
+
+        Args:
+            guild_id (int): The guild.
+            keep (Iterable[str], optional): The media the guild still holds, e.g. the song it is playing.
+        """
+        keep = tuple(keep)
+        with self._lock:
+            for media_id in [m for m, holders in self._refs.items() if guild_id in holders and m not in keep]:
+                holders = self._refs[media_id]
+                holders.discard(guild_id)
+                if not holders:
+                    del self._refs[media_id]
+        self._submit(self._remove_refs, self._coordinator.remove_guild_refs, guild_id, keep)
+
+    def _remove_refs(self, remove, *args):
+        remove(*args)
+        self._evict()
+
+    def flush(self):
+        """Waits until the writer thread has passed everything submitted so far on to the coordinator."""
+        self._writer.submit(lambda: None).result()
+
+    def stats(self) -> Dict[str, int]:
+        """The size of the store, as last counted by the writer thread."""
+        entries, used, referenced = self._usage
+        return {
+            'entries': entries,
+            'bytes': used,
+            'quota_bytes': self._quota,
+            'referenced': referenced,
+        }
+
+
+AUDIO_STORE = AudioStore()
@@ -0,0 +1,234 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks, e.g. on Windows - fine for one bot process, which is all the launcher starts there.
+    fcntl = None
+
+from constants import COORDINATOR_DB_LOC, COORDINATOR_LOCK_DIR
+
+
+class Coordinator:
+    """Shares state between the bot processes running on one host, e.g. one per group of shards.
+
+    It keeps a second level of the metadata cache, the index of the audio store and the references guilds hold
+    on its files in an SQLite database in WAL mode, so readers never wait on the writer.
+    File locks make sure a media is downloaded by one process at a time; the OS releases them if a process dies.
+    It works the same with a single process, where it also keeps the metadata cache warm across restarts.
+    """
+    # expired cache entries are purged every so many puts.
+    _PURGE_EVERY = 256
+
+    def __init__(self, db_file: str = COORDINATOR_DB_LOC, lock_dir: str = COORDINATOR_LOCK_DIR):
+        """
+        Args:
+            db_file (str, optional): The location of the shared database.
+            lock_dir (str, optional): The folder the lock files are kept in.
+        """
+        self._db_file = db_file
+        self._lock_dir = lock_dir
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._conn: Union[sqlite3.Connection, None] = None
+        self._puts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per process, shared by its threads under self._lock.
+        if self._conn is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            conn = sqlite3.connect(self._db_file, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(
+                'CREATE TABLE IF NOT EXISTS metadata_cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL);'
+                'CREATE TABLE IF NOT EXISTS audio_files ('
+                'media_id TEXT PRIMARY KEY, file TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL);'
+                'CREATE INDEX IF NOT EXISTS audio_files_last_used ON audio_files (last_used);'
+                'CREATE TABLE IF NOT EXISTS audio_refs ('
+                'media_id TEXT NOT NULL, guild_id INTEGER NOT NULL, pid INTEGER NOT NULL, PRIMARY KEY (media_id, guild_id));'
+                'CREATE TABLE IF NOT EXISTS ffmpeg_usage ('
+                'pid INTEGER PRIMARY KEY, active INTEGER NOT NULL, transcoding INTEGER NOT NULL);'
+            )
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _query(self, sql: str, params: Iterable = ()) -> List[Tuple]:
+        with self._lock:
+            return self._connect().execute(sql, tuple(params)).fetchall()
+
+    # metadata cache
+
+    def cache_get(self, key: str) -> Union[Tuple[Any, float], None]:
+        """Gets a value put into the shared metadata cache by any process.
+
+        Returns:
+            Union[Tuple[Any, float], None]: The value and when it expires, or None if it is not cached or has expired.
+        """
+        rows = self._query('SELECT value, expires_at FROM metadata_cache WHERE key = ? AND expires_at > ?', (key, time.time()))
+        if not rows:
+            return None
+        try:
+            return pickle.loads(rows[0][0]), rows[0][1]
+        except Exception:
+            return None
+
+    def cache_put(self, key: str, value, expires_at: float):
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO metadata_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                         (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at))
+            self._puts += 1
+            if self._puts % self._PURGE_EVERY == 0:
+                conn.execute('DELETE FROM metadata_cache WHERE expires_at <= ?', (time.time(),))
+
+    def cache_invalidate(self, key: str):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM metadata_cache WHERE key = ?', (key,))
+
+    # audio store
+
+    def audio_file(self, media_id: str) -> Union[Tuple[str, int], None]:
+        """Gets the file name and size of a media in the audio store."""
+        rows = self._query('SELECT file, size FROM audio_files WHERE media_id = ?', (media_id,))
+        return rows[0] if rows else None
+
+    def audio_files(self) -> Dict[str, Tuple[str, int, float]]:
+        """Gets every media in the audio store, as media id -> (file name, size, last used)."""
+        return {media_id: (file, size, last_used) for media_id, file, size, last_used
+                in self._query('SELECT media_id, file, size, last_used FROM audio_files')}
+
+    def put_audio_files(self, entries: Dict[str, Tuple[str, int, float]], replace: bool = True):
+        """Adds media to the audio store, as media id -> (file name, size, last used).
+
+        Args:
+            entries (Dict[str, Tuple[str, int, float]]): The media to add.
+            replace (bool, optional): Whether media already in the store are replaced, or left as they are.
+        """
+        with self._transaction() as conn:
+            conn.executemany(
+                f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO audio_files (media_id, file, size, last_used) "
+                f"VALUES (?, ?, ?, ?)",
+                [(media_id, file, size, last_used) for media_id, (file, size, last_used) in entries.items()]
+            )
+
+    def touch_audio_file(self, media_id: str, last_used: float):
+        with self._transaction() as conn:
+            conn.execute('UPDATE audio_files SET last_used = ? WHERE media_id = ?', (last_used, media_id))
+
+    def remove_audio_files(self, media_ids: Iterable[str]):
+        with self._transaction() as conn:
+            conn.executemany('DELETE FROM audio_files WHERE media_id = ?', [(media_id,) for media_id in media_ids])
+
+    def audio_usage(self) -> Tuple[int, int]:
+        """Gets how many media the audio store holds, and how many bytes."""
+        count, size = self._query('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio_files')[0]
+        return count, size
+
+    def eviction_candidates(self) -> List[Tuple[str, str, int]]:
+        """Gets the media no live process references, least recently used first, as (media id, file name, size)."""
+        self._drop_dead_refs()
+        return self._query(
+            'SELECT media_id, file, size FROM audio_files WHERE media_id NOT IN (SELECT media_id FROM audio_refs) '
+            'ORDER BY last_used'
+        )
+
+    def add_ref(self, guild_id: int, media_id: str):
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO audio_refs (media_id, guild_id, pid) VALUES (?, ?, ?)',
+                         (media_id, guild_id, os.getpid()))
+
+    def remove_ref(self, guild_id: int, media_id: str):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM audio_refs WHERE media_id = ? AND guild_id = ?', (media_id, guild_id))
+
+    def remove_guild_refs(self, guild_id: int, keep: Iterable[str] = ()):
+        keep = list(keep)
+        with self._transaction() as conn:
+            conn.execute(f'DELETE FROM audio_refs WHERE guild_id = ? AND media_id NOT IN ({", ".join("?" * len(keep))})',
+                         (guild_id, *keep))
+
+    def referenced_count(self) -> int:
+        return self._query('SELECT COUNT(DISTINCT media_id) FROM audio_refs')[0][0]
+
+    def _drop_dead_refs(self):
+        # the references of a process that died, e.g. one of the launcher's, go with it.
+        dead = [pid for (pid,) in self._query('SELECT DISTINCT pid FROM audio_refs') if not _is_alive(pid)]
+        if dead:
+            with self._transaction() as conn:
+                conn.executemany('DELETE FROM audio_refs WHERE pid = ?', [(pid,) for pid in dead])
+
+    # ffmpeg
+
+    def publish_ffmpeg_usage(self, active: int, transcoding: int):
+        """Publishes how many ffmpeg processes this process is running, for ffmpeg_usage() in any process."""
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO ffmpeg_usage (pid, active, transcoding) VALUES (?, ?, ?)',
+                         (os.getpid(), active, transcoding))
+
+    def ffmpeg_usage(self) -> Dict[str, int]:
+        """Gets how many ffmpeg processes the live bot processes on the host are running, and how many transcode."""
+        rows = [row for row in self._query('SELECT pid, active, transcoding FROM ffmpeg_usage') if _is_alive(row[0])]
+        return {
+            'processes': len(rows),
+            'active': sum(active for _, active, _ in rows),
+            'transcoding': sum(transcoding for _, _, transcoding in rows),
+        }
+
+    # locks
+
+    @contextmanager
+    def file_lock(self, name: str):
+        """Holds an exclusive lock over every process on the host, e.g. on the download of one media.
+        This blocks until the lock is free, so it must not be held on the event loop.
+
+        Args:
+            name (str): What the lock is for. It must be usable as a file name.
+        """
+        os.makedirs(self._lock_dir, exist_ok=True)
+        with open(os.path.join(self._lock_dir, f"{name}.lock"), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def download_lock(self, media_id: str):
+        """Holds the download of a media, so no other process downloads it at the same time."""
+        return self.file_lock(f"download-{media_id}")
+
+
+def _is_alive(pid: int) -> bool:
+    # on Windows, os.kill would terminate the process - its references are kept instead.
+    if pid == os.getpid() or os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+COORDINATOR = Coordinator()
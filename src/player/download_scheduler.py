@@ -0,0 +1,306 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple, Union
+
+from constants import DOWNLOAD_WORKERS, PROGRESSIVE_MIN_BYTES, PROGRESSIVE_RATE_MARGIN
+from src.player.single_flight import IN_FLIGHT
+from src.player.audio_store import AUDIO_STORE
+from src.player.coordinator import COORDINATOR
+from src.player.youtube.media_metadata import MediaMetadata
+from src.player.youtube.extraction_backend import EXTRACTOR
+from src.player.executors import EXECUTORS
+from src.player.metrics import DOWNLOAD_WAIT, DOWNLOAD_DURATION, DOWNLOADS
+
+
+class DownloadCancelledError(Exception):
+    """Raised from the progress hook of a download no guild wants anymore, which stops yt_dlp at its next chunk."""
+
+
+class DownloadProgress:
+    """How far a running download is. It is updated by the yt_dlp progress hooks, from the download's thread.
+    """
+    def __init__(self, min_bytes: int = PROGRESSIVE_MIN_BYTES):
+        """
+        Args:
+            min_bytes (int, optional): How much of the file has to be on disk before it may be played.
+        """
+        self.tmp_file: Union[str, None] = None
+        self.file: Union[str, None] = None
+        self.downloaded = 0
+        self.total: Union[int, None] = None
+        self.started_at = time.monotonic()
+        self.done = threading.Event()
+        self.failed = False
+        self.cancelled = False
+        self._min_bytes = min_bytes
+        self.on_playable = None
+
+    def hook(self, status: dict):
+        if self.cancelled:
+            raise DownloadCancelledError("The download is no longer wanted")
+        was_playable = self.playable
+        self.tmp_file = status.get('tmpfilename') or self.tmp_file
+        self.file = status.get('filename') or self.file
+        self.downloaded = status.get('downloaded_bytes') or self.downloaded
+        self.total = status.get('total_bytes') or status.get('total_bytes_estimate') or self.total
+        if not was_playable and self.playable and self.on_playable is not None:
+            self.on_playable()
+
+    @property
+    def playable(self) -> bool:
+        """Whether enough of the file is on disk to start playing it."""
+        return self.tmp_file is not None and self.downloaded >= self._min_bytes
+
+    def keeps_up(self, duration: Union[int, None]) -> bool:
+        """Checks whether the download stays comfortably ahead of playing the track from its start.
+
+        Args:
+            duration (Union[int, None]): The play time of the track, in seconds.
+        """
+        if self.done.is_set():
+            return not self.failed
+        if not self.total or not duration:
+            return False
+        rate = self.downloaded / max(time.monotonic() - self.started_at, 1e-3)
+        return rate >= self.total / duration * PROGRESSIVE_RATE_MARGIN
+
+
+class _DownloadRequest:
+    __slots__ = ('media', 'etas', 'queued_at', 'task', 'waiters', 'cancelled')
+
+    def __init__(self, media: MediaMetadata):
+        self.media = media
+        # guild id -> seconds until the media plays in that guild.
+        self.etas: Dict[int, int] = {}
+        self.queued_at = time.monotonic()
+        self.task: Union[asyncio.Task, None] = None
+        # futures of the callers waiting on the download, and whether they only wait for it to be playable.
+        self.waiters: List[Tuple[asyncio.Future, bool]] = []
+        # set once no guild wants the media anymore while it is downloading.
+        self.cancelled = False
+
+    @property
+    def eta(self) -> int:
+        return min(self.etas.values())
+
+
+class DownloadScheduler:
+    """Downloads media for every guild with a bounded number of workers.
+
+    Pending downloads are ordered by how soon their media plays in any guild that wants it,
+    so entries near the front of a queue jump ahead of the rest. A download that no guild wants anymore
+    is dropped, or stops being waited on if it is already running.
+    The progress of running downloads is exposed, so their audio can be played while it is being written.
+    """
+    def __init__(self, workers: int = DOWNLOAD_WORKERS):
+        """
+        Args:
+            workers (int, optional): How many downloads may run at the same time.
+        """
+        self._workers = max(1, workers)
+        self._requests: Dict[str, _DownloadRequest] = {}
+        self._progress: Dict[str, DownloadProgress] = {}
+        # (eta, order, media id) - entries whose eta changed since they were pushed are skipped when popped.
+        self._heap: List[Tuple[int, int, str]] = []
+        self._order = itertools.count()
+        self._running = 0
+        # media id -> the request whose download is running, including cancelled ones whose thread has not returned yet.
+        self._active: Dict[str, _DownloadRequest] = {}
+
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._wait_total = 0.0
+        self._download_total = 0.0
+        self._download_max = 0.0
+
+    def sync_guild(self, guild_id: int, entries: Iterable[Tuple[MediaMetadata, int]]):
+        """Sets what a guild needs downloaded, replacing what it needed before.
+
+        Args:
+            guild_id (int): The id of the guild.
+            entries (Iterable[Tuple[MediaMetadata, int]]): The media to download, with the seconds until each one plays.
+        """
+        wanted: Dict[str, Tuple[MediaMetadata, int]] = {}
+        for media, eta in entries:
+            if media.id not in wanted or eta < wanted[media.id][1]:
+                wanted[media.id] = (media, eta)
+
+        for media_id, request in list(self._requests.items()):
+            if guild_id in request.etas and media_id not in wanted:
+                del request.etas[guild_id]
+                if not request.etas:
+                    self._cancel(media_id)
+
+        for media_id, (media, eta) in wanted.items():
+            if AUDIO_STORE.contains(media_id):
+                continue
+            request = self._requests.get(media_id)
+            if request is None:
+                request = self._requests[media_id] = _DownloadRequest(media)
+            old_eta = request.eta if request.etas else None
+            request.etas[guild_id] = eta
+            if request.task is None and request.eta != old_eta:
+                heapq.heappush(self._heap, (request.eta, next(self._order), media_id))
+        self._dispatch()
+
+    def drop_guild(self, guild_id: int):
+        """Drops every download a guild needed, e.g. once its queue is cleared."""
+        self.sync_guild(guild_id, ())
+
+    def progress(self, media_id: str) -> Union[DownloadProgress, None]:
+        """Gets the progress of the download of a media, if it is running."""
+        return self._progress.get(media_id)
+
+    async def wait(self, media: MediaMetadata, guild_id: int, playable: bool = False) -> bool:
+        """Waits for a media to be downloaded, moving it to the front of the line for the guild.
+
+        Args:
+            media (MediaMetadata): The media to wait for.
+            guild_id (int): The id of the guild waiting for it.
+            playable (bool, optional): Only waits until enough of the file is on disk to start playing it.
+
+        Returns:
+            bool: Whether the media is in the audio store, or playable if only that was waited for, afterwards.
+        """
+        if AUDIO_STORE.contains(media.id):
+            return True
+        progress = self._progress.get(media.id)
+        if playable and progress is not None and progress.playable:
+            return True
+        request = self._requests.get(media.id)
+        if request is None:
+            request = self._requests[media.id] = _DownloadRequest(media)
+        request.etas[guild_id] = 0
+        if request.task is None:
+            heapq.heappush(self._heap, (0, next(self._order), media.id))
+        waiter = asyncio.get_running_loop().create_future()
+        request.waiters.append((waiter, playable))
+        self._dispatch()
+        await waiter
+        if AUDIO_STORE.contains(media.id):
+            return True
+        progress = self._progress.get(media.id)
+        return playable and progress is not None and progress.playable
+
+    def _cancel(self, media_id: str):
+        request = self._requests.pop(media_id)
+        self._cancelled += 1
+        DOWNLOADS.inc(outcome='cancelled')
+        if request.task is not None:
+            # a thread cannot be interrupted - the progress hook stops the download at its next chunk, and it keeps
+            # its worker until its thread returns, so cancelled downloads never run past the bound.
+            request.cancelled = True
+            progress = self._progress.pop(media_id, None)
+            if progress is not None:
+                progress.cancelled = True
+        self._wake(request)
+
+    @staticmethod
+    def _wake(request: _DownloadRequest, playable_only: bool = False):
+        for waiter, playable in request.waiters:
+            if (playable or not playable_only) and not waiter.done():
+                waiter.set_result(None)
+        request.waiters = [(waiter, playable) for waiter, playable in request.waiters if not waiter.done()]
+
+    def _on_playable(self, media_id: str):
+        request = self._requests.get(media_id)
+        if request is not None:
+            self._wake(request, playable_only=True)
+
+    def _dispatch(self):
+        while self._running < self._workers and self._heap:
+            eta, _, media_id = heapq.heappop(self._heap)
+            request = self._requests.get(media_id)
+            if request is None or request.task is not None or not request.etas or request.eta != eta:
+                continue
+            if media_id in self._active:
+                # a cancelled download of the media is still stopping - the request is pushed again once it has.
+                continue
+            self._running += 1
+            self._active[media_id] = request
+            request.task = asyncio.ensure_future(self._run(request))
+
+    def _download(self, media: MediaMetadata, progress: DownloadProgress):
+        try:
+            # another bot process on the host may be downloading it - it is then waited for, not downloaded twice.
+            with COORDINATOR.download_lock(media.id):
+                if not AUDIO_STORE.find(media.id) and not progress.cancelled:
+                    EXTRACTOR.download(media, progress.hook)
+                    if progress.cancelled:
+                        raise DownloadCancelledError("The download is no longer wanted")
+                    AUDIO_STORE.register(media.id)
+        except Exception:
+            progress.failed = True
+            raise
+        finally:
+            # only set once the finished file is in the store, so readers of the partial file can switch over to it.
+            progress.done.set()
+
+    async def _run(self, request: _DownloadRequest):
+        media = request.media
+        started_at = time.monotonic()
+        self._started += 1
+        self._wait_total += started_at - request.queued_at
+        DOWNLOAD_WAIT.observe(started_at - request.queued_at)
+        try:
+            await IN_FLIGHT.do(f"download:{media.id}", self._run_download, request)
+            if request.cancelled:
+                return
+            if not AUDIO_STORE.contains(media.id):
+                raise IOError("No audio file was downloaded")
+            elapsed = time.monotonic() - started_at
+            self._completed += 1
+            self._download_total += elapsed
+            self._download_max = max(self._download_max, elapsed)
+            DOWNLOAD_DURATION.observe(elapsed)
+            DOWNLOADS.inc(outcome='completed')
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if not request.cancelled:
+                self._failed += 1
+                DOWNLOADS.inc(outcome='failed')
+                print(f"Failed to download {media.original_url}: {e}")
+        finally:
+            self._running -= 1
+            del self._active[media.id]
+            self._progress.pop(media.id, None)
+            newer = self._requests.get(media.id)
+            if newer is request:
+                del self._requests[media.id]
+            elif newer is not None and newer.task is None and newer.etas:
+                # wanted again while the cancelled download was stopping.
+                heapq.heappush(self._heap, (newer.eta, next(self._order), media.id))
+            self._wake(request)
+            self._dispatch()
+
+    async def _run_download(self, request: _DownloadRequest):
+        media = request.media
+        loop = asyncio.get_running_loop()
+        progress = DownloadProgress()
+        # it may have been cancelled before it got to start.
+        progress.cancelled = request.cancelled
+        if not request.cancelled:
+            self._progress[media.id] = progress
+        progress.on_playable = lambda: loop.call_soon_threadsafe(self._on_playable, media.id)
+        # the scheduler already orders downloads across guilds, so they share one turn on the executor.
+        await EXECUTORS['download'].run(self._download, media, progress)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """The queue depth of the scheduler, its outcome counters, and its latencies in seconds."""
+        return {
+            'pending': sum(1 for request in self._requests.values() if request.task is None),
+            'running': self._running,
+            'workers': self._workers,
+            'completed': self._completed,
+            'failed': self._failed,
+            'cancelled': self._cancelled,
+            'avg_wait': self._wait_total / self._started if self._started else 0.0,
+            'avg_download': self._download_total / self._completed if self._completed else 0.0,
+            'max_download': self._download_max,
+        }
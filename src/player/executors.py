@@ -0,0 +1,142 @@
+import asyncio
+import functools
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Hashable, Union
+
+from constants import SEARCH_EXECUTOR_WORKERS, INFO_EXECUTOR_WORKERS, DOWNLOAD_EXECUTOR_WORKERS
+
+
+class _WorkItem:
+    __slots__ = ('call', 'future', 'queued_at', 'run_time')
+
+    def __init__(self, call, future: asyncio.Future):
+        self.call = call
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.run_time = 0.0
+
+
+class WorkloadExecutor:
+    """A bounded pool of threads for one class of blocking work, e.g. searches or downloads.
+
+    Work waits in a queue of its own for every guild, and the guilds take turns when a thread frees up,
+    so a guild loading a long playlist cannot take every thread away from the others.
+    It is driven from the event loop: work is submitted and its results are handed back there.
+    """
+    def __init__(self, name: str, workers: int):
+        """
+        Args:
+            name (str): The name of the workload class, which its threads are also named after.
+            workers (int): How many pieces of work may run at the same time.
+        """
+        self.name = name
+        self._workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(self._workers, thread_name_prefix=f"{name}-worker")
+        # guild id -> work waiting for a thread, in the order the guilds take turns.
+        self._queues: OrderedDict[Hashable, Deque[_WorkItem]] = OrderedDict()
+        self._running = 0
+
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    async def run(self, func, *args, guild_id: Union[int, None] = None, **kwargs):
+        """Runs a blocking function on a thread of this executor, once it is the guild's turn.
+
+        Args:
+            func: The blocking function.
+            guild_id (Union[int, None], optional): The guild the work is for. Work for no guild in particular shares one turn.
+
+        Returns:
+            The result of the function.
+        """
+        item = _WorkItem(functools.partial(func, *args, **kwargs), asyncio.get_running_loop().create_future())
+        self._queues.setdefault(guild_id, deque()).append(item)
+        self._submitted += 1
+        self._dispatch()
+        return await item.future
+
+    def _next_item(self) -> Union[_WorkItem, None]:
+        while self._queues:
+            guild_id, queue = next(iter(self._queues.items()))
+            item = queue.popleft()
+            if queue:
+                self._queues.move_to_end(guild_id)
+            else:
+                del self._queues[guild_id]
+            # the caller stopped waiting for it, e.g. its command was cancelled.
+            if not item.future.cancelled():
+                return item
+        return None
+
+    def _dispatch(self):
+        while self._running < self._workers:
+            item = self._next_item()
+            if item is None:
+                return
+            waited = time.monotonic() - item.queued_at
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._running += 1
+            future = asyncio.wrap_future(self._pool.submit(self._timed, item))
+            future.add_done_callback(functools.partial(self._finished, item))
+
+    @staticmethod
+    def _timed(item: _WorkItem):
+        started_at = time.monotonic()
+        try:
+            return item.call()
+        finally:
+            item.run_time = time.monotonic() - started_at
+
+    def _finished(self, item: _WorkItem, future: asyncio.Future):
+        self._running -= 1
+        self._run_total += item.run_time
+        self._run_max = max(self._run_max, item.run_time)
+        if future.cancelled() or future.exception() is not None:
+            self._failed += 1
+        else:
+            self._completed += 1
+
+        if not item.future.done():
+            if future.cancelled():
+                item.future.cancel()
+            elif future.exception() is not None:
+                item.future.set_exception(future.exception())
+            else:
+                item.future.set_result(future.result())
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """The load of the executor, and its queue wait and run times in seconds."""
+        finished = self._completed + self._failed
+        started = finished + self._running
+        return {
+            'workers': self._workers,
+            'running': self._running,
+            'queued': sum(len(queue) for queue in self._queues.values()),
+            'queued_guilds': len(self._queues),
+            'submitted': self._submitted,
+            'completed': self._completed,
+            'failed': self._failed,
+            'avg_wait': self._wait_total / started if started else 0.0,
+            'max_wait': self._wait_max,
+            'avg_run': self._run_total / finished if finished else 0.0,
+            'max_run': self._run_max,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+EXECUTORS: Dict[str, WorkloadExecutor] = {
+    'search': WorkloadExecutor('search', SEARCH_EXECUTOR_WORKERS),
+    'info': WorkloadExecutor('info', INFO_EXECUTOR_WORKERS),
+    'download': WorkloadExecutor('download', DOWNLOAD_EXECUTOR_WORKERS),
+}
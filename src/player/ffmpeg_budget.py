@@ -0,0 +1,291 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, Union
+
+from constants import (FFMPEG_PROCESSES_PER_CPU, FFMPEG_TRANSCODES_PER_CPU, FFMPEG_PREFETCH_SHARE,
+                       FFMPEG_ADMISSION_TIMEOUT, FFMPEG_USAGE_PUBLISH_INTERVAL, SHARD_PROCESSES_ENV)
+from src.player.coordinator import COORDINATOR, Coordinator
+from src.player.metrics import FFMPEG_ADMISSION_WAIT
+
+
+class FFmpegBudgetExceededError(Exception):
+    """Error when no ffmpeg process may be started, as the host is running as many as it can handle.
+    """
+    pass
+
+
+class FFmpegSlot:
+    """The admission of one ffmpeg process. It must be released once the process is cleaned up.
+    """
+    __slots__ = ('_budget', 'transcode', '_released')
+
+    def __init__(self, budget: 'FFmpegBudget', transcode: bool):
+        self._budget = budget
+        self.transcode = transcode
+        self._released = False
+
+    def release(self):
+        """Gives the slot back. Releasing a slot more than once does nothing."""
+        if not self._released:
+            self._released = True
+            self._budget._release(self)
+
+
+class _Waiter:
+    """A process waiting for a slot. The slot is handed to it once it is admitted,
+    and it is woken through its future if it waits on an event loop.
+    """
+    __slots__ = ('transcode', 'slot', 'loop', 'future')
+
+    def __init__(self, transcode: bool, loop: Union[asyncio.AbstractEventLoop, None] = None):
+        self.transcode = transcode
+        self.slot: Union[FFmpegSlot, None] = None
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _host_share(limit: int) -> int:
+    # the launcher splits the host between its bot processes, which tells each of them how many there are.
+    processes = int(os.environ.get(SHARD_PROCESSES_ENV) or 1)
+    return max(1, limit // max(1, processes))
+
+
+class FFmpegBudget:
+    """Admission control over the ffmpeg processes the voice clients of every guild start.
+
+    The limits scale with the CPU count of the host, split between the bot processes running on it.
+    Transcoding processes decode and resample audio, and have a limit of their own, far below the one of
+    the processes only copying Opus through. A track waits, up to a timeout, for a slot to free up.
+    The waiting tracks are admitted in the order they came in, except that one waiting on the transcode limit
+    lets the ones behind it that copy Opus through go first. They wait on a thread, or on the event loop.
+    Prefetching the next track is background work, and is skipped once the budget is mostly used.
+    The counts are published to the coordinator, so the ones of the whole host can be read in any process.
+    They are published on a thread of their own, at most once per publish interval, with the changes made meanwhile.
+    """
+    def __init__(self, max_processes: int = _host_share((os.cpu_count() or 1) * FFMPEG_PROCESSES_PER_CPU),
+                 max_transcodes: int = _host_share((os.cpu_count() or 1) * FFMPEG_TRANSCODES_PER_CPU),
+                 prefetch_share: float = FFMPEG_PREFETCH_SHARE, coordinator: Union[Coordinator, None] = COORDINATOR,
+                 publish_interval: float = FFMPEG_USAGE_PUBLISH_INTERVAL):
+        """
+        Args:
+            max_processes (int, optional): How many ffmpeg processes may run at once.
+            max_transcodes (int, optional): How many of them may be transcoding.
+            prefetch_share (float, optional): The share of the slots prefetching may use.
+            coordinator (Union[Coordinator, None], optional): Where the counts are published for the host. None for nowhere.
+            publish_interval (float, optional): How often, at most, the counts are published, in seconds.
+        """
+        self._max_processes = max(1, max_processes)
+        self._max_transcodes = max(1, min(max_transcodes, self._max_processes))
+        self._prefetch_share = prefetch_share
+        self._coordinator = coordinator
+        self._cond = threading.Condition()
+        self._publish_interval = publish_interval
+        self._publisher = ThreadPoolExecutor(1, thread_name_prefix="ffmpeg-usage")
+        self._publish_pending = False
+        # the counts of the whole host, as last read from the coordinator, and when.
+        self._host: Dict[str, int] = {}
+        self._host_read_at = float('-inf')
+
+        self._active = 0
+        self._transcoding = 0
+        self._waiting = 0
+        self._queue: Deque[_Waiter] = deque()
+
+        self._admitted = 0
+        self._rejected = 0
+        self._prefetch_skipped = 0
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _fits(self, transcode: bool, prefetch: bool = False) -> bool:
+        if prefetch and self._active >= self._max_processes * self._prefetch_share:
+            return False
+        if transcode and self._transcoding >= self._max_transcodes:
+            return False
+        return self._active < self._max_processes
+
+    def has_room(self, transcode: bool = False) -> bool:
+        """Whether a process could be started right now, without waiting."""
+        with self._cond:
+            return self._fits(transcode)
+
+    def acquire(self, transcode: bool, timeout: float = FFMPEG_ADMISSION_TIMEOUT, prefetch: bool = False) -> FFmpegSlot:
+        """Takes a slot for an ffmpeg process, waiting for one to free up if needed.
+        This blocks, so it must not be called on the event loop with a timeout - `admit` waits there instead.
+
+        Args:
+            transcode (bool): Whether the process transcodes the audio, rather than copying Opus through.
+            timeout (float, optional): How long to wait for a slot, in seconds.
+            prefetch (bool, optional): Whether the process is background work, which does not wait at all.
+
+        Raises:
+            FFmpegBudgetExceededError: No slot freed up in time.
+        """
+        with self._cond:
+            if prefetch:
+                if not self._fits(transcode, prefetch=True):
+                    self._prefetch_skipped += 1
+                    raise FFmpegBudgetExceededError("Prefetching is paused while ffmpeg is busy")
+                slot = self._take(transcode)
+            elif self._fits(transcode):
+                FFMPEG_ADMISSION_WAIT.observe(0.0)
+                slot = self._take(transcode)
+            else:
+                waiter = self._enqueue(transcode)
+                started_at = time.monotonic()
+                self._cond.wait_for(lambda: waiter.slot is not None, timeout)
+                slot = self._end_wait(waiter, started_at, timeout)
+        self._publish()
+        return slot
+
+    async def admit(self, transcode: bool, timeout: float = FFMPEG_ADMISSION_TIMEOUT) -> FFmpegSlot:
+        """Takes a slot for an ffmpeg process like `acquire`, but waits for it on the event loop instead of blocking.
+
+        Args:
+            transcode (bool): Whether the process transcodes the audio, rather than copying Opus through.
+            timeout (float, optional): How long to wait for a slot, in seconds.
+
+        Raises:
+            FFmpegBudgetExceededError: No slot freed up in time.
+        """
+        with self._cond:
+            if self._fits(transcode):
+                FFMPEG_ADMISSION_WAIT.observe(0.0)
+                slot = self._take(transcode)
+            else:
+                slot = None
+                waiter = self._enqueue(transcode, asyncio.get_running_loop())
+                started_at = time.monotonic()
+        if slot is None:
+            try:
+                await asyncio.wait_for(waiter.future, timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                with self._cond:
+                    self._waiting -= 1
+                    if waiter.slot is None:
+                        self._queue.remove(waiter)
+                if waiter.slot is not None:
+                    waiter.slot.release()
+                raise
+            with self._cond:
+                slot = self._end_wait(waiter, started_at, timeout)
+        self._publish()
+        return slot
+
+    def _take(self, transcode: bool) -> FFmpegSlot:
+        self._active += 1
+        self._transcoding += transcode
+        self._admitted += 1
+        return FFmpegSlot(self, transcode)
+
+    def _enqueue(self, transcode: bool, loop: Union[asyncio.AbstractEventLoop, None] = None) -> _Waiter:
+        waiter = _Waiter(transcode, loop)
+        self._queue.append(waiter)
+        self._waiting += 1
+        return waiter
+
+    def _end_wait(self, waiter: _Waiter, started_at: float, timeout: float) -> FFmpegSlot:
+        self._waiting -= 1
+        waited = time.monotonic() - started_at
+        self._waited += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        FFMPEG_ADMISSION_WAIT.observe(waited)
+        if waiter.slot is None:
+            self._queue.remove(waiter)
+            self._rejected += 1
+            raise FFmpegBudgetExceededError(
+                f"No ffmpeg slot freed up within {timeout}s ({self._active} processes running)")
+        return waiter.slot
+
+    def _admit_waiters(self):
+        # no waiter fits once this is done, so a process that fits when it comes in has no one to queue behind.
+        admitted = False
+        for waiter in list(self._queue):
+            if not self._fits(waiter.transcode):
+                continue
+            self._queue.remove(waiter)
+            if waiter.loop is not None and waiter.loop.is_closed():
+                # no one is left to take the slot.
+                self._waiting -= 1
+                continue
+            waiter.slot = self._take(waiter.transcode)
+            if waiter.loop is not None:
+                waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def _release(self, slot: FFmpegSlot):
+        with self._cond:
+            self._active -= 1
+            self._transcoding -= slot.transcode
+            self._admit_waiters()
+        self._publish()
+
+    def _publish(self):
+        # a publish that is already pending also takes this change along.
+        if self._coordinator is None:
+            return
+        with self._cond:
+            if self._publish_pending:
+                return
+            self._publish_pending = True
+        self._publisher.submit(self._write_usage)
+
+    def _write_usage(self):
+        time.sleep(self._publish_interval)
+        with self._cond:
+            self._publish_pending = False
+            active, transcoding = self._active, self._transcoding
+        try:
+            self._coordinator.publish_ffmpeg_usage(active, transcoding)
+            host = self._coordinator.ffmpeg_usage()
+        except sqlite3.Error as e:
+            print(f"Failed to publish the ffmpeg usage. Reason: {e}")
+            return
+        with self._cond:
+            self._host = host
+            self._host_read_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """The slots in use in this process and on the whole host, and how admission went.
+        The host counts are the ones last read by the publishing thread, which is asked to read them again if they are old.
+        """
+        with self._cond:
+            stale = time.monotonic() - self._host_read_at > self._publish_interval
+        if stale:
+            self._publish()
+        with self._cond:
+            host = self._host
+            return {
+                'active': self._active,
+                'transcoding': self._transcoding,
+                'waiting': self._waiting,
+                'max_processes': self._max_processes,
+                'max_transcodes': self._max_transcodes,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'prefetch_skipped': self._prefetch_skipped,
+                'avg_wait': self._wait_total / self._waited if self._waited else 0.0,
+                'max_wait': self._wait_max,
+                'host_active': host.get('active', self._active),
+                'host_transcoding': host.get('transcoding', self._transcoding),
+                'host_processes': host.get('processes', 1),
+            }
+
+
+FFMPEG_BUDGET = FFmpegBudget()
@@ -0,0 +1,123 @@
+import random
+from typing import Dict, Iterable, List, Union
+
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+class MediaQueue:
+    """A queue of media entries for a guild.
+
+    Taking from and putting back to the front, indexed access and membership checks are O(1),
+    and the total play time of the queued entries is kept up to date as entries come and go.
+    """
+    _MIN_COMPACT_SIZE = 64
+
+    def __init__(self, entries: Iterable[MediaMetadata] = ()):
+        # entries live in self._items[self._head:]; the slots before the head are free.
+        self._items: List[Union[MediaMetadata, None]] = []
+        self._head = 0
+        self._counts: Dict[MediaMetadata, int] = {}
+        self._duration = 0
+        self.extend(entries)
+
+    @staticmethod
+    def _duration_of(entry: MediaMetadata) -> int:
+        return int(entry.duration or 0)
+
+    def _added(self, entry: MediaMetadata):
+        self._counts[entry] = self._counts.get(entry, 0) + 1
+        self._duration += self._duration_of(entry)
+
+    def _removed(self, entry: MediaMetadata):
+        count = self._counts.pop(entry) - 1
+        if count:
+            self._counts[entry] = count
+        self._duration -= self._duration_of(entry)
+
+    def _compact(self):
+        del self._items[:self._head]
+        self._head = 0
+
+    @property
+    def duration(self) -> int:
+        """The total play time of the queued entries, in seconds."""
+        return self._duration
+
+    def __len__(self):
+        return len(self._items) - self._head
+
+    def __bool__(self):
+        return len(self._items) > self._head
+
+    def __iter__(self):
+        for index in range(self._head, len(self._items)):
+            yield self._items[index]
+
+    def __contains__(self, entry):
+        return entry in self._counts
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._items[self._head + i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+        return self._items[self._head + index]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def popleft(self) -> MediaMetadata:
+        """Takes the entry at the front of the queue.
+
+        Raises:
+            IndexError: The queue is empty.
+        """
+        if not self:
+            raise IndexError("pop from an empty queue")
+        entry = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        if self._head >= self._MIN_COMPACT_SIZE and self._head * 2 >= len(self._items):
+            self._compact()
+        self._removed(entry)
+        return entry
+
+    def appendleft(self, entry: MediaMetadata):
+        """Puts an entry back to the front of the queue.
+        """
+        if self._head == 0:
+            # make room in front, proportional to the size of the queue, so this stays amortized O(1).
+            gap = max(self._MIN_COMPACT_SIZE, len(self._items))
+            self._items[0:0] = [None] * gap
+            self._head = gap
+        self._head -= 1
+        self._items[self._head] = entry
+        self._added(entry)
+
+    def append(self, entry: MediaMetadata):
+        self._items.append(entry)
+        self._added(entry)
+
+    def extend(self, entries: Iterable[MediaMetadata]):
+        for entry in entries:
+            self.append(entry)
+
+    def insert_many(self, index: int, entries: List[MediaMetadata]):
+        """Inserts entries at a position of the queue.
+        """
+        index = min(max(index, 0), len(self))
+        self._items[self._head + index:self._head + index] = entries
+        for entry in entries:
+            self._added(entry)
+
+    def clear(self):
+        self._items.clear()
+        self._head = 0
+        self._counts.clear()
+        self._duration = 0
+
+    def shuffle(self):
+        self._compact()
+        random.shuffle(self._items)
@@ -0,0 +1,323 @@
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+from aiohttp import web
+
+from constants import METRICS_HOST, METRICS_PORT, METRICS_PORT_ENV
+
+
+# in seconds, from a cached lookup to a long extraction or download.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DOWNLOAD_BUCKETS = (1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return f"{{{','.join(pairs)}}}" if pairs else ''
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        """
+        Args:
+            name (str): The name of the metric.
+            documentation (str): What the metric measures.
+            labels (Tuple[str, ...], optional): The names of the labels its values are split by.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # the audio threads and the executors update metrics too.
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """The samples of the metric, as (name, formatted labels, value)."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A total that only goes up, e.g. of retries.
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels):
+        """Mirrors a total that is counted elsewhere, e.g. the hits of the metadata cache."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, e.g. the length of the queues.
+    """
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.set_total(value, **labels)
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def clear(self):
+        """Drops every value, e.g. before the values of the labels still in use are set again."""
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    """The distribution of a latency, in cumulative buckets.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Args:
+            name (str): The name of the metric.
+            documentation (str): What the metric measures.
+            labels (Tuple[str, ...], optional): The names of the labels its values are split by.
+            buckets (Tuple[float, ...], optional): The upper bounds of the buckets. +Inf is added.
+        """
+        super().__init__(name, documentation, labels)
+        self._bounds = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [count per bucket, not cumulative, sum].
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            held = self._values.get(key)
+            if held is None:
+                held = self._values[key] = [[0] * len(self._bounds), 0.0]
+            held[0][index] += 1
+            held[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the block under it takes, whether or not it raises."""
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started_at, **labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            held = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in held:
+            cumulative = 0
+            for bound, count in zip(self._bounds, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", _format_labels(self.labels + ('le',), key + (_format_value(bound),)),
+                                cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.labels, key), total))
+            samples.append((f"{self.name}_count", _format_labels(self.labels, key), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """The metrics of the bot, rendered in the Prometheus text format.
+
+    Metrics are updated where the work happens. Values already kept elsewhere, e.g. the counters of the
+    metadata cache or the length of the queues, are copied in by collectors, which run on every scrape.
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        # name -> a callable that updates metrics right before they are rendered.
+        self._collectors: Dict[str, Callable[[], None]] = {}
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is registered already")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def set_collector(self, name: str, collector: Union[Callable[[], None], None]):
+        """Sets the collector of a name, replacing the previous one, e.g. of a reloaded cog. None removes it."""
+        if collector is None:
+            self._collectors.pop(name, None)
+        else:
+            self._collectors[name] = collector
+
+    def render(self) -> str:
+        """Runs the collectors and renders every metric. This runs on the event loop, which the collectors read from.
+        """
+        for name, collector in list(self._collectors.items()):
+            try:
+                collector()
+            except Exception as e:
+                print(f"Failed to collect the {name} metrics. Reason: {e}")
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+def _metrics_port() -> Union[int, None]:
+    # started by launcher.py, each process serves its metrics on a port of its own.
+    if os.environ.get(METRICS_PORT_ENV):
+        return int(os.environ[METRICS_PORT_ENV])
+    return METRICS_PORT
+
+
+class MetricsServer:
+    """Serves the metrics on http://host:port/metrics, for Prometheus to scrape on the host.
+    """
+    _CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, registry: MetricsRegistry, host: str = METRICS_HOST, port: Union[int, None] = _metrics_port()):
+        """
+        Args:
+            registry (MetricsRegistry): The metrics to serve.
+            host (str, optional): The address to listen on. Only the host itself by default.
+            port (Union[int, None], optional): The port to listen on. None serves nothing.
+        """
+        self._registry = registry
+        self._host = host
+        self._port = port
+        self._runner: Union[web.AppRunner, None] = None
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None
+
+    async def start(self):
+        """Starts serving, on the running loop. Starting a running server does nothing."""
+        if self._runner is not None or self._port is None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self._host, self._port).start()
+        except OSError:
+            await runner.cleanup()
+            raise
+        self._runner = runner
+        print(f"Serving metrics on http://{self._host}:{self._port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            runner, self._runner = self._runner, None
+            await runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self._registry.render().encode('utf-8'), headers={'Content-Type': self._CONTENT_TYPE})
+
+
+METRICS = MetricsRegistry()
+METRICS_SERVER = MetricsServer(METRICS)
+
+# the play pipeline, stage by stage.
+REQUEST_WAIT = METRICS.histogram(
+    'musicbot_request_wait_seconds', "Time a play request waited for a free resolution slot.", ('kind',))
+REQUEST_DURATION = METRICS.histogram(
+    'musicbot_request_duration_seconds', "Time from a play request to its entries being queued.", ('kind',))
+EXTRACTION_DURATION = METRICS.histogram(
+    'musicbot_extraction_duration_seconds', "Time yt_dlp took to extract a link, a playlist or a search.", ('kind',))
+EXTRACTION_ERRORS = METRICS.counter(
+    'musicbot_extraction_errors_total', "Extractions that failed.", ('kind',))
+DOWNLOAD_WAIT = METRICS.histogram(
+    'musicbot_download_wait_seconds', "Time a download waited in the download scheduler.", buckets=DOWNLOAD_BUCKETS)
+DOWNLOAD_DURATION = METRICS.histogram(
+    'musicbot_download_duration_seconds', "Time a download took, once started.", buckets=DOWNLOAD_BUCKETS)
+DOWNLOADS = METRICS.counter(
+    'musicbot_downloads_total', "Downloads by how they ended.", ('outcome',))
+VOICE_CONNECT_DURATION = METRICS.histogram(
+    'musicbot_voice_connect_duration_seconds', "Time connecting to a voice channel took.")
+FFMPEG_ADMISSION_WAIT = METRICS.histogram(
+    'musicbot_ffmpeg_admission_wait_seconds', "Time a song waited for an ffmpeg slot.")
+FFMPEG_START_DURATION = METRICS.histogram(
+    'musicbot_ffmpeg_start_duration_seconds', "Time starting an ffmpeg process took.", ('mode',))
+FIRST_AUDIO = METRICS.histogram(
+    'musicbot_time_to_first_audio_seconds', "Time from a play command on an idle player to its first audio frame.")
+TRACK_GAP = METRICS.histogram(
+    'musicbot_track_gap_seconds', "Silence between the end of a song and the first audio frame of the next.")
+TRACKS_STARTED = METRICS.counter(
+    'musicbot_tracks_started_total', "Songs started, by whether their source was prepared ahead.", ('start',))
+PLAY_RETRIES = METRICS.counter(
+    'musicbot_play_retries_total', "Songs played again after their player failed.")
+TRACK_ERRORS = METRICS.counter(
+    'musicbot_track_errors_total', "Songs that could not be played, by why.", ('reason',))
+
+# collected on every scrape, from the state the bot keeps anyway.
+QUEUED_ENTRIES = METRICS.gauge(
+    'musicbot_queued_entries', "Entries waiting in the queues of every guild.")
+LONGEST_QUEUE = METRICS.gauge(
+    'musicbot_longest_queue_entries', "Entries waiting in the longest queue.")
+VOICE_CLIENTS = METRICS.gauge(
+    'musicbot_voice_clients', "Voice channels the bot is connected to.")
+SESSIONS = METRICS.gauge(
+    'musicbot_sessions', "Guild sessions, live or idle in memory, or only saved to disk.", ('state',))
+GATEWAY_LATENCY = METRICS.gauge(
+    'musicbot_gateway_latency_seconds', "Latency of the Discord gateway, by shard.", ('shard',))
+METADATA_CACHE_LOOKUPS = METRICS.counter(
+    'musicbot_metadata_cache_lookups_total', "Lookups of the metadata cache, by how they went.", ('result',))
+METADATA_CACHE_HIT_RATIO = METRICS.gauge(
+    'musicbot_metadata_cache_hit_ratio', "Share of the metadata cache lookups that hit, since startup.")
+METADATA_CACHE_BYTES = METRICS.gauge(
+    'musicbot_metadata_cache_bytes', "Approximate size of the metadata cache.")
+AUDIO_STORE_BYTES = METRICS.gauge(
+    'musicbot_audio_store_bytes', "Size of the downloaded audio on the host.")
+EXECUTOR_TASKS = METRICS.gauge(
+    'musicbot_executor_tasks', "Blocking work by executor and by whether it runs or waits.", ('executor', 'state'))
+DOWNLOADS_ACTIVE = METRICS.gauge(
+    'musicbot_downloads', "Downloads by whether they run or wait.", ('state',))
+FFMPEG_PROCESSES = METRICS.gauge(
+    'musicbot_ffmpeg_processes', "Running ffmpeg processes, in this bot process and on the whole host.", ('scope', 'mode'))
+FFMPEG_WAITING = METRICS.gauge(
+    'musicbot_ffmpeg_waiting', "Songs waiting for an ffmpeg slot.")
+FFMPEG_REJECTIONS = METRICS.counter(
+    'musicbot_ffmpeg_rejections_total', "ffmpeg processes that were not admitted, by what they were for.", ('kind',))
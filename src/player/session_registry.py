@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from constants import SESSION_IDLE_TIMEOUT, SESSION_MEMORY_BUDGET
+
+
+class SessionRegistry:
+    """The sessions of the guilds using the bot, kept least recently used first.
+
+    A session is created on the first use of its guild. Sessions that are not pinned, i.e. not connected
+    to voice nor busy with a request, become evictable once they have not been used for idle_timeout seconds,
+    or, least recently used first, while the sessions together hold more than max_bytes.
+    Evicting a session is up to the caller, which compacts it into a snapshot first.
+    Sessions must provide `approx_bytes()`.
+    """
+    def __init__(self, factory: Callable[[], Any], idle_timeout: float = SESSION_IDLE_TIMEOUT,
+                 max_bytes: int = SESSION_MEMORY_BUDGET):
+        """
+        Args:
+            factory (Callable[[], Any]): Creates the session of a guild.
+            idle_timeout (float, optional): How long a session may go unused before it is evictable, in seconds.
+            max_bytes (int, optional): How many bytes the sessions may hold together.
+        """
+        self._factory = factory
+        self._idle_timeout = idle_timeout
+        self._max_bytes = max_bytes
+        # guarded, as the audio threads look sessions up too.
+        self._lock = threading.Lock()
+        # guild id -> (session, when it was last used), least recently used first.
+        self._sessions: OrderedDict[int, Tuple[Any, float]] = OrderedDict()
+        self._evicted = 0
+
+    def get(self, guild_id: int) -> Union[Any, None]:
+        """Gets the session of a guild, if it has one, and marks it as used."""
+        with self._lock:
+            held = self._sessions.get(guild_id)
+            if held is None:
+                return None
+            self._sessions[guild_id] = (held[0], time.monotonic())
+            self._sessions.move_to_end(guild_id)
+            return held[0]
+
+    def __getitem__(self, guild_id: int):
+        """Gets the session of a guild, creating it if it has none, and marks it as used."""
+        with self._lock:
+            held = self._sessions.get(guild_id)
+            session = held[0] if held is not None else self._factory()
+            self._sessions[guild_id] = (session, time.monotonic())
+            self._sessions.move_to_end(guild_id)
+            return session
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def items(self) -> List[Tuple[int, Any]]:
+        """The guilds and their sessions, least recently used first. This does not mark them as used."""
+        with self._lock:
+            return [(guild_id, held[0]) for guild_id, held in self._sessions.items()]
+
+    def pop(self, guild_id: int, evicted: bool = False) -> Union[Any, None]:
+        """Removes the session of a guild.
+
+        Args:
+            guild_id (int): The guild.
+            evicted (bool, optional): Whether it is removed for being evictable, which is counted.
+        """
+        with self._lock:
+            held = self._sessions.pop(guild_id, None)
+            if held is not None and evicted:
+                self._evicted += 1
+            return held[0] if held is not None else None
+
+    def evictable(self, pinned: Callable[[int, Any], bool]) -> List[int]:
+        """The guilds whose sessions should be evicted, least recently used first.
+
+        Args:
+            pinned (Callable[[int, Any], bool]): Gets whether the session of a guild must stay in memory.
+        """
+        now = time.monotonic()
+        held = self._held()
+        sizes = {guild_id: session.approx_bytes() for guild_id, session, _ in held}
+        total = sum(sizes.values())
+        evictable = []
+        for guild_id, session, last_used in held:
+            if total <= self._max_bytes and now - last_used < self._idle_timeout:
+                continue
+            if pinned(guild_id, session):
+                continue
+            evictable.append(guild_id)
+            total -= sizes[guild_id]
+        return evictable
+
+    def _held(self) -> List[Tuple[int, Any, float]]:
+        with self._lock:
+            return [(guild_id, session, last_used) for guild_id, (session, last_used) in self._sessions.items()]
+
+    def stats(self, pinned: Callable[[int, Any], bool]) -> Dict[str, Union[int, float]]:
+        """The number of live (pinned) and idle sessions, and the bytes they hold.
+
+        Args:
+            pinned (Callable[[int, Any], bool]): Gets whether the session of a guild must stay in memory.
+        """
+        sizes = [(pinned(guild_id, session), session.approx_bytes()) for guild_id, session in self.items()]
+        total = sum(size for _, size in sizes)
+        return {
+            'sessions': len(sizes),
+            'live': sum(1 for live, _ in sizes if live),
+            'idle': sum(1 for live, _ in sizes if not live),
+            'bytes': total,
+            'max_bytes': self._max_bytes,
+            'avg_bytes': total / len(sizes) if sizes else 0.0,
+            'largest_bytes': max((size for _, size in sizes), default=0),
+            'evicted': self._evicted,
+        }
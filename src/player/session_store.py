@@ -0,0 +1,222 @@
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Union
+
+from constants import SESSION_DB_LOC, SESSION_MAX_AGE
+
+
+# bumped whenever the layout of a snapshot changes; snapshots of another version are dropped.
+SNAPSHOT_VERSION = 1
+
+
+class SessionStore:
+    """Snapshots of every guild's session, kept in SQLite so a restart or a reload of the player cog resumes them.
+
+    A snapshot is a small JSON document per guild: the queued entries as (id, title, duration, url),
+    the current entry, and the loop state. How far into the current entry playback was is kept in a row
+    of its own, so a playing guild whose queue did not change only has its position written.
+    Only the guilds whose snapshot changed are written, in one transaction, on a writer thread of their own,
+    which also encodes them. Saved snapshots are read on startup but only decoded once their guild is used again.
+    """
+    def __init__(self, db_file: str = SESSION_DB_LOC, max_age: float = SESSION_MAX_AGE):
+        """
+        Args:
+            db_file (str, optional): The location of the session database.
+            max_age (float, optional): How old a snapshot may get, in seconds, before it is dropped on startup.
+        """
+        self._db_file = db_file
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        # one writer, so snapshots are written in the order they were taken.
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="session-writer")
+
+        # guild id -> the saved snapshot of the guilds that have not been used since startup, still encoded,
+        # or as it was stashed.
+        self._saved: Dict[int, Union[str, dict]] = {}
+        # guild id -> the saved position of the guilds in self._saved.
+        self._positions: Dict[int, float] = {}
+        # guild id -> the snapshot last written, so unchanged ones are not written again.
+        self._written: Dict[int, str] = {}
+        self._dirty = set()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._db_file, timeout=30)
+        # the write-ahead log keeps the last committed snapshots intact if the process dies mid-write.
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def load(self):
+        """Reads the saved snapshots, dropping the ones older than max_age. They are decoded lazily, see take().
+        Snapshots still being written are written first, so a reloaded player cog reads what the unloaded one left.
+        """
+        self._writer.submit(self._load).result()
+
+    def _load(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS guild_sessions ('
+                    'guild_id INTEGER PRIMARY KEY, snapshot TEXT NOT NULL, updated_at REAL NOT NULL)'
+                )
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS guild_positions (guild_id INTEGER PRIMARY KEY, position REAL NOT NULL)'
+                )
+                conn.execute('DELETE FROM guild_sessions WHERE updated_at < ?', (time.time() - self._max_age,))
+                conn.execute('DELETE FROM guild_positions WHERE guild_id NOT IN (SELECT guild_id FROM guild_sessions)')
+            rows = conn.execute('SELECT guild_id, snapshot FROM guild_sessions').fetchall()
+            positions = conn.execute('SELECT guild_id, position FROM guild_positions').fetchall()
+        except sqlite3.Error as e:
+            print(f"Failed to load the saved sessions. Reason: {e}")
+            rows = positions = []
+        finally:
+            conn.close()
+        with self._lock:
+            self._saved = dict(rows)
+            self._positions = dict(positions)
+            self._written = dict(rows)
+
+    def saved_guilds(self) -> List[int]:
+        """The guilds with a saved snapshot that has not been taken yet."""
+        with self._lock:
+            return list(self._saved)
+
+    def take(self, guild_id: int) -> Union[dict, None]:
+        """Takes the saved snapshot of a guild, once. The snapshot stays on disk until the guild's session overwrites it.
+
+        Returns:
+            Union[dict, None]: The decoded snapshot, or None if there is none or it cannot be read.
+        """
+        with self._lock:
+            raw = self._saved.pop(guild_id, None)
+            position = self._positions.pop(guild_id, None)
+        if raw is None:
+            return None
+        if isinstance(raw, dict):
+            return raw
+        try:
+            snapshot = json.loads(raw)
+        except ValueError:
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+            return None
+        # snapshots written before positions got their own rows carry theirs.
+        if position is not None:
+            snapshot['position'] = position
+        return snapshot
+
+    def mark_dirty(self, guild_id: int):
+        """Marks the session of a guild as changed. This is safe to call from any thread.
+        """
+        with self._lock:
+            self._dirty.add(guild_id)
+
+    def take_dirty(self) -> List[int]:
+        """Takes the guilds marked as changed since the last call."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return list(dirty)
+
+    def write(self, snapshots: Dict[int, Union[dict, None]], positions: Union[Dict[int, float], None] = None) -> Future:
+        """Writes snapshots on the writer thread, which encodes them. Snapshots equal to the last written one are skipped.
+        The snapshots must not be changed afterwards.
+
+        Args:
+            snapshots (Dict[int, Union[dict, None]]): guild id -> its snapshot, or None to delete the guild's snapshot.
+            positions (Union[Dict[int, float], None], optional): guild id -> how far into its current entry playback is,
+                for guilds whose snapshot did not change otherwise.
+
+        Returns:
+            Future: Done once the snapshots are written.
+        """
+        return self._writer.submit(self._write, snapshots, positions or {})
+
+    def stash(self, guild_id: int, snapshot: dict) -> Future:
+        """Writes the snapshot of a guild whose session is dropped from memory, e.g. once it went idle.
+        The snapshot is kept as it is, to be taken again as if it had been read on startup.
+
+        Returns:
+            Future: Done once the snapshot is written.
+        """
+        with self._lock:
+            self._saved[guild_id] = snapshot
+            self._positions.pop(guild_id, None)
+        return self._writer.submit(self._write, {guild_id: snapshot}, {})
+
+    @staticmethod
+    def _encode(snapshot: dict) -> str:
+        return json.dumps(snapshot, separators=(',', ':'))
+
+    def _write(self, snapshots: Dict[int, Union[dict, None]], positions: Dict[int, float]):
+        positions = dict(positions)
+        encoded: Dict[int, Union[str, None]] = {}
+        for guild_id, snapshot in snapshots.items():
+            if snapshot is None:
+                encoded[guild_id] = None
+                continue
+            # the position is written to its own row, so a snapshot that only moved on in its song is left as it is.
+            snapshot = {key: value for key, value in snapshot.items() if key != 'position'}
+            positions[guild_id] = snapshots[guild_id].get('position') or 0.0
+            encoded[guild_id] = self._encode(snapshot)
+
+        with self._lock:
+            changes = {guild_id: raw for guild_id, raw in encoded.items()
+                       if raw != self._written.get(guild_id) and not (raw is None and guild_id in self._saved)}
+        deleted = [guild_id for guild_id, raw in encoded.items() if raw is None]
+        for guild_id in deleted:
+            positions.pop(guild_id, None)
+        if not changes and not positions:
+            return
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO guild_sessions (guild_id, snapshot, updated_at) VALUES (?, ?, ?)',
+                    [(guild_id, raw, now) for guild_id, raw in changes.items() if raw is not None]
+                )
+                conn.executemany(
+                    'DELETE FROM guild_sessions WHERE guild_id = ?',
+                    [(guild_id,) for guild_id, raw in changes.items() if raw is None]
+                )
+                conn.executemany(
+                    'DELETE FROM guild_positions WHERE guild_id = ?',
+                    [(guild_id,) for guild_id, raw in changes.items() if raw is None]
+                )
+                conn.executemany(
+                    'INSERT OR REPLACE INTO guild_positions (guild_id, position) VALUES (?, ?)',
+                    list(positions.items())
+                )
+                # a session that keeps playing is still in use, so it is not dropped as too old on the next startup.
+                conn.executemany(
+                    'UPDATE guild_sessions SET updated_at = ? WHERE guild_id = ?',
+                    [(now, guild_id) for guild_id in positions if guild_id not in changes]
+                )
+        except sqlite3.Error as e:
+            print(f"Failed to save the sessions. Reason: {e}")
+            with self._lock:
+                # written again with the next batch.
+                self._dirty.update(changes)
+            return
+        finally:
+            conn.close()
+        with self._lock:
+            for guild_id, raw in changes.items():
+                if raw is None:
+                    self._written.pop(guild_id, None)
+                else:
+                    self._written[guild_id] = raw
+
+    def close(self):
+        """Waits for the snapshots still being written, e.g. on shutdown.
+        """
+        self._writer.shutdown(wait=True)
+
+
+SESSION_STORE = SessionStore()
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Any, Dict, Tuple
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same piece of work, so it only runs once at a time.
+
+    The first caller of a key runs the work. Every caller that comes in while it is still running
+    awaits the same result instead of starting the work again.
+    """
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def is_in_flight(self, key: str) -> bool:
+        return key in self._in_flight
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    async def do(self, key: str, func, *args, **kwargs) -> Tuple[Any, bool]:
+        """Runs the coroutine function for the key, or joins the run that is already in flight.
+
+        Args:
+            key (str): The key identifying the work, e.g. the canonical media id or the query.
+            func: A coroutine function doing the work.
+
+        Returns:
+            Tuple[Any, bool]: The result of the work, and whether it was shared from another caller.
+            Lists are copied for every caller, so callers can modify their own result.
+        """
+        future = self._in_flight.get(key)
+        shared = future is not None
+        if not shared:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # shielded, so one caller being cancelled does not cancel the work for everyone else.
+        result = await asyncio.shield(future)
+        return (list(result) if isinstance(result, list) else result), shared
+
+
+IN_FLIGHT = SingleFlight()
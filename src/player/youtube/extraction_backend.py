@@ -0,0 +1,173 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Union
+
+from constants import EXTRACTION_BACKEND, EXTRACTION_PROCESSES
+from src.player.youtube.media_metadata import MediaMetadata
+from src.player.youtube.ydl_pool import YDL_POOL
+from src.player.metrics import EXTRACTION_DURATION, EXTRACTION_ERRORS
+
+
+# the fields of a yt_dlp progress status that are sent back from worker processes.
+_PROGRESS_FIELDS = ('status', 'tmpfilename', 'filename', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate')
+
+# set in worker processes only, where download progress is reported through it.
+_worker_progress_queue = None
+
+
+def extract_media(url: str, playlist: bool) -> List[MediaMetadata]:
+    """Extracts the media of a video or a playlist url.
+
+    Args:
+        url (str): The url to extract.
+        playlist (bool): Whether the url is a playlist.
+
+    Returns:
+        List[MediaMetadata]: The extracted media, empty if there is nothing playable.
+    """
+    with YDL_POOL.session('info') as ydl:
+        obtained_data: Dict = ydl.extract_info(url, download=False)
+    if obtained_data is None:
+        return []
+    if not playlist:
+        return [MediaMetadata(obtained_data)]
+    return [MediaMetadata(i) for i in obtained_data.get('entries') or [] if i is not None]
+
+
+def extract_flat(url: str) -> List[MediaMetadata]:
+    """Extracts the entries of a playlist flat, i.e. without extracting the entries themselves.
+    """
+    with YDL_POOL.session('flat') as ydl:
+        obtained_data: Dict = ydl.extract_info(url, download=False)
+    if obtained_data is None:
+        return []
+    entries = [MediaMetadata.from_flat_entry(i) for i in obtained_data.get('entries') or [] if i is not None]
+    return [entry for entry in entries if entry.original_url]
+
+
+def extract_search(search_term: str) -> List[MediaMetadata]:
+    """Extracts the results of a search, e.g. 'ytsearch5:query'.
+    """
+    with YDL_POOL.session('search') as ydl:
+        search_res = ydl.extract_info(search_term, download=False)['entries']
+    return [MediaMetadata(i) for i in search_res]
+
+
+# what each extraction function is measured as.
+_EXTRACTION_KINDS = {extract_media: 'info', extract_flat: 'flat', extract_search: 'search'}
+
+
+def _download_in_worker(media_id: str, url: str):
+    def report(status: dict):
+        _worker_progress_queue.put((media_id, {key: status.get(key) for key in _PROGRESS_FIELDS}))
+
+    with YDL_POOL.session('download', progress_hook=report) as ydl:
+        ydl.download([url])
+
+
+def _init_worker(progress_queue):
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+
+
+class ExtractionBackend:
+    """Runs the yt_dlp extractions and downloads, either in the calling thread or in a pool of processes.
+
+    Parsing what yt_dlp fetches is CPU heavy. In a thread, it competes for the GIL with the audio threads
+    of the voice clients, which have to produce a frame every 20 ms. The process backend keeps that work
+    in other interpreters, and only sends the compact MediaMetadata of the results back.
+    """
+    def __init__(self, kind: str = EXTRACTION_BACKEND, processes: int = EXTRACTION_PROCESSES):
+        """
+        Args:
+            kind (str, optional): 'thread' to run in the calling thread, or 'process' to run in worker processes.
+            processes (int, optional): How many worker processes the process backend has.
+        """
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown extraction backend {kind}")
+        self._kind = kind
+        self._processes = max(1, processes)
+        self._lock = threading.Lock()
+        self._pool: Union[ProcessPoolExecutor, None] = None
+        self._progress_queue = None
+        self._progress_hooks: Dict[str, Callable[[dict], None]] = {}
+
+    @property
+    def kind(self) -> str:
+        return self._kind
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawned rather than forked, since the bot process runs threads that a fork would copy mid-work.
+                context = multiprocessing.get_context('spawn')
+                self._progress_queue = context.Queue()
+                self._pool = ProcessPoolExecutor(self._processes, mp_context=context,
+                                                 initializer=_init_worker, initargs=(self._progress_queue,))
+                threading.Thread(target=self._forward_progress, daemon=True).start()
+            return self._pool
+
+    def _forward_progress(self):
+        while True:
+            try:
+                media_id, status = self._progress_queue.get()
+            except (EOFError, OSError, ValueError):
+                return
+            hook = self._progress_hooks.get(media_id)
+            if hook is not None:
+                try:
+                    hook(status)
+                except Exception as e:
+                    # e.g. the download was cancelled - the hook cannot stop a worker process, and must not stop this thread.
+                    print(f"Progress hook of {media_id} failed: {e}")
+
+    def run(self, func, *args):
+        """Runs one of the extraction functions of this module. This blocks until it is done.
+
+        Args:
+            func: The function, which has to be defined at the top level of this module so processes can run it.
+        """
+        kind = _EXTRACTION_KINDS.get(func, func.__name__)
+        started_at = time.monotonic()
+        try:
+            if self._kind == 'thread':
+                return func(*args)
+            return self._get_pool().submit(func, *args).result()
+        except Exception:
+            EXTRACTION_ERRORS.inc(kind=kind)
+            raise
+        finally:
+            EXTRACTION_DURATION.observe(time.monotonic() - started_at, kind=kind)
+
+    def download(self, media: MediaMetadata, progress_hook: Union[Callable[[dict], None], None] = None):
+        """Downloads the audio of a media into the storage folder. This blocks until it is done.
+        Registering the file in the audio store is left to the caller.
+
+        Args:
+            media (MediaMetadata): The media to download.
+            progress_hook (Union[Callable[[dict], None], None], optional): A yt_dlp progress hook for the download.
+        """
+        if self._kind == 'thread':
+            with YDL_POOL.session('download', progress_hook=progress_hook) as ydl:
+                ydl.download([media.original_url])
+            return
+
+        pool = self._get_pool()
+        if progress_hook is not None:
+            self._progress_hooks[media.id] = progress_hook
+        try:
+            pool.submit(_download_in_worker, media.id, media.original_url).result()
+        finally:
+            self._progress_hooks.pop(media.id, None)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._progress_queue.close()
+                self._pool = None
+
+
+EXTRACTOR = ExtractionBackend()
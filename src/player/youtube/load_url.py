@@ -1,6 +1,10 @@
-from yt_dlp import YoutubeDL
-from typing import Dict
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, List, Union
 from src.player.youtube.media_metadata import MediaMetadata
+from src.player.youtube.metadata_cache import METADATA_CACHE, media_key, url_key
+from src.player.youtube.extraction_backend import EXTRACTOR, extract_media, extract_flat
+from src.player.youtube.verify_link import route
 from src.player.observers import DownloaderObservable
 
 
@@ -10,25 +14,118 @@ class LoadURL(DownloaderObservable):
     def __init__(self, url):
         super().__init__()
         self._url = url
-        if "list" in self._url:
+        self._link = route(url)
+        if self._link is not None and self._link.is_playlist:
             self._url_type = "playlist"
         else:
             self._url_type = "video"
-        self.inst = YoutubeDL(
-            {
-                'format':'bestaudio',
-                'ignoreerrors':'only_download'
-            }
-        )
+
+    @property
+    def cache_key(self):
+        # every link to the same video or playlist shares its entry.
+        return url_key(self._link.cache_key if self._link is not None else self._url)
+
+    @property
+    def flat_cache_key(self):
+        return f"{self.cache_key}:flat"
+
+    @property
+    def is_playlist(self):
+        return self._url_type == "playlist"
+
+    @property
+    def playlist_index(self) -> Union[int, None]:
+        """The 1-based position in the playlist the link starts at, if it gives one."""
+        return self._link.index if self._link is not None else None
+
+    def cached_info(self, shared: bool = True) -> Union[List[MediaMetadata], None]:
+        """Looks the link up in the metadata cache, without touching yt_dlp.
+        A video is also found if it was cached by a search or another playlist.
+
+        Args:
+            shared (bool, optional): Whether to look into the level shared between processes, which blocks on SQLite.
+                False on the event loop.
+
+        Returns:
+            Union[List[MediaMetadata], None]: The cached entries, or None on a miss.
+        """
+        cached = METADATA_CACHE.get(self.cache_key, shared)
+        if cached is None and not self.is_playlist and self._link is not None and self._link.site == 'youtube':
+            cached = METADATA_CACHE.get(media_key(self._link.video_id), shared)
+        return cached
 
     def load_info(self):
-        obtained_data : Dict = self.inst.extract_info(self._url, download = False)
+        cached = self.cached_info()
+        if cached is not None:
+            self.notify_observers()
+            return cached
+
+        result = EXTRACTOR.run(extract_media, self._url, self.is_playlist)
         self.notify_observers() # im done mtfk
-        if self._url_type == 'video':
-            if obtained_data is not None:
-                return [MediaMetadata(obtained_data)]
-            else:
-                return []
-        else:
-            return [MediaMetadata(i) for i in obtained_data['entries'] if i is not None]
+        if not result and not self.is_playlist:
+            return []
+
+        METADATA_CACHE.put(self.cache_key, result)
+        for item in result:
+            METADATA_CACHE.put(media_key(item.id), [item])
+        return result
+
+    def load_entries(self) -> List[MediaMetadata]:
+        """Loads the entries of a playlist flat, i.e. without extracting the entries themselves.
+
+        Returns:
+            List[MediaMetadata]: The entries, in playlist order. They carry no direct media url.
+        """
+        cached = METADATA_CACHE.get(self.flat_cache_key)
+        if cached is not None:
+            self.notify_observers()
+            return cached
+
+        result = EXTRACTOR.run(extract_flat, self._url)
+        self.notify_observers()
+        if not result:
+            return []
+
+        METADATA_CACHE.put(self.flat_cache_key, result)
+        return result
+
+
+async def iter_playlist(entries: List[MediaMetadata],
+                        resolve: Callable[[MediaMetadata], Awaitable[List[MediaMetadata]]],
+                        concurrency: int) -> AsyncIterator[List[MediaMetadata]]:
+    """Resolves the entries of a playlist with bounded concurrency, yielding them in playlist order.
+
+    Args:
+        entries (List[MediaMetadata]): The flat entries of the playlist.
+        resolve (Callable[[MediaMetadata], Awaitable[List[MediaMetadata]]]): Resolves a flat entry into its metadata.
+        concurrency (int): How many entries may be resolved at the same time.
+
+    Yields:
+        List[MediaMetadata]: The metadata of each entry, in order. Entries that failed to resolve yield an empty list.
+    """
+    entries_iter = iter(entries)
+    pending = deque()
+
+    def fill():
+        while len(pending) < concurrency:
+            entry = next(entries_iter, None)
+            if entry is None:
+                return
+            pending.append(asyncio.ensure_future(resolve(entry)))
 
+    fill()
+    try:
+        while pending:
+            task = pending.popleft()
+            fill()
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Failed to load a playlist entry: {e}")
+                result = []
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,148 +1,97 @@
+from typing import Union
+
+from src.player.executors import EXECUTORS
+from src.player.youtube.metadata_cache import stream_url_expiry
+from src.player.youtube.ydl_pool import YDL_POOL
+
+
 class MediaMetadata:
-    __slots__ = ('_full_info',
-                 'id',
+    # the fields playback and display use, kept eagerly.
+    __slots__ = ('id',
                  'title',
-                 'formats',
-                 'thumbnails',
-                 'description',
-                 'upload_date',
-                 'uploader',
-                 'uploader_id',
-                 'uploader_url',
-                 'channel_id',
-                 'channel_url',
                  'duration',
-                 'view_count',
-                 'average_rating',
-                 'age_limit',
-                 'webpage_url',
-                 'categories',
-                 'tags',
-                 'playable_in_embed',
-                 'is_live',
-                 'was_live',
-                 'live_status',
-                 'release_timestamp',
-                 'automatic_captions',
-                 'subtitles',
-                 'chapters',
-                 'like_count',
-                 'dislike_count',
-                 'channel',
-                 'track',
-                 'artist',
-                 'album',
-                 'creator',
-                 'alt_title',
-                 'availability',
                  'original_url',
-                 'webpage_url_basename',
-                 'extractor',
-                 'extractor_key',
-                 'playlist',
-                 'playlist_index',
-                 'thumbnail',
-                 'display_id',
-                 'requested_subtitles',
-                 '__has_drm',
-                 'requested_formats',
-                 'format',
-                 'format_id',
-                 'ext',
-                 'width',
-                 'height',
-                 'resolution',
-                 'fps',
-                 'vcodec',
-                 'vbr',
-                 'stretched_ratio',
+                 'url',
+                 'expire',
                  'acodec',
-                 'abr',
-                 'url'
+                 'ext',
+                 '_extra'
                  )
 
+    # small fields, kept only when yt_dlp gave them a value.
+    _LIGHT_FIELDS = ('upload_date', 'uploader', 'uploader_id', 'uploader_url', 'channel_id', 'channel_url',
+                     'view_count', 'average_rating', 'age_limit', 'webpage_url', 'playable_in_embed', 'is_live',
+                     'was_live', 'live_status', 'release_timestamp', 'like_count', 'dislike_count', 'channel',
+                     'track', 'artist', 'album', 'creator', 'alt_title', 'availability', 'webpage_url_basename',
+                     'extractor', 'extractor_key', 'playlist', 'playlist_index', 'thumbnail', 'display_id',
+                     'format', 'format_id', 'width', 'height', 'resolution', 'fps', 'vcodec', 'vbr',
+                     'stretched_ratio', 'abr')
+
+    # large fields, never kept for an entry - fetch_full_info gets them from yt_dlp when they are needed.
+    _HEAVY_FIELDS = ('formats', 'thumbnails', 'description', 'categories', 'tags', 'automatic_captions',
+                     'subtitles', 'chapters', 'requested_subtitles', 'requested_formats')
+
     def __init__(self, info_dict: dict):
         '''
-        Keeps track of the metadata of a YouTube video for ease of access
-        All necessary keys:
-        'id', 'title', 'formats', 'thumbnails', 'description', 'upload_date', 'uploader', 'uploader_id', 'uploader_url',
-         'channel_id', 'channel_url', 'duration', 'view_count', 'average_rating', 'age_limit', 'webpage_url',
-         'categories', 'tags', 'playable_in_embed', 'is_live', 'was_live', 'live_status', 'release_timestamp',
-         'automatic_captions', 'subtitles', 'chapters', 'like_count', 'dislike_count', 'channel', 'track', 'artist',
-         'album', 'creator', 'alt_title', 'availability', 'original_url', 'webpage_url_basename', 'extractor',
-         'extractor_key', 'playlist', 'playlist_index', 'thumbnail', 'display_id', 'requested_subtitles', '__has_drm',
-         'requested_formats', 'format', 'format_id', 'ext', 'width', 'height', 'resolution', 'fps', 'vcodec', 'vbr',
-         'stretched_ratio', 'acodec', 'abr', 'url'
+        Keeps track of the metadata of a YouTube video for ease of access.
+        Only the fields used for playback and display are kept eagerly:
+        'id', 'title', 'duration', 'original_url', 'url', 'acodec', 'ext', and the expiry of 'url'.
+        Other small fields are kept in a compact mapping. Large ones such as 'formats', 'thumbnails',
+        'automatic_captions' and 'subtitles' read as None - the raw info dict is not kept, use fetch_full_info.
         :param info_dict: The dictionary containing the metadata of the video
         '''
-        self._full_info = info_dict
-        self.id = self._setup_variable('id')
-        self.title = self._setup_variable('title')
-        self.formats = self._setup_variable('formats')
-        self.thumbnails = self._setup_variable('thumbnails')
-        self.description = self._setup_variable('description')
-        self.upload_date = self._setup_variable('upload_date')
-        self.uploader = self._setup_variable('uploader')
-        self.uploader_id = self._setup_variable('uploader_id')
-        self.uploader_url = self._setup_variable('uploader_url')
-        self.channel_id = self._setup_variable('channel_id')
-        self.channel_url = self._setup_variable('channel_url')
-        self.duration = self._setup_variable('duration')
-        self.view_count = self._setup_variable('view_count')
-        self.average_rating = self._setup_variable('average_rating')
-        self.age_limit = self._setup_variable('age_limit')
-        self.webpage_url = self._setup_variable('webpage_url')
-        self.categories = self._setup_variable('categories')
-        self.tags = self._setup_variable('tags')
-        self.playable_in_embed = self._setup_variable('playable_in_embed')
-        self.is_live = self._setup_variable('is_live')
-        self.was_live = self._setup_variable('was_live')
-        self.live_status = self._setup_variable('live_status')
-        self.release_timestamp = self._setup_variable('release_timestamp')
-        self.automatic_captions = self._setup_variable('automatic_captions')
-        self.subtitles = self._setup_variable('subtitles')
-        self.chapters = self._setup_variable('chapters')
-        self.like_count = self._setup_variable('like_count')
-        self.dislike_count = self._setup_variable('dislike_count')
-        self.channel = self._setup_variable('channel')
-        self.track = self._setup_variable('track')
-        self.artist = self._setup_variable('artist')
-        self.album = self._setup_variable('album')
-        self.creator = self._setup_variable('creator')
-        self.alt_title = self._setup_variable('alt_title')
-        self.availability = self._setup_variable('availability')
-        self.original_url = self._setup_variable('original_url')
-        self.webpage_url_basename = self._setup_variable('webpage_url_basename')
-        self.extractor = self._setup_variable('extractor')
-        self.extractor_key = self._setup_variable('extractor_key')
-        self.playlist = self._setup_variable('playlist')
-        self.playlist_index = self._setup_variable('playlist_index')
-        self.thumbnail = self._setup_variable('thumbnail')
-        self.display_id = self._setup_variable('display_id')
-        self.requested_subtitles = self._setup_variable('requested_subtitles')
-        self.__has_drm = self._setup_variable('__has_drm')
-        self.requested_formats = self._setup_variable('requested_formats')
-        self.format = self._setup_variable('format')
-        self.format_id = self._setup_variable('format_id')
-        self.ext = self._setup_variable('ext')
-        self.width = self._setup_variable('width')
-        self.height = self._setup_variable('height')
-        self.resolution = self._setup_variable('resolution')
-        self.fps = self._setup_variable('fps')
-        self.vcodec = self._setup_variable('vcodec')
-        self.vbr = self._setup_variable('vbr')
-        self.stretched_ratio = self._setup_variable('stretched_ratio')
-        self.acodec = self._setup_variable('acodec')
-        self.abr = self._setup_variable('abr')
-        self.url = self._setup_variable('url')
-
-    def _setup_variable(self, key):
-        try:
-            return self._full_info[key]
-        except KeyError:
-            return None
-        except TypeError:
+        if not isinstance(info_dict, dict):
+            info_dict = {}
+        self.id = info_dict.get('id')
+        self.title = info_dict.get('title')
+        self.duration = info_dict.get('duration')
+        self.original_url = info_dict.get('original_url') or info_dict.get('webpage_url')
+        self.url = info_dict.get('url')
+        self.expire = stream_url_expiry(self.url)
+        self.acodec = info_dict.get('acodec')
+        self.ext = info_dict.get('ext')
+        self._extra = {key: info_dict[key] for key in self._LIGHT_FIELDS if info_dict.get(key) is not None}
+
+    @classmethod
+    def from_flat_entry(cls, entry: dict) -> 'MediaMetadata':
+        """Creates the metadata of a flat playlist entry, which carries no direct media url.
+        The url is resolved just before the entry is played.
+
+        Args:
+            entry (dict): The flat entry, as yt_dlp gives it with `extract_flat`.
+        """
+        page_url = entry.get('webpage_url') or entry.get('url')
+        if page_url and not page_url.startswith(('http://', 'https://')) and entry.get('ie_key') == 'Youtube':
+            page_url = f"https://www.youtube.com/watch?v={page_url}"
+        media = cls({key: value for key, value in entry.items() if key != 'url'})
+        media.original_url = page_url
+        return media
+
+    def update_stream(self, other: 'MediaMetadata'):
+        """Takes the direct media url, and the fields describing it, from freshly extracted metadata.
+        The id, title and duration are left as they are, since queues hash and total entries by them.
+        """
+        self.url = other.url
+        self.expire = other.expire
+        self.acodec = other.acodec
+        self.ext = other.ext
+
+    def __getstate__(self):
+        # a plain tuple, so entries sent back from extraction processes stay small.
+        return tuple(getattr(self, slot) for slot in MediaMetadata.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(MediaMetadata.__slots__, state):
+            setattr(self, slot, value)
+
+    def __getattr__(self, item):
+        # only called for attributes that are not slots, i.e. the light and heavy fields.
+        if item in MediaMetadata._LIGHT_FIELDS:
+            return self._extra.get(item)
+        if item in MediaMetadata._HEAVY_FIELDS:
+            # not kept - reading one must never block on yt_dlp, fetch_full_info does that explicitly.
             return None
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{item}'")
 
     def __str__(self):
         try:
@@ -156,17 +105,22 @@ class MediaMetadata:
         except TypeError:
             return "None"
 
-    def __eq__(self, o):
-        if isinstance(o, MediaMetadata):
-            if self.id == o.id:
-                return True
-            else:
-                return False
-        else:
-            return False
+    async def fetch_full_info(self, guild_id: Union[int, None] = None) -> dict:
+        """Fetches the full info dict of the media, heavy fields included, from yt_dlp on the 'info' executor.
+
+        Args:
+            guild_id (Union[int, None], optional): The guild the info is fetched for.
+
+        Returns:
+            dict: The info dict, or an empty one if the media has no page url.
+        """
+        if not self.original_url:
+            return {}
+        return await EXECUTORS['info'].run(self._extract_full_info, guild_id=guild_id)
 
-    def to_dict(self):
-        return self._full_info
+    def _extract_full_info(self) -> dict:
+        with YDL_POOL.session('info') as ydl:
+            return ydl.extract_info(self.original_url, download=False) or {}
 
     def to_simple_dict(self):
         return {
@@ -176,7 +130,7 @@ class MediaMetadata:
         }
 
     def __key(self):
-        return (self.id, self.title)       
+        return (self.id, self.title)
 
     def __hash__(self):
         return hash(self.__key())
@@ -185,4 +139,4 @@ class MediaMetadata:
         if isinstance(other, MediaMetadata):
             if self.id == other.id and self.title == other.title:
                 return True
-        return False
\ No newline at end of file
+        return False
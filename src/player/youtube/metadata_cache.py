@@ -0,0 +1,251 @@
+import sqlite3
+import sys
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Union
+from urllib.parse import urlparse, parse_qs
+
+from constants import METADATA_CACHE_MAX_BYTES, METADATA_CACHE_DEFAULT_TTL, STREAM_URL_EXPIRY_MARGIN
+from src.player.coordinator import COORDINATOR, Coordinator
+
+
+def stream_url_expiry(url: Union[str, None]) -> Union[float, None]:
+    """Gets the expiry timestamp of a direct media url.
+
+    googlevideo urls carry it either as an `expire` query parameter or as an `/expire/<ts>/` path segment.
+
+    Args:
+        url (Union[str, None]): The direct media url.
+
+    Returns:
+        Union[float, None]: The unix timestamp the url expires at, or None if the url does not expire.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    try:
+        values = parse_qs(parsed.query).get('expire')
+        if values:
+            return float(values[0])
+        segments = parsed.path.split('/')
+        if 'expire' in segments:
+            return float(segments[segments.index('expire') + 1])
+    except (ValueError, IndexError):
+        pass
+    return None
+
+
+def media_key(media_id: str) -> str:
+    return f"media:{media_id}"
+
+
+def url_key(url: str) -> str:
+    return f"url:{url.strip()}"
+
+
+def query_key(search_key: str, limit: int, query: str) -> str:
+    normalized = " ".join(query.casefold().split())
+    return f"search:{search_key}{limit}:{normalized}"
+
+
+def _approx_size(obj, seen = None) -> int:
+    """Roughly measures how many bytes an object, and everything it holds, takes up."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_approx_size(k, seen) + _approx_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_approx_size(i, seen) for i in obj)
+    elif hasattr(obj, '__slots__'):
+        for slot in obj.__slots__:
+            if hasattr(obj, slot):
+                size += _approx_size(getattr(obj, slot), seen)
+    return size
+
+
+class _CacheEntry:
+    __slots__ = ('value', 'expires_at', 'size')
+
+    def __init__(self, value, expires_at: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class MetadataCache:
+    """An in-process TTL + LRU cache for the metadata obtained from yt_dlp,
+    backed by a second level shared by every bot process on the host.
+
+    The shared level is SQLite, so it is only read by lookups that may block, i.e. off the event loop,
+    and written on a writer thread of the cache's own.
+    """
+    def __init__(self, max_bytes: int = METADATA_CACHE_MAX_BYTES,
+                 default_ttl: float = METADATA_CACHE_DEFAULT_TTL,
+                 expiry_margin: float = STREAM_URL_EXPIRY_MARGIN,
+                 shared: Union[Coordinator, None] = COORDINATOR):
+        """
+        Args:
+            max_bytes (int, optional): The memory budget of the cache. Least recently used entries are evicted past it.
+            default_ttl (float, optional): How long, in seconds, entries without a stream url expiry live for.
+            expiry_margin (float, optional): How long, in seconds, before the stream url expires an entry is dropped.
+            shared (Union[Coordinator, None], optional): Keeps the second level, looked into on misses. None for none.
+        """
+        self._max_bytes = max_bytes
+        self._shared = shared
+        self._default_ttl = default_ttl
+        self._expiry_margin = expiry_margin
+
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="metadata-cache-writer")
+        self._cur_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # the hits found in the shared level, e.g. put there by another process.
+        self.shared_hits = 0
+
+    def _ttl_for(self, value) -> Union[float, None]:
+        """Works out when a value should expire, based on the earliest expiring stream url in it."""
+        items = value if isinstance(value, list) else [value]
+        now = time.time()
+        expiries = [stream_url_expiry(getattr(i, 'url', None)) for i in items]
+        expiries = [e for e in expiries if e is not None]
+        if not expiries:
+            return now + self._default_ttl
+        expires_at = min(expiries) - self._expiry_margin
+        return expires_at if expires_at > now else None
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        self._cur_bytes -= entry.size
+
+    def get(self, key: str, shared: bool = True) -> Any:
+        """Gets a value from the cache.
+
+        Args:
+            key (str): The key of the value.
+            shared (bool, optional): Whether to look into the shared level on a miss, which blocks on SQLite.
+                Lookups on the event loop pass False, and do not count as misses - a blocking lookup follows them.
+
+        Returns:
+            Any: The value, or None if the key is not cached or has expired. Lists are returned as a copy.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry.value
+        if entry is None:
+            if not shared:
+                return None
+            value = self._get_shared(key)
+            if value is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+        return list(value) if isinstance(value, list) else value
+
+    def _get_shared(self, key: str) -> Any:
+        if self._shared is None:
+            return None
+        try:
+            found = self._shared.cache_get(key)
+        except sqlite3.Error as e:
+            print(f"Failed to read the shared metadata cache. Reason: {e}")
+            return None
+        if found is None:
+            return None
+        value, expires_at = found
+        self._put_local(key, value, expires_at)
+        with self._lock:
+            self.hits += 1
+            self.shared_hits += 1
+        return value
+
+    def put(self, key: str, value):
+        """Puts a value into the cache. Values whose stream urls are about to expire are not cached.
+
+        Args:
+            key (str): The key of the value.
+            value: The value to cache.
+        """
+        expires_at = self._ttl_for(value)
+        if expires_at is None:
+            return
+        if isinstance(value, list):
+            value = list(value)
+        self._put_local(key, value, expires_at)
+        if self._shared is not None:
+            self._writer.submit(self._write_shared, self._shared.cache_put, key, value, expires_at)
+
+    @staticmethod
+    def _write_shared(write, *args):
+        try:
+            write(*args)
+        except sqlite3.Error as e:
+            print(f"Failed to write the shared metadata cache. Reason: {e}")
+
+    def _put_local(self, key: str, value, expires_at: float):
+        size = _approx_size(value)
+        if size > self._max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _CacheEntry(value, expires_at, size)
+            self._cur_bytes += size
+            while self._cur_bytes > self._max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+        if self._shared is not None:
+            self._writer.submit(self._write_shared, self._shared.cache_invalidate, key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._cur_bytes = 0
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Gets the counters of the cache.
+
+        Returns:
+            Dict[str, Union[int, float]]: The hit/miss counters, the hit rate and the current size of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._cur_bytes,
+                'max_bytes': self._max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'shared_hits': self.shared_hits,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+METADATA_CACHE = MetadataCache()
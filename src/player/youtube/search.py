@@ -1,6 +1,6 @@
-from yt_dlp import YoutubeDL
 from src.player.observers import DownloaderObservable
-from src.player.youtube.media_metadata import MediaMetadata
+from src.player.youtube.metadata_cache import METADATA_CACHE, media_key, query_key
+from src.player.youtube.extraction_backend import EXTRACTOR, extract_search
 
 
 class SearchVideos(DownloaderObservable):
@@ -16,11 +16,19 @@ class SearchVideos(DownloaderObservable):
         self._search_key = self._SITE_MAPPING[chosen_site]
         self._limit = limit
 
+    def cache_key(self, query):
+        return query_key(self._search_key, self._limit, query)
+
     def search(self, query):
-        ydl = YoutubeDL({
-            'format': 'bestaudio',
-            'ignoreerrors': 'only_download'
-        })
-        search_res = ydl.extract_info(f"{self._search_key}{self._limit}:{query}", download=False)['entries']
+        cached = METADATA_CACHE.get(self.cache_key(query))
+        if cached is not None:
+            self.notify_observers()
+            return cached
+
+        result = EXTRACTOR.run(extract_search, f"{self._search_key}{self._limit}:{query}")
         self.notify_observers()
-        return [MediaMetadata(i) for i in search_res]
\ No newline at end of file
+
+        METADATA_CACHE.put(self.cache_key(query), result)
+        for item in result:
+            METADATA_CACHE.put(media_key(item.id), [item])
+        return result
@@ -0,0 +1,66 @@
+import time
+from typing import List
+
+from constants import STREAM_URL_EXPIRY_MARGIN
+from src.player.youtube.load_url import LoadURL
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+class StreamUnavailableError(Exception):
+    """Error when the direct media url of an entry cannot be resolved
+    """
+    pass
+
+
+class StreamResolver:
+    """Resolves the direct media url of a queue entry shortly before it is played.
+
+    Entries only need a stable identifier (their id and original url) while they wait in queue.
+    Their direct url is fetched when they are about to play, or refreshed if it expires within the margin.
+    """
+    def __init__(self, refresh_margin: float = STREAM_URL_EXPIRY_MARGIN):
+        """
+        Args:
+            refresh_margin (float, optional): How long, in seconds, before it expires a direct url is refreshed.
+        """
+        self._refresh_margin = refresh_margin
+
+    def needs_refresh(self, media: MediaMetadata) -> bool:
+        if not media.url:
+            return True
+        return media.expire is not None and media.expire - self._refresh_margin <= time.time()
+
+    @staticmethod
+    def flight_key(media: MediaMetadata) -> str:
+        return f"stream:{media.id}"
+
+    def resolve(self, media: MediaMetadata) -> str:
+        """Gets a direct media url for an entry that is valid for at least the refresh margin.
+        The entry is updated in place, so every guild holding it benefits from the refresh. This blocks on network I/O.
+
+        Args:
+            media (MediaMetadata): The entry to resolve.
+
+        Raises:
+            StreamUnavailableError: The url could not be resolved.
+
+        Returns:
+            str: The direct media url.
+        """
+        if not self.needs_refresh(media):
+            return media.url
+        if not media.original_url:
+            raise StreamUnavailableError(f"{media.title} has no url to resolve its stream from")
+
+        try:
+            fresh: List[MediaMetadata] = LoadURL(media.original_url).load_info()
+        except Exception as e:
+            raise StreamUnavailableError(f"Failed to resolve the stream of {media.title}: {e}")
+        if not fresh or not fresh[0].url:
+            raise StreamUnavailableError(f"{media.title} has no playable stream")
+
+        media.update_stream(fresh[0])
+        return media.url
+
+
+STREAM_RESOLVER = StreamResolver()
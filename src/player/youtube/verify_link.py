@@ -1,7 +1,23 @@
 import re
+from typing import Union
 
-_YOUTUBE_VALID_LINK_REGEX = r'^((?:https?:)?\/\/)?((?:www|m)\.)?((?:youtube\.com|youtu.be))(\/(?:[\w\-]+\?v=|embed\/|v\/)?)([\w\-]+)(\S+)?$'
-_BILIBILI_VALID_LINK_REGEX = r'''(?x)
+# patterns are compiled once, at import.
+_YOUTUBE_LINK = re.compile(r'''(?x)
+                    ^(?:https?:)?(?://)?
+                    (?:
+                        (?:(?:www|m|music)\.)?youtube(?:-nocookie)?\.com/
+                        (?:
+                            (?:watch|playlist|watch_videos)/?|
+                            (?:embed|v|shorts|live)/(?P<path_id>[\w-]{11})/?
+                        )|
+                        (?:www\.)?youtu\.be/(?P<short_id>[\w-]{11})/?
+                    )
+                    (?:\?(?P<query>[^\s\#]*))?(?:\#\S*)?$
+                    ''', re.IGNORECASE)
+_QUERY_VIDEO_ID = re.compile(r'(?:^|&)v=([\w-]{11})(?:&|$)')
+_QUERY_PLAYLIST_ID = re.compile(r'(?:^|&)list=([\w-]+)(?:&|$)')
+_QUERY_INDEX = re.compile(r'(?:^|&)index=([1-9]\d*)(?:&|$)')
+_BILIBILI_VALID_LINK_REGEX = re.compile(r'''(?x)
                     https?://
                         (?:(?:www|bangumi)\.)?
                         bilibili\.(?:tv|com)/
@@ -13,9 +29,92 @@ _BILIBILI_VALID_LINK_REGEX = r'''(?x)
                             (s/)?video/[bB][vV](?P<id_bv>[^/?#&]+)
                         )
                         (?:/?\?p=(?P<page>\d+))?
-                    '''
+                    ''')
 SUPPORTED_SITES = ["youtube", "bilibili"]
 
 
+class LinkInfo:
+    """What a supported link points to, read from the link alone.
+    """
+    __slots__ = ('site', 'video_id', 'playlist_id', 'index')
+
+    def __init__(self, site: str, video_id: Union[str, None] = None, playlist_id: Union[str, None] = None,
+                 index: Union[int, None] = None):
+        """
+        Args:
+            site (str): One of SUPPORTED_SITES.
+            video_id (Union[str, None], optional): The id of the linked video, if any.
+            playlist_id (Union[str, None], optional): The id of the linked playlist, if any.
+            index (Union[int, None], optional): The 1-based position in the playlist the link starts at, if any.
+        """
+        self.site = site
+        self.video_id = video_id
+        self.playlist_id = playlist_id
+        self.index = index
+
+    @property
+    def is_playlist(self) -> bool:
+        return self.playlist_id is not None
+
+    @property
+    def cache_key(self) -> str:
+        """A key that is the same for every link to the same video or playlist, e.g. youtu.be and youtube.com links.
+        """
+        if self.is_playlist:
+            return f"{self.site}:playlist:{self.playlist_id}"
+        return f"{self.site}:video:{self.video_id}"
+
+    def __repr__(self):
+        return (f"LinkInfo(site={self.site!r}, video_id={self.video_id!r}, "
+                f"playlist_id={self.playlist_id!r}, index={self.index!r})")
+
+
+def _route_youtube(link: str) -> Union[LinkInfo, None]:
+    match = _YOUTUBE_LINK.match(link)
+    if match is None:
+        return None
+    query = match.group('query') or ''
+    video_id = match.group('path_id') or match.group('short_id')
+    if video_id is None:
+        found = _QUERY_VIDEO_ID.search(query)
+        video_id = found.group(1) if found else None
+    found = _QUERY_PLAYLIST_ID.search(query) if 'list=' in query else None
+    playlist_id = found.group(1) if found else None
+    if video_id is None and playlist_id is None:
+        return None
+
+    index = None
+    if playlist_id is not None:
+        found = _QUERY_INDEX.search(query)
+        index = int(found.group(1)) if found else None
+    return LinkInfo('youtube', video_id, playlist_id, index)
+
+
+def _route_bilibili(link: str) -> Union[LinkInfo, None]:
+    match = _BILIBILI_VALID_LINK_REGEX.search(link)
+    if match is None:
+        return None
+    video_id = f"BV{match.group('id_bv')}" if match.group('id_bv') else f"av{match.group('id')}"
+    if match.group('page'):
+        video_id = f"{video_id}_p{match.group('page')}"
+    return LinkInfo('bilibili', video_id)
+
+
+def route(link: str) -> Union[LinkInfo, None]:
+    """Reads what a link points to, without any network I/O.
+
+    Args:
+        link (str): The link, e.g. a youtube.com, youtu.be, music.youtube.com or bilibili.com one.
+
+    Returns:
+        Union[LinkInfo, None]: What the link points to, or None if it is not a supported link.
+    """
+    link = link.strip()
+    info = _route_youtube(link)
+    if info is None and 'bilibili.' in link:
+        info = _route_bilibili(link)
+    return info
+
+
 def is_valid_link(link:str):
-    return bool(re.search(_YOUTUBE_VALID_LINK_REGEX, link)) or bool(re.search(_BILIBILI_VALID_LINK_REGEX, link))
\ No newline at end of file
+    return route(link) is not None
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Union
+
+from yt_dlp import YoutubeDL
+
+from constants import MUSIC_STORAGE, YDL_POOL_SIZE, YDL_MAX_USES
+
+
+# the option sets YoutubeDL instances are made with, one set of instances per profile.
+# the native audio container is kept as is when downloading, so Opus audio can be passed through on playback.
+YDL_PROFILES: Dict[str, dict] = {
+    'search': {
+        'format': 'bestaudio[acodec=opus]/bestaudio',
+        'ignoreerrors': 'only_download',
+    },
+    'info': {
+        'format': 'bestaudio[acodec=opus]/bestaudio',
+        'ignoreerrors': 'only_download',
+    },
+    'flat': {
+        'extract_flat': 'in_playlist',
+        'ignoreerrors': 'only_download',
+    },
+    'download': {
+        'format': 'bestaudio[acodec=opus]/bestaudio/best',
+        'outtmpl': os.path.join(MUSIC_STORAGE, '%(id)s.%(ext)s'),
+    },
+}
+
+
+class _PooledInstance:
+    __slots__ = ('ydl', 'progress_hook', 'uses', 'errors', 'busy_time', 'created_at')
+
+    def __init__(self, params: dict):
+        self.progress_hook: Union[Callable[[dict], None], None] = None
+        # the hook is fixed at creation, and forwards to whoever borrows the instance.
+        self.ydl = YoutubeDL(dict(params, progress_hooks=[self._on_progress]))
+        self.uses = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.created_at = time.time()
+
+    def _on_progress(self, status: dict):
+        if self.progress_hook is not None:
+            self.progress_hook(status)
+
+
+class YoutubeDLPool:
+    """Keeps warmed YoutubeDL instances for every option profile, and lends each one to one thread at a time.
+
+    Reusing instances skips registering the extractors and parsing the options again for every request,
+    and keeps their HTTP connections open between requests. Instances are replaced after a number of uses,
+    so what they accumulate over time stays bounded.
+    """
+    def __init__(self, profiles: Dict[str, dict] = YDL_PROFILES, size: int = YDL_POOL_SIZE, max_uses: int = YDL_MAX_USES):
+        """
+        Args:
+            profiles (Dict[str, dict], optional): The YoutubeDL options of every profile, by profile name.
+            size (int, optional): How many instances each profile may have.
+            max_uses (int, optional): How many times an instance is used before it is replaced.
+        """
+        self._profiles = profiles
+        self._size = max(1, size)
+        self._max_uses = max_uses
+        self._lock = threading.Condition()
+        self._idle: Dict[str, List[_PooledInstance]] = {profile: [] for profile in profiles}
+        self._busy: Dict[str, List[_PooledInstance]] = {profile: [] for profile in profiles}
+        # instances that are idle, in use, or being made.
+        self._created: Dict[str, int] = dict.fromkeys(profiles, 0)
+        self._waits: Dict[str, int] = dict.fromkeys(profiles, 0)
+        self._wait_time: Dict[str, float] = dict.fromkeys(profiles, 0.0)
+        self._retired: Dict[str, int] = dict.fromkeys(profiles, 0)
+
+    def _acquire(self, profile: str) -> _PooledInstance:
+        if profile not in self._profiles:
+            raise KeyError(f"Unknown YoutubeDL profile {profile}")
+        with self._lock:
+            waited_since = None
+            while not self._idle[profile] and self._created[profile] >= self._size:
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self._waits[profile] += 1
+                self._lock.wait()
+            if waited_since is not None:
+                self._wait_time[profile] += time.monotonic() - waited_since
+
+            if self._idle[profile]:
+                # the most recently used instance is the most likely to still have its connections open.
+                instance = self._idle[profile].pop()
+                self._busy[profile].append(instance)
+                return instance
+            self._created[profile] += 1
+
+        # made outside of the lock, since registering the extractors is the slow part.
+        try:
+            instance = _PooledInstance(self._profiles[profile])
+        except Exception:
+            with self._lock:
+                self._created[profile] -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._busy[profile].append(instance)
+        return instance
+
+    def _release(self, profile: str, instance: _PooledInstance):
+        with self._lock:
+            self._busy[profile].remove(instance)
+            if instance.uses >= self._max_uses:
+                self._retired[profile] += 1
+                self._created[profile] -= 1
+            else:
+                self._idle[profile].append(instance)
+            self._lock.notify()
+
+    @contextmanager
+    def session(self, profile: str, progress_hook: Union[Callable[[dict], None], None] = None) -> Iterator[YoutubeDL]:
+        """Borrows a YoutubeDL instance of a profile, waiting for one if all of them are in use.
+
+        Args:
+            profile (str): The name of the profile, e.g. 'search', 'info', 'flat' or 'download'.
+            progress_hook (Union[Callable[[dict], None], None], optional): A yt_dlp progress hook for the downloads made with the instance.
+
+        Yields:
+            YoutubeDL: The instance, only to be used by the borrowing thread until it is given back.
+        """
+        instance = self._acquire(profile)
+        instance.progress_hook = progress_hook
+        started_at = time.monotonic()
+        try:
+            yield instance.ydl
+        except Exception:
+            instance.errors += 1
+            raise
+        finally:
+            instance.progress_hook = None
+            instance.uses += 1
+            instance.busy_time += time.monotonic() - started_at
+            self._release(profile, instance)
+
+    def stats(self) -> Dict[str, Dict]:
+        """The instances of every profile and their usage."""
+        with self._lock:
+            result = {}
+            for profile in self._profiles:
+                instances = self._idle[profile] + self._busy[profile]
+                result[profile] = {
+                    'instances': len(instances),
+                    'in_use': len(self._busy[profile]),
+                    'retired': self._retired[profile],
+                    'waits': self._waits[profile],
+                    'wait_time': self._wait_time[profile],
+                    'per_instance': [
+                        {'uses': i.uses, 'errors': i.errors, 'busy_time': i.busy_time, 'age': time.time() - i.created_at}
+                        for i in instances
+                    ],
+                }
+            return result
+
+
+YDL_POOL = YoutubeDLPool()
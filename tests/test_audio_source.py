@@ -0,0 +1,111 @@
+import io
+import threading
+
+import pytest
+
+discord = pytest.importorskip('discord')
+
+from src.player import audio_source
+from src.player.ffmpeg_budget import FFmpegBudget
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+class _FakeProcess:
+    pid = 0
+    returncode = 0
+
+    def __init__(self):
+        self.stdout = io.BytesIO()
+        self.stdin = None
+
+    def kill(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def poll(self):
+        return 0
+
+    def wait(self, timeout=None):
+        return 0
+
+    def communicate(self, *args, **kwargs):
+        return b'', b''
+
+
+class _FinishedDownload:
+    """The progress of a download that is done, whose file has been read through."""
+    tmp_file = None
+    file = None
+    failed = False
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.done.set()
+
+
+@pytest.fixture
+def spawned(monkeypatch):
+    """The argv of every ffmpeg process the test starts. No process is actually started."""
+    argv = []
+
+    def spawn(self, args, **kwargs):
+        argv.append(list(args))
+        return _FakeProcess()
+
+    monkeypatch.setattr(discord.player.FFmpegAudio, '_spawn_process', spawn)
+    monkeypatch.setattr(audio_source, 'FFMPEG_BUDGET', FFmpegBudget(coordinator=None))
+    return argv
+
+
+def _codec(args):
+    return args[args.index('-c:a') + 1]
+
+
+def test_opus_passthrough_copies_the_audio(spawned):
+    media = MediaMetadata({'id': 'abc', 'title': 'Song', 'acodec': 'opus', 'ext': 'webm'})
+    source = audio_source.create_source(media, 'abc.webm', stream=False, passthrough=True)
+    try:
+        assert source.is_opus()
+        assert _codec(spawned[0]) == 'copy'
+    finally:
+        source.cleanup()
+
+
+def test_other_audio_is_transcoded_to_pcm(spawned):
+    media = MediaMetadata({'id': 'abc', 'title': 'Song', 'acodec': 'mp4a.40.2', 'ext': 'm4a'})
+    source = audio_source.create_source(media, 'abc.m4a', stream=False, passthrough=True)
+    try:
+        assert not source.is_opus()
+        assert 's16le' in spawned[0]
+    finally:
+        source.cleanup()
+
+
+def test_progressive_source_ends_with_a_finished_download(spawned):
+    media = MediaMetadata({'id': 'abc', 'title': 'Song', 'acodec': 'mp4a.40.2', 'ext': 'm4a'})
+    reopened = []
+
+    def reopen(at, opus):
+        reopened.append(at)
+        return audio_source.create_source(media, 'abc.m4a', stream=False, passthrough=opus, start=at)
+
+    source = audio_source.ProgressiveSource(media, _FinishedDownload(), reopen)
+    try:
+        assert source.read() == b''
+        assert not reopened
+    finally:
+        source.cleanup()
+
+
+def test_source_uses_the_slot_it_was_admitted_with(spawned):
+    budget = audio_source.FFMPEG_BUDGET
+    media = MediaMetadata({'id': 'abc', 'title': 'Song', 'acodec': 'mp4a.40.2', 'ext': 'm4a'})
+    slot = budget.acquire(transcode=True, timeout=0)
+
+    source = audio_source.create_source(media, 'abc.m4a', stream=False, passthrough=True, wait=0, slot=slot)
+    assert budget.stats()['active'] == 1
+    source.cleanup()
+
+    assert budget.stats()['active'] == 0
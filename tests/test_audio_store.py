@@ -0,0 +1,80 @@
+import threading
+
+from src.player.audio_store import AudioStore
+from src.player.coordinator import Coordinator
+
+
+class _RecordingCoordinator(Coordinator):
+    """A coordinator that records the threads it is called from."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = set()
+
+    def _query(self, *args, **kwargs):
+        self.threads.add(threading.current_thread().name)
+        return super()._query(*args, **kwargs)
+
+    def _transaction(self):
+        self.threads.add(threading.current_thread().name)
+        return super()._transaction()
+
+
+def _store(tmp_path, quota_bytes=1024):
+    coordinator = _RecordingCoordinator(str(tmp_path / 'coordinator.db'), str(tmp_path / 'locks'))
+    storage = tmp_path / 'music'
+    storage.mkdir()
+    return AudioStore(str(storage), quota_bytes, coordinator), coordinator, storage
+
+
+def test_bookkeeping_runs_on_the_writer_thread(tmp_path):
+    store, coordinator, storage = _store(tmp_path)
+    (storage / 'abc.webm').write_bytes(b'x' * 100)
+
+    store.register('abc')
+    store.acquire(1, 'abc')
+    assert store.contains('abc')
+    assert store.path_for('abc') == str(storage / 'abc.webm')
+    store.release(1, 'abc')
+    store.release_guild(1)
+    store.flush()
+
+    assert coordinator.threads and all(name.startswith('audio-store') for name in coordinator.threads)
+    assert coordinator.audio_file('abc') == ('abc.webm', 100)
+    assert store.stats()['bytes'] == 100
+
+
+def test_unreferenced_audio_over_quota_is_evicted(tmp_path):
+    store, coordinator, storage = _store(tmp_path, quota_bytes=150)
+    for media_id in ('abc', 'def'):
+        (storage / f'{media_id}.webm').write_bytes(b'x' * 100)
+    store.acquire(1, 'def')
+
+    store.register('abc')
+    store.register('def')
+    store.flush()
+
+    assert not store.contains('abc')
+    assert store.contains('def')
+    assert store.stats()['entries'] == 1
+
+
+def test_find_sees_audio_another_process_stored(tmp_path):
+    store, coordinator, storage = _store(tmp_path)
+    (storage / 'abc.webm').write_bytes(b'x' * 100)
+    coordinator.put_audio_files({'abc': ('abc.webm', 100, 0.0)})
+
+    assert not store.contains('abc')
+    assert store.find('abc')
+    assert store.contains('abc')
+
+
+def test_release_guild_keeps_the_media_asked_for(tmp_path):
+    store, coordinator, storage = _store(tmp_path)
+    store.acquire(1, 'abc')
+    store.acquire(1, 'def')
+
+    store.release_guild(1, keep=['abc'])
+    store.flush()
+
+    assert coordinator.referenced_count() == 1
+    assert store._refs == {'abc': {1}}
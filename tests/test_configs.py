@@ -0,0 +1,22 @@
+from src import configs
+from src.configs import Config
+
+
+def test_exit_handler_writes_pending_settings(tmp_path):
+    config = Config(tmp_path / 'config.db', legacy_config_file=tmp_path / 'missing.ini', flush_delay=3600)
+    config.set_state(1)
+
+    configs._close_open_configs()
+
+    assert not Config(tmp_path / 'config.db', legacy_config_file=tmp_path / 'missing.ini').isAutoPick(1)
+
+
+def test_closed_config_is_not_closed_again_on_exit(tmp_path):
+    first = Config(tmp_path / 'config.db', legacy_config_file=tmp_path / 'missing.ini')
+    second = Config(tmp_path / 'config.db', legacy_config_file=tmp_path / 'missing.ini')
+
+    first.close()
+
+    assert first not in configs._OPEN_CONFIGS
+    assert second in configs._OPEN_CONFIGS
+    second.close()
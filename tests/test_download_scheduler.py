@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.player import download_scheduler
+from src.player.download_scheduler import DownloadCancelledError, DownloadProgress, DownloadScheduler
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+class _EmptyStore:
+    def contains(self, media_id):
+        return False
+
+
+def _media(video_id):
+    return MediaMetadata({'id': video_id, 'title': video_id, 'duration': 60})
+
+
+def test_cancelled_progress_stops_the_download():
+    progress = DownloadProgress()
+    progress.hook({'downloaded_bytes': 1})
+    progress.cancelled = True
+
+    with pytest.raises(DownloadCancelledError):
+        progress.hook({'downloaded_bytes': 2})
+
+
+def test_cancelled_download_keeps_its_worker_until_its_thread_returns(monkeypatch):
+    monkeypatch.setattr(download_scheduler, 'AUDIO_STORE', _EmptyStore())
+    release = threading.Event()
+    started = []
+
+    def download(media, progress):
+        started.append(media.id)
+        release.wait(5)
+
+    scheduler = DownloadScheduler(workers=1)
+    monkeypatch.setattr(scheduler, '_download', download)
+
+    async def cancel_then_queue_another():
+        scheduler.sync_guild(1, [(_media('a'), 0)])
+        await asyncio.sleep(0.05)
+        scheduler.drop_guild(1)
+        scheduler.sync_guild(1, [(_media('b'), 0)])
+        await asyncio.sleep(0.05)
+        during = (list(started), scheduler.stats()['running'])
+        release.set()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if 'b' in started:
+                break
+        return during
+
+    started_during, running_during = asyncio.run(cancel_then_queue_another())
+
+    assert started_during == ['a']
+    assert running_during == 1
+    assert started == ['a', 'b']
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.player.ffmpeg_budget import FFmpegBudget, FFmpegBudgetExceededError
+
+
+class _Coordinator:
+    """Records the counts published to it, and the threads they were published from."""
+    def __init__(self):
+        self.published = []
+        self.threads = set()
+
+    def publish_ffmpeg_usage(self, active, transcoding):
+        self.published.append((active, transcoding))
+        self.threads.add(threading.current_thread().name)
+
+    def ffmpeg_usage(self):
+        active, transcoding = self.published[-1]
+        return {'processes': 1, 'active': active, 'transcoding': transcoding}
+
+
+def test_usage_is_published_in_batches_off_the_calling_thread():
+    coordinator = _Coordinator()
+    budget = FFmpegBudget(max_processes=8, max_transcodes=4, coordinator=coordinator, publish_interval=0.05)
+
+    for _ in range(50):
+        budget.acquire(transcode=True, timeout=0).release()
+    slot = budget.acquire(transcode=False, timeout=0)
+    time.sleep(0.3)
+
+    assert 1 <= len(coordinator.published) <= 3
+    assert coordinator.published[-1] == (1, 0)
+    assert all(name.startswith('ffmpeg-usage') for name in coordinator.threads)
+    assert budget.stats()['host_active'] == 1
+    slot.release()
+
+
+def test_no_coordinator_publishes_nothing():
+    budget = FFmpegBudget(max_processes=2, max_transcodes=1, coordinator=None)
+
+    budget.acquire(transcode=True, timeout=0).release()
+
+    assert budget.stats()['host_processes'] == 1
+
+
+def test_waiters_are_admitted_in_turn_on_the_event_loop():
+    budget = FFmpegBudget(max_processes=2, max_transcodes=1, coordinator=None)
+    admitted = []
+
+    async def wait_for_slot(name, transcode):
+        slot = await budget.admit(transcode, timeout=1)
+        admitted.append(name)
+        if name != 'first':
+            slot.release()
+        return slot
+
+    async def run():
+        running = budget.acquire(transcode=True, timeout=0)
+        budget.acquire(transcode=False, timeout=0)
+        waiters = [asyncio.ensure_future(wait_for_slot(name, transcode))
+                   for name, transcode in (('first', True), ('second', False), ('third', False))]
+        await asyncio.sleep(0)
+        assert budget.stats()['waiting'] == 3
+
+        # the freed transcode slot goes to the first waiter, ahead of the ones that came in after it.
+        running.release()
+        await asyncio.sleep(0.01)
+        assert admitted == ['first']
+        assert budget.stats()['transcoding'] == 1
+
+        (await waiters[0]).release()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(run())
+
+    assert admitted == ['first', 'second', 'third']
+
+
+def test_transcode_waiting_on_its_limit_lets_passthrough_through():
+    budget = FFmpegBudget(max_processes=3, max_transcodes=1, coordinator=None)
+
+    async def run():
+        budget.acquire(transcode=True, timeout=0)
+        transcode = asyncio.ensure_future(budget.admit(transcode=True, timeout=0.05))
+        await asyncio.sleep(0)
+        passthrough = await budget.admit(transcode=False, timeout=0)
+        with pytest.raises(FFmpegBudgetExceededError):
+            await transcode
+        return passthrough
+
+    assert not asyncio.run(run()).transcode
+    assert budget.stats()['waiting'] == 0
+    assert budget.stats()['rejected'] == 1
@@ -0,0 +1,44 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('discord')
+
+from src.cogs.player import GuildSession, Job, Player
+from src.player.load_options import JobOption
+from src.player.session_registry import SessionRegistry
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+def _entry(video_id):
+    return MediaMetadata({'id': video_id, 'title': video_id, 'duration': 60})
+
+
+def test_cleared_queue_drops_its_reservations():
+    guild_sesh = GuildSession()
+    guild_sesh.add_entries([_entry('a')])
+    reservation = guild_sesh.reserve()
+
+    guild_sesh.clear_queue()
+    guild_sesh.add_entries([_entry('b')], reservation)
+
+    assert not guild_sesh.queue
+    assert not guild_sesh.reservations
+    assert not guild_sesh.busy
+
+
+def test_selection_after_clear_adds_nothing():
+    player = Player.__new__(Player)
+    player._sessions = SessionRegistry(GuildSession)
+    ctx = SimpleNamespace(guild=SimpleNamespace(id=1))
+    guild_sesh = player._sessions[1]
+
+    async def select_after_clear():
+        job = Job(JobOption.SEARCH_JOB, 'song', ctx)
+        job.reservation = guild_sesh.reserve()
+        guild_sesh.clear_queue()
+        return player._commit_entries(job, [_entry('b')])
+
+    assert asyncio.run(select_after_clear()) == ([], [])
+    assert not guild_sesh.queue
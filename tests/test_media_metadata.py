@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """The urls the test extracted. Nothing is fetched from the network."""
+    urls = []
+
+    def extract(self):
+        urls.append(self.original_url)
+        return {'id': self.id, 'formats': [{'format_id': '251'}]}
+
+    monkeypatch.setattr(MediaMetadata, '_extract_full_info', extract)
+    return urls
+
+
+def test_heavy_fields_do_not_extract(extractions):
+    media = MediaMetadata({'id': 'abc', 'title': 'Song', 'webpage_url': 'https://www.youtube.com/watch?v=abc',
+                           'formats': [{'format_id': '251'}], 'uploader': 'Someone'})
+
+    assert media.formats is None
+    assert media.uploader == 'Someone'
+    assert not extractions
+    with pytest.raises(AttributeError):
+        media.unknown_field
+
+
+def test_fetch_full_info_extracts_once(extractions):
+    media = MediaMetadata({'id': 'abc', 'title': 'Song', 'webpage_url': 'https://www.youtube.com/watch?v=abc'})
+
+    info = asyncio.run(media.fetch_full_info())
+
+    assert info['formats'] == [{'format_id': '251'}]
+    assert extractions == ['https://www.youtube.com/watch?v=abc']
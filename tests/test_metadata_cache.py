@@ -0,0 +1,45 @@
+import threading
+import time
+
+from src.player.youtube.metadata_cache import MetadataCache
+
+
+class _SharedLevel:
+    """A shared level that records the threads it is used from."""
+    def __init__(self):
+        self.values = {}
+        self.threads = []
+        self.written = threading.Event()
+
+    def cache_get(self, key):
+        self.threads.append(threading.current_thread().name)
+        return self.values.get(key)
+
+    def cache_put(self, key, value, expires_at):
+        self.threads.append(threading.current_thread().name)
+        self.values[key] = (value, expires_at)
+        self.written.set()
+
+
+def test_lookup_without_the_shared_level_does_not_query_it():
+    shared = _SharedLevel()
+    shared.values['url:a'] = ('cached', time.time() + 60)
+    cache = MetadataCache(shared=shared)
+
+    assert cache.get('url:a', shared=False) is None
+    assert not shared.threads
+    assert cache.stats()['misses'] == 0
+
+    assert cache.get('url:a') == 'cached'
+    assert cache.get('url:a', shared=False) == 'cached'
+
+
+def test_put_writes_the_shared_level_on_the_writer_thread():
+    shared = _SharedLevel()
+    cache = MetadataCache(shared=shared)
+
+    cache.put('url:a', 'value')
+
+    assert cache.get('url:a', shared=False) == 'value'
+    assert shared.written.wait(5)
+    assert shared.threads == [name for name in shared.threads if name.startswith('metadata-cache-writer')]
@@ -0,0 +1,230 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+import pytest
+
+discord = pytest.importorskip('discord')
+
+from src.cogs import player as player_module
+from src.cogs.player import GuildSession, Player
+from src.player.ffmpeg_budget import FFmpegBudget
+from src.player.load_options import LoopOption
+from src.player.youtube.stream_resolver import StreamUnavailableError
+from src.player.session_registry import SessionRegistry
+from src.player.youtube.media_metadata import MediaMetadata
+
+
+class _FakeSource(discord.AudioSource):
+    def __init__(self):
+        self.cleaned_up = False
+
+    def read(self) -> bytes:
+        return b''
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+class _FakeVoice:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.playing = []
+
+    def is_playing(self):
+        return bool(self.playing)
+
+    def is_paused(self):
+        return False
+
+    def play(self, source, after=None):
+        if self.fail:
+            raise discord.errors.ClientException('Not connected to voice.')
+        self.playing.append(source)
+
+    async def disconnect(self):
+        pass
+
+
+class _FakeContext:
+    def __init__(self):
+        self.guild = SimpleNamespace(id=1)
+        self.sent = []
+
+    def typing(self):
+        return contextlib.AsyncExitStack()
+
+    async def send(self, message, **kwargs):
+        self.sent.append(message)
+
+
+def _entry(video_id):
+    return MediaMetadata({'id': video_id, 'title': video_id, 'duration': 60})
+
+
+@pytest.fixture
+def player(monkeypatch):
+    """A Player whose streams resolve at once, after yielding to the event loop, and whose sources are fakes."""
+    player = Player.__new__(Player)
+    player._sessions = SessionRegistry(GuildSession)
+    player.sources = []
+
+    async def resolve_stream(song, guild_id):
+        await asyncio.sleep(0)
+
+    async def get_admitted_player(ctx):
+        return player.get_players(ctx)
+
+    async def prepare_next(ctx):
+        pass
+
+    def get_players(ctx, job=None, wait=0):
+        source = _FakeSource()
+        player.sources.append(source)
+        player._sessions[ctx.guild.id].player = source
+        return source
+
+    monkeypatch.setattr(player, '_resolve_stream', resolve_stream)
+    monkeypatch.setattr(player, '_get_admitted_player', get_admitted_player)
+    monkeypatch.setattr(player, 'prepare_next', prepare_next)
+    monkeypatch.setattr(player, 'get_players', get_players)
+    monkeypatch.setattr(player, '_mark_dirty', lambda ctx: None)
+    return player
+
+
+def test_concurrent_play_song_starts_one_song(player):
+    ctx, voice = _FakeContext(), _FakeVoice()
+    guild_sesh = player._sessions[1]
+    guild_sesh.add_entries([_entry('a'), _entry('b')])
+
+    async def play_twice():
+        await asyncio.gather(player.play_song(ctx, voice), player.play_song(ctx, voice))
+
+    asyncio.run(play_twice())
+
+    assert len(voice.playing) == 1
+    assert guild_sesh.cur_song.id == 'a'
+    assert [song.id for song in guild_sesh.queue] == ['b']
+
+
+def test_failed_play_cleans_up_the_source(player):
+    ctx, voice = _FakeContext(), _FakeVoice(fail=True)
+    guild_sesh = player._sessions[1]
+    guild_sesh.add_entries([_entry('a')])
+
+    with pytest.raises(discord.errors.ClientException):
+        asyncio.run(player.play_song(ctx, voice))
+
+    assert player.sources[0].cleaned_up
+    assert guild_sesh.player is None
+    assert guild_sesh.cur_song is None
+    assert [song.id for song in guild_sesh.queue] == ['a']
+
+
+def test_source_the_voice_client_does_not_take_is_cleaned_up(player):
+    guild_sesh = player._sessions[1]
+    source = guild_sesh.player = _FakeSource()
+
+    assert not Player._hand_over(None, guild_sesh, source, after=None)
+    assert source.cleaned_up
+    assert guild_sesh.player is None
+
+    source = guild_sesh.player = _FakeSource()
+    assert not Player._hand_over(_FakeVoice(fail=True), guild_sesh, source, after=None)
+    assert source.cleaned_up
+
+    source = guild_sesh.player = _FakeSource()
+    assert Player._hand_over(_FakeVoice(), guild_sesh, source, after=None)
+    assert not source.cleaned_up
+    assert guild_sesh.player is source
+
+
+def test_looped_song_that_cannot_be_reopened_moves_the_queue_on(player, monkeypatch):
+    guild_sesh = player._sessions[1]
+    guild_sesh.cur_song = _entry('a')
+    guild_sesh.loop = LoopOption.LOOP
+    guild_sesh.add_entries([_entry('b')])
+    unavailable = [True]
+
+    def get_players(ctx, job=None, wait=0):
+        if unavailable.pop() if unavailable else False:
+            raise StreamUnavailableError("gone")
+        source = guild_sesh.player = _FakeSource()
+        return source
+
+    monkeypatch.setattr(player, 'get_players', get_players)
+    monkeypatch.setattr(player, '_notify_if_saturated', lambda ctx: None)
+    monkeypatch.setattr(player, '_schedule_prepare_next', lambda ctx: None)
+    monkeypatch.setattr(player, '_sync_downloads', lambda ctx: None)
+    player._unloading = False
+    player._leaving = set()
+
+    async def play_next():
+        loop = asyncio.get_running_loop()
+        ctx = _FakeContext()
+        ctx.bot = SimpleNamespace(loop=loop)
+        ctx.voice_client = _FakeVoice()
+        player._bot = SimpleNamespace(loop=loop, voice_clients=[])
+        player.play_next(ctx)
+        await asyncio.sleep(0)
+        return ctx
+
+    ctx = asyncio.run(play_next())
+
+    assert guild_sesh.loop is LoopOption.NO_LOOP
+    assert guild_sesh.cur_song.id == 'b'
+    assert len(ctx.voice_client.playing) == 1
+    assert any('Could not play a' in message for message in ctx.sent)
+
+
+def test_progressive_reopen_never_resolves_a_stream(monkeypatch):
+    song = _entry('a')
+
+    with pytest.raises(StreamUnavailableError):
+        Player._reopen_progressive(song, True, 12.0)
+
+
+def test_only_the_song_still_playing_is_kept_held(player):
+    guild_sesh = player._sessions[1]
+    guild_sesh.cur_song = _entry('a')
+    voice = _FakeVoice()
+    voice.guild = SimpleNamespace(id=1)
+    player._bot = SimpleNamespace(voice_clients=[voice])
+
+    assert player._playing_media(1, guild_sesh) == ()
+
+    voice.playing.append(_FakeSource())
+    assert player._playing_media(1, guild_sesh) == ('a',)
+    assert player._playing_media(2, guild_sesh) == ()
+
+
+def test_song_is_admitted_for_the_slot_its_source_needs(player, monkeypatch):
+    budget = FFmpegBudget(max_processes=2, max_transcodes=1, coordinator=None)
+    monkeypatch.setattr(player_module, 'FFMPEG_BUDGET', budget)
+    guild_sesh = player._sessions[1]
+    guild_sesh.cur_song = MediaMetadata({'id': 'a', 'title': 'a', 'acodec': 'mp4a.40.2', 'ext': 'm4a'})
+    slots = []
+
+    def get_players(ctx, job=None, wait=0, slot=None):
+        slots.append(slot)
+        return _FakeSource()
+
+    monkeypatch.setattr(player, 'get_players', get_players)
+
+    asyncio.run(Player._get_admitted_player(player, _FakeContext()))
+
+    assert slots[0].transcode
+    assert budget.stats()['transcoding'] == 1
+
+
+def test_resume_restarts_a_queue_that_stopped(player, monkeypatch):
+    ctx = _FakeContext()
+    ctx.voice_client = _FakeVoice()
+    player._sessions[1].add_entries([_entry('a')])
+    monkeypatch.setattr(player, 'peek_vc', lambda ctx: True)
+    monkeypatch.setattr(player, '_is_connected', lambda ctx: True)
+
+    asyncio.run(Player.resume.callback(player, ctx))
+
+    assert len(ctx.voice_client.playing) == 1
+    assert player._sessions[1].cur_song.id == 'a'
@@ -0,0 +1,47 @@
+import sqlite3
+
+from src.player.session_store import SNAPSHOT_VERSION, SessionStore
+
+
+def _snapshot(queue, position):
+    return {'version': SNAPSHOT_VERSION, 'cur_song': ['a', 'a', 60, None], 'position': position,
+            'queue': [[video_id, video_id, 60, None] for video_id in queue]}
+
+
+def _store(db_file):
+    store = SessionStore(str(db_file))
+    store.load()
+    return store
+
+
+def _snapshot_rows(db_file):
+    conn = sqlite3.connect(str(db_file))
+    try:
+        return conn.execute('SELECT snapshot FROM guild_sessions').fetchall()
+    finally:
+        conn.close()
+
+
+def test_position_is_saved_without_rewriting_the_queue(tmp_path):
+    db_file = tmp_path / 'sessions.db'
+    store = _store(db_file)
+    store.write({1: _snapshot(['b', 'c'], 1.0)}).result()
+    written = _snapshot_rows(db_file)
+
+    store.write({}, {1: 42.5}).result()
+    store.close()
+
+    assert _snapshot_rows(db_file) == written
+    snapshot = _store(db_file).take(1)
+    assert snapshot['position'] == 42.5
+    assert [entry[0] for entry in snapshot['queue']] == ['b', 'c']
+
+
+def test_deleted_snapshot_drops_its_position(tmp_path):
+    db_file = tmp_path / 'sessions.db'
+    store = _store(db_file)
+    store.write({1: _snapshot(['b'], 3.0)}).result()
+    store.write({1: None}).result()
+    store.close()
+
+    assert _store(db_file).take(1) is None
@@ -0,0 +1,21 @@
+from src.player.youtube.verify_link import route
+
+
+def test_equivalent_links_share_a_cache_key():
+    links = [
+        'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+        'https://youtube.com/watch?v=dQw4w9WgXcQ&ab_channel=RickAstley',
+        'https://youtu.be/dQw4w9WgXcQ?si=abcdefgh12345678',
+        'https://music.youtube.com/watch?v=dQw4w9WgXcQ&feature=share',
+        'https://m.youtube.com/watch?v=dQw4w9WgXcQ',
+    ]
+
+    assert {route(link).cache_key for link in links} == {route(links[0]).cache_key}
+
+
+def test_playlist_opened_at_an_entry_is_keyed_by_its_playlist():
+    playlist = route('https://www.youtube.com/playlist?list=PLabc')
+    at_entry = route('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLabc&index=3')
+
+    assert at_entry.cache_key == playlist.cache_key
+    assert at_entry.cache_key != route('https://youtu.be/dQw4w9WgXcQ').cache_key